@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+# Measures the cost of one memmon tick (sampling every supervised pid)
+# for each available sampler, against the number of processes.  The
+# "processes" are idle ``sleep`` children of this script.
+#
+# python benchmarks/memmon_samplers.py [count ...]
+
+import subprocess
+import sys
+import time
+
+from superlance import samplers
+
+def spawn(count):
+    return [ subprocess.Popen(['sleep', '600']) for i in range(count) ]
+
+def reap(children):
+    for child in children:
+        child.kill()
+        child.wait()
+
+def timeit(sampler, pids, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        sampled = sampler.sample(pids)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    assert len(sampled) == len(pids), (sampler.name, len(sampled))
+    return best
+
+def candidates():
+    result = [samplers.make_sampler('psbatch'), samplers.make_sampler('ps')]
+    if samplers.have_proc():
+        result.insert(0, samplers.make_sampler('proc'))
+    return result
+
+def main(argv=sys.argv):
+    counts = [ int(x) for x in argv[1:] ] or [10, 50, 100, 300]
+    names = [ sampler.name for sampler in candidates() ]
+    print '%8s  %s' % ('procs', '  '.join([ '%12s' % n for n in names ]))
+    for count in counts:
+        children = spawn(count)
+        try:
+            pids = [ child.pid for child in children ]
+            row = [ timeit(sampler, pids) for sampler in candidates() ]
+        finally:
+            reap(children)
+        print '%8d  %s' % (
+            count, '  '.join([ '%10.1fms' % (x * 1000) for x in row ]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+# Measures the mean time of one small XML-RPC call over a new connection
+# per call, over supervisor's SupervisorTransport and over superlance's
+# KeepAliveTransport, against a local HTTP/1.1 XML-RPC server standing in
+# for supervisord.
+#
+# python benchmarks/rpc_transport.py [calls]
+
+import sys
+import threading
+import time
+import xmlrpclib
+from SocketServer import ThreadingMixIn
+from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+
+from supervisor.xmlrpc import SupervisorTransport
+
+from superlance.transport import KeepAliveTransport
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+class OneShotTransport(xmlrpclib.Transport):
+    def request(self, host, handler, request_body, verbose=0):
+        try:
+            return xmlrpclib.Transport.request(self, host, handler,
+                                               request_body, verbose)
+        finally:
+            self.close()
+
+def serve():
+    server = Server(('127.0.0.1', 0), RequestHandler, logRequests=False)
+    server.register_function(lambda: 'RUNNING', 'getState')
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+def candidates(url):
+    return [
+        ('oneshot', OneShotTransport()),
+        ('supervisor', SupervisorTransport('', '', url)),
+        ('keepalive', KeepAliveTransport('', '', url)),
+        ]
+
+def timeit(url, transport, calls):
+    proxy = xmlrpclib.ServerProxy(url, transport)
+    start = time.time()
+    for i in range(calls):
+        assert proxy.getState() == 'RUNNING'
+    elapsed = time.time() - start
+    transport.close()
+    return elapsed / calls
+
+def main(argv=sys.argv):
+    calls = int((argv[1:] or [1000])[0])
+    server = serve()
+    url = 'http://127.0.0.1:%d/RPC2' % server.server_address[1]
+    try:
+        for name, transport in candidates(url):
+            elapsed = timeit(url, transport, calls)
+            print '%12s  %8.3fms' % (name, elapsed * 1000)
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Adaptive sampling for memmon: each process is measured again after an
+interval derived from its headroom (how far below its limit it is) and its
+recent growth rate, so processes close to their limit are measured often
+and idle ones rarely.
+"""
+
+import heapq
+
+class AdaptiveScheduler:
+    """ A priority queue of (when due, key).  ``budget`` caps how many keys
+    due() hands out per call; the rest stay due and go first next time.
+
+    A key's interval is ``maxinterval`` scaled by its headroom as a fraction
+    of its limit, and, if it is growing, at most ``safety`` times its
+    projected time to reach the limit; never less than ``mininterval``. """
+
+    def __init__(self, maxinterval, mininterval=0, budget=None, safety=0.25):
+        self.maxinterval = maxinterval
+        self.mininterval = mininterval
+        self.budget = budget
+        self.safety = safety
+        self.heap = []
+        self.next = {} # key -> when due; heap entries not matching are stale
+        self.last = {} # key -> (when, value) of the last measurement
+
+    def due(self, keys, now):
+        wanted = dict.fromkeys(keys)
+        # keys we have never seen are due right away
+        for key in keys:
+            if key not in self.next:
+                self.schedule(key, now)
+        for key in self.next.keys():
+            if key not in wanted:
+                del self.next[key]
+                self.last.pop(key, None)
+
+        result = []
+        taken = {}
+        while self.heap and self.heap[0][0] <= now:
+            if self.budget is not None and len(result) >= self.budget:
+                break
+            when, key = heapq.heappop(self.heap)
+            if self.next.get(key) != when or key in taken:
+                continue # stale, or a duplicate
+            taken[key] = True
+            result.append(key)
+        # due keys stay due until update() reschedules them
+        for key in result:
+            heapq.heappush(self.heap, (self.next[key], key))
+        if len(self.heap) > 2 * len(self.next) + 16:
+            self.compact()
+        return result
+
+    def schedule(self, key, when):
+        self.next[key] = when
+        heapq.heappush(self.heap, (when, key))
+
+    def compact(self):
+        self.heap = [ (when, key) for key, when in self.next.items() ]
+        heapq.heapify(self.heap)
+
+    def interval(self, key, now, value, limit):
+        headroom = limit - value
+        if headroom <= 0 or limit <= 0:
+            return self.mininterval
+        interval = self.maxinterval * min(float(headroom) / limit, 1.0)
+        last = self.last.get(key)
+        if last is not None and now > last[0]:
+            rate = (value - last[1]) / (now - last[0])
+            if rate > 0:
+                interval = min(interval, self.safety * headroom / rate)
+        return max(interval, self.mininterval)
+
+    def update(self, key, now, value, limit):
+        """ Record a measurement of ``key`` and schedule the next one;
+        returns the interval chosen. """
+        interval = self.interval(key, now, value, limit)
+        self.last[key] = (now, value)
+        self.schedule(key, now + interval)
+        return interval
@@ -0,0 +1,97 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Response body checks for httpok which read the body a chunk at a time,
+without keeping more of it than a chunk and a little overlap, and at
+most ``maxbytes`` of it.  Once the pattern is found, the rest of the
+body is read and discarded rather than searched, so that the connection
+can be used again.
+
+A literal pattern is found even when it straddles two chunks.  A regular
+expression is searched for in a window of the current chunk and the last
+``overlap`` bytes before it, so a match straddling two chunks is found if
+it is at most ``overlap`` bytes long.
+"""
+
+import re
+
+CHUNKSIZE = 8192
+MAXBYTES = 1024 * 1024
+OVERLAP = 1024
+
+def drain(res, maxbytes=MAXBYTES, chunksize=CHUNKSIZE):
+    """ Read and discard a response body; returns True if it was read to
+    its end (so the connection may be used again) before maxbytes """
+    read = 0
+    while read <= maxbytes:
+        chunk = res.read(chunksize)
+        if not chunk:
+            return True
+        read += len(chunk)
+    return False
+
+class BodyMatcher:
+    """ Checks that a body contains ``pattern`` (a string, or a regular
+    expression if ``regex`` is true), or with ``negate`` that it
+    doesn't. """
+
+    def __init__(self, pattern, regex=False, negate=False, maxbytes=MAXBYTES,
+                 chunksize=CHUNKSIZE, overlap=OVERLAP):
+        self.pattern = pattern
+        self.regex = regex
+        self.negate = negate
+        self.maxbytes = maxbytes
+        self.chunksize = chunksize
+        if regex:
+            try:
+                self.search = re.compile(pattern).search
+            except re.error, why:
+                raise ValueError('Bad regular expression %r: %s' % (pattern,
+                                                                   why))
+            self.overlap = overlap
+        else:
+            self.search = lambda text: pattern in text
+            self.overlap = max(len(pattern) - 1, 0)
+
+    def scan(self, res):
+        """ Read ``res`` until the body ends or maxbytes have been read,
+        searching it until the pattern is found; returns (found,
+        complete), where complete is True if the body was read to its
+        end. """
+        tail = ''
+        read = 0
+        while read < self.maxbytes:
+            chunk = res.read(min(self.chunksize, self.maxbytes - read))
+            if not chunk:
+                return False, True
+            read += len(chunk)
+            text = tail + chunk
+            if self.search(text):
+                return True, drain(res, self.maxbytes - read, self.chunksize)
+            if self.overlap:
+                tail = text[-self.overlap:]
+        # the body may or may not end here
+        return False, not res.read(1)
+
+    def passes(self, found):
+        return found != self.negate
+
+    def __str__(self):
+        if self.regex:
+            what = 'match %r' % self.pattern
+        else:
+            what = 'contain %r' % self.pattern
+        if self.negate:
+            return 'must not %s' % what
+        return 'must %s' % what
@@ -0,0 +1,291 @@
+#!/usr/bin/env python -u
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+
+# A event listener meant to be subscribed to TICK_60 (or TICK_5)
+# events, which restarts any processes that are children of
+# supervisord that keep using "too much" CPU (busy loops, runaway
+# regular expressions).  CPU usage is read from /proc, so this is Linux
+# only.
+
+# A supervisor config snippet that tells supervisor to use this script
+# as a listener is below.
+#
+# [eventlistener:cpumon]
+# command=python cpumon.py [options]
+# events=TICK_60,PROCESS_STATE
+
+doc = """\
+cpumon.py [-p processname=percent]  [-g groupname=percent]
+          [-a percent] [-s sendmail] [-m email_address] [-n samples]
+          [-T] [-R workers] [-i seconds] [-e [host:]port]
+          [--statsd=[host:]port] [--dogstatsd] [--resync=seconds]
+
+Options:
+
+-p -- specify a process_name=percent pair.  Restart the supervisor
+      process named 'process_name' when it keeps using more than percent
+      of a CPU.  If this process is in a group, it can be specified using
+      the 'group_name:process_name' syntax.  The name may be a glob
+      pattern (e.g. worker_*=90).
+
+-g -- specify a group_name=percent pair.  Restart any process in this group
+      when it keeps using more than percent of a CPU.  The name may be a
+      glob pattern.
+
+-a -- specify a global percent.  Restart any child of the supervisord
+      under which this runs if it keeps using more than percent of a CPU.
+
+-s -- the sendmail command to use to send email
+      (e.g. "/usr/sbin/sendmail -t -i").  Must be a command which accepts
+      header and message data on stdin and sends mail.
+      Default is "/usr/sbin/sendmail -t -i".
+
+-m -- specify an email address.  The script will send mail to this
+      address when any process is restarted.  If no email address is
+      specified, email will not be sent.
+
+-n -- the number of consecutive samples a process must be over its limit
+      before it is restarted.  Defaults to 3.
+
+-T -- measure whole process trees: the CPU usage of a supervised process
+      is the sum over the process and all of its descendants.
+
+-R -- restart processes in this many background worker threads instead
+      of in the event handler.  The default, 0, restarts processes
+      synchronously.
+
+-i -- measure processes every this many seconds (e.g. 5) in a background
+      thread, rather than once per TICK event.
+
+-e -- serve the latest measurements, limits and restart counts in the
+      OpenMetrics (Prometheus) text format at http://host:port/metrics.
+
+--statsd -- send measurements (cpumon.cpu.group.process gauges) and
+      restart counts to a StatsD server over UDP, as memmon does, along
+      with the cpumon.rpc timers and cpumon.rpc_reconnects counts of its
+      XML-RPC calls to supervisord.
+
+--dogstatsd -- with --statsd, send the group and process name as
+      DogStatsD tags rather than as part of the metric name.
+
+--resync -- with PROCESS_STATE events subscribed to, the process list is
+      kept current from those events and fetched from supervisord afresh
+      only every this many seconds (default 60).  Without them, it is
+      fetched on every tick.
+
+CPU usage is measured between two samples (two TICK events, or two -i
+intervals), as a percentage of one CPU: a process keeping two CPUs busy
+uses 200 percent.  A process is first measured on its second sample.
+
+The -p and -g options may be specified more than once, and the same
+precedence as for memmon applies: exactly one limit applies to each
+process.  A percent may be given with or without a trailing '%'.
+
+A sample invocation:
+
+cpumon.py -p program1=90 -g thegroup=150 -a 95 -n 5 -m chrism@plope.com
+"""
+
+import os
+import sys
+
+from superlance import exporter
+from superlance import samplers
+from superlance import statsd
+from superlance import transport
+from superlance.memmon import Memmon
+from superlance.memmon import parse_address
+from superlance.memmon import parse_number
+
+def usage():
+    print doc
+    sys.exit(255)
+
+class Cpumon(Memmon):
+    """ memmon's loop, rules and restart path, applied to CPU usage as
+    measured by samplers.CPUSampler. """
+    progname = 'cpumon'
+    metric_name = 'process_cpu_percent'
+    limit_name = 'process_limit_percent'
+
+    def __init__(self, programs, groups, any, sendmail, email, rpc,
+                 sampler=None, tree=False, samples=3, workers=0,
+                 interval=None, exporter=None, stats=None, resync=60):
+        if sampler is None:
+            sampler = samplers.CPUSampler()
+        Memmon.__init__(self, programs, groups, any, sendmail, email, rpc,
+                        sampler, tree, None, workers, interval, None,
+                        exporter, stats, resync)
+        self.samples = samples
+        self.over = {} # process name -> consecutive samples over the limit
+
+    def watch(self, infos):
+        watched = Memmon.watch(self, infos)
+        names = dict([ ('%s:%s' % (info['group'], info['name']), 1)
+                       for info, limit in watched ])
+        # with -i, check() may drop a name from the sampling thread
+        # meanwhile
+        for name in self.over.keys():
+            if name not in names:
+                self.over.pop(name, None)
+        return watched
+
+    def check(self, name, cpu, limit, now, verbose=True):
+        """ The reason to restart the process, or None """
+        if cpu <= limit:
+            self.over.pop(name, None)
+            return None
+        count = self.over.get(name, 0) + 1
+        if count < self.samples:
+            self.over[name] = count
+            if verbose:
+                self.stderr.write('CPU of %s over its limit of %s%% for %d '
+                                  'of %d samples\n' % (name, limit, count,
+                                                       self.samples))
+            return None
+        self.over.pop(name, None)
+        return ('its CPU usage was over its limit of %s%% for %d '
+                'consecutive samples (%s%% when last measured)' % (
+                limit, count, cpu))
+
+def parse_namepercent(option, value):
+    try:
+        name, percent = value.split('=')
+    except ValueError:
+        print 'Unparseable value %r for %r' % (value, option)
+        usage()
+    return name, parse_percent(option, percent)
+
+def parse_percent(option, value):
+    if value.endswith('%'):
+        value = value[:-1]
+    percent = parse_number(option, value, float)
+    if percent <= 0:
+        print 'A percentage for %r must be positive' % option
+        usage()
+    return percent
+
+def main():
+    import getopt
+    short_args="hp:g:a:s:m:n:TR:i:e:"
+    long_args=[
+        "help",
+        "program=",
+        "group=",
+        "any=",
+        "sendmail_program=",
+        "email=",
+        "samples=",
+        "tree",
+        "workers=",
+        "interval=",
+        "metrics=",
+        "statsd=",
+        "dogstatsd",
+        "resync=",
+        ]
+    arguments = sys.argv[1:]
+    if not arguments:
+        usage()
+    try:
+        opts, args=getopt.getopt(arguments, short_args, long_args)
+    except:
+        usage()
+
+    programs = {}
+    groups = {}
+    any = None
+    sendmail = '/usr/sbin/sendmail -t -i'
+    email = None
+    samples = 3
+    tree = False
+    workers = 0
+    interval = None
+    metrics = None
+    statsd_address = None
+    dogstatsd = False
+    resync = 60
+
+    for option, value in opts:
+
+        if option in ('-h', '--help'):
+            usage()
+
+        if option in ('-p', '--program'):
+            name, percent = parse_namepercent(option, value)
+            programs[name] = percent
+
+        if option in ('-g', '--group'):
+            name, percent = parse_namepercent(option, value)
+            groups[name] = percent
+
+        if option in ('-a', '--any'):
+            any = parse_percent(option, value)
+
+        if option in ('-s', '--sendmail_program'):
+            sendmail = value
+
+        if option in ('-m', '--email'):
+            email = value
+
+        if option in ('-n', '--samples'):
+            samples = parse_number(option, value, int)
+            if samples < 1:
+                print 'At least 1 sample is needed for %r' % option
+                usage()
+
+        if option in ('-T', '--tree'):
+            tree = True
+
+        if option in ('-R', '--workers'):
+            workers = parse_number(option, value, int)
+
+        if option in ('-i', '--interval'):
+            interval = parse_number(option, value, float)
+
+        if option in ('-e', '--metrics'):
+            metrics = parse_address(option, value)
+
+        if option == '--statsd':
+            statsd_address = parse_address(option, value, statsd)
+
+        if option == '--dogstatsd':
+            dogstatsd = True
+
+        if option == '--resync':
+            resync = parse_number(option, value, float)
+
+    if not samplers.have_proc():
+        print 'cpumon reads CPU usage from /proc and requires Linux'
+        usage()
+
+    metrics_exporter = None
+    if metrics is not None:
+        metrics_exporter = exporter.MetricsExporter(*metrics)
+        metrics_exporter.start()
+
+    stats = None
+    if statsd_address is not None:
+        host, port = statsd_address
+        stats = statsd.StatsClient(host, port, 'cpumon', dogstatsd)
+
+    rpc = transport.getRPCInterface(os.environ, stats)
+    cpumon = Cpumon(programs, groups, any, sendmail, email, rpc, None, tree,
+                    samples, workers, interval, metrics_exporter, stats,
+                    resync)
+    cpumon.runforever()
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,7 @@
 
 doc = """\
 crashmail.py [-p processname] [-a] [-o string] [-m mail_address]
-             [-s sendmail] URL
+             [-s sendmail] [--statsd=[host:]port] [--dogstatsd] URL
 
 Options:
 
@@ -50,6 +50,12 @@ Options:
       address when crashmail detects a process crash.  If no email
       address is specified, email will not be sent.
 
+--statsd -- count crashes (crashmail.crashes) on a StatsD server over
+      UDP.  The host defaults to 127.0.0.1.
+
+--dogstatsd -- with --statsd, send the group and process name as
+      DogStatsD tags rather than as part of the metric name.
+
 The -p option may be specified more than once, allowing for
 specification of multiple processes.  Specifying -a overrides any
 selection of -p.
@@ -65,19 +71,23 @@ import sys
 
 from supervisor import childutils
 
+from superlance import statsd
+
 def usage():
     print doc
     sys.exit(255)
 
 class CrashMail:
 
-    def __init__(self, programs, any, email, sendmail, optionalheader):
+    def __init__(self, programs, any, email, sendmail, optionalheader,
+                 stats=None):
 
         self.programs = programs
         self.any = any
         self.email = email
         self.sendmail = sendmail
         self.optionalheader = optionalheader
+        self.stats = stats
         self.stdin = sys.stdin
         self.stdout = sys.stdout
         self.stderr = sys.stderr
@@ -119,6 +129,12 @@ class CrashMail:
             self.stderr.write('unexpected exit, mailing\n')
             self.stderr.flush()
 
+            if self.stats is not None:
+                self.stats.incr('crashes', tags=[
+                    ('group', pheaders['groupname']),
+                    ('name', pheaders['processname'])])
+                self.stats.flush()
+
             self.mail(self.email, subject, msg)
 
             childutils.listener.ok(self.stdout)
@@ -146,6 +162,8 @@ def main(argv=sys.argv):
         "optionalheader="
         "sendmail_program=",
         "email=",
+        "statsd=",
+        "dogstatsd",
         ]
     arguments = argv[1:]
     try:
@@ -161,6 +179,8 @@ def main(argv=sys.argv):
     status = '200'
     inbody = None
     optionalheader = None
+    stats = None
+    dogstatsd = False
 
     for option, value in opts:
 
@@ -182,6 +202,16 @@ def main(argv=sys.argv):
         if option in ('-o', '--optionalheader'):
             optionalheader = value
 
+        if option == '--statsd':
+            try:
+                stats = statsd.parse_address(value)
+            except ValueError, why:
+                print why
+                usage()
+
+        if option == '--dogstatsd':
+            dogstatsd = True
+
     url = arguments[-1]
 
     if not 'SUPERVISOR_SERVER_URL' in os.environ:
@@ -190,7 +220,11 @@ def main(argv=sys.argv):
         sys.stderr.flush()
         return
         
-    prog = CrashMail(programs, any, email, sendmail, optionalheader)
+    if stats is not None:
+        host, port = stats
+        stats = statsd.StatsClient(host, port, 'crashmail', dogstatsd)
+
+    prog = CrashMail(programs, any, email, sendmail, optionalheader, stats)
     prog.runforever()
 
 if __name__ == '__main__':
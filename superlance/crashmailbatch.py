@@ -29,6 +29,7 @@ crashmailbatch.py [--interval=<batch interval in minutes>]
         [--toEmail=<email address>]
         [--fromEmail=<email address>]
         [--subject=<email subject>]
+        [--statsd=<[host:]port>] [--dogstatsd]
 
 Options:
 
@@ -42,6 +43,12 @@ Options:
 
 --subject - the email subject line
 
+--statsd - count the events reported (crashmailbatch.process_state_exited) on a StatsD
+           server over UDP
+
+--dogstatsd - with --statsd, send the group and process name as DogStatsD
+              tags
+
 A sample invocation:
 
 crashmailbatch.py --toEmail="you@bar.com" --fromEmail="me@bar.com"
@@ -0,0 +1,112 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+An embedded HTTP endpoint serving metrics in the OpenMetrics (Prometheus)
+text format.  The listener renders the body once per sample cycle with
+render() and hands it to update(); scrapes are served from those cached
+bytes and never trigger sampling or RPC calls.
+"""
+
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+def escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return '%d' % value
+
+def render(families):
+    """ Render a list of (name, type, help, samples) metric families, where
+    samples is a list of (labels, value) and labels a list of (name, value)
+    pairs.  Counter samples get the mandatory _total suffix. """
+    lines = []
+    for name, kind, help, samples in families:
+        lines.append('# TYPE %s %s' % (name, kind))
+        lines.append('# HELP %s %s' % (name, help))
+        if kind == 'counter':
+            samplename = name + '_total'
+        else:
+            samplename = name
+        for labels, value in samples:
+            if labels:
+                labels = '{%s}' % ','.join(
+                    [ '%s="%s"' % (k, escape(v)) for k, v in labels ])
+            else:
+                labels = ''
+            lines.append('%s%s %s' % (samplename, labels,
+                                      format_value(value)))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.exporter.body
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # stderr belongs to the listener's own log
+        pass
+
+class MetricsExporter:
+    """ Serves the latest body handed to update() at /metrics from a
+    background thread. """
+
+    def __init__(self, host='', port=9100):
+        self.host = host
+        self.port = port
+        self.body = '# EOF\n'
+        self.server = None
+        self.thread = None
+
+    def update(self, body):
+        # a single reference assignment; the serving thread sees either
+        # the old body or the new one, never a mix
+        self.body = body
+
+    def start(self):
+        self.server = HTTPServer((self.host, self.port), MetricsHandler)
+        self.server.exporter = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def parse_address(value):
+    """ Parse '[host:]port' into a (host, port) pair """
+    host, sep, port = value.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('Bad address %r, expected [host:]port' % value)
+    return host, port
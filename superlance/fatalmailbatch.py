@@ -29,6 +29,7 @@ fatalmailbatch.py [--interval=<batch interval in minutes>]
         [--toEmail=<email address>]
         [--fromEmail=<email address>]
         [--subject=<email subject>]
+        [--statsd=<[host:]port>] [--dogstatsd]
 
 Options:
 
@@ -42,6 +43,12 @@ Options:
 
 --subject - the email subject line
 
+--statsd - count the events reported (fatalmailbatch.process_state_fatal) on a StatsD
+           server over UDP
+
+--dogstatsd - with --statsd, send the group and process name as DogStatsD
+              tags
+
 A sample invocation:
 
 fatalmailbatch.py --toEmail="you@bar.com" --fromEmail="me@bar.com"
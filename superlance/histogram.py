@@ -0,0 +1,103 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+A rolling latency histogram for httpok.  Latencies are counted in fixed
+log-scale buckets, each a quarter of a power of two (about 19%) wider
+than the one before, from 1ms up to about 17 minutes; only the bucket
+of each of the last ``window`` latencies is remembered, in a ring of
+bytes.  Percentiles are estimated as the geometric middle of their
+bucket, so they are accurate to within about 10%.
+"""
+
+import bisect
+import math
+from array import array
+
+# upper bounds (in milliseconds) of the buckets; latencies over the last
+# bound go in one more, overflow bucket
+BOUNDS = [ 2 ** (i / 4.0) for i in range(81) ]
+
+def bucket(ms):
+    return bisect.bisect_left(BOUNDS, ms)
+
+def estimate(i):
+    """ A latency representative of bucket i """
+    if i == 0:
+        return BOUNDS[0]
+    if i == len(BOUNDS):
+        return BOUNDS[-1]
+    return math.sqrt(BOUNDS[i - 1] * BOUNDS[i])
+
+def format_ms(ms):
+    if ms < 1000:
+        return '%.3gms' % ms
+    return '%.1fs' % (ms / 1000.0)
+
+class LatencyHistogram:
+    def __init__(self, window=20):
+        if window < 1:
+            raise ValueError('A window needs room for at least one latency')
+        self.window = window
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.ring = array('B', [0]) * window # bucket of each latency
+        self.count = 0
+        self.next = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, ms):
+        if self.count == self.window:
+            self.counts[self.ring[self.next]] -= 1
+        else:
+            self.count += 1
+        i = bucket(ms)
+        self.counts[i] += 1
+        self.ring[self.next] = i
+        self.next = (self.next + 1) % self.window
+
+    def clear(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.next = 0
+
+    def percentile(self, p):
+        """ The estimated p-th percentile in milliseconds, or None if no
+        latencies were added """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(p / 100.0 * self.count)))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return estimate(i)
+
+    def report(self, percentiles=(50, 95, 99)):
+        """ One line: the percentiles, then the count of each bucket in
+        use, e.g. 'p50 11ms, p99 90ms of 20; <=11.3ms: 19, <=97.5ms: 1' """
+        if not self.count:
+            return 'no latencies'
+        summary = ', '.join([ 'p%g %s' % (p, format_ms(self.percentile(p)))
+                              for p in percentiles ])
+        buckets = []
+        for i, count in enumerate(self.counts):
+            if not count:
+                continue
+            if i == len(BOUNDS):
+                label = '>%s' % format_ms(BOUNDS[-1])
+            else:
+                label = '<=%s' % format_ms(BOUNDS[i])
+            buckets.append('%s: %d' % (label, count))
+        return '%s of %d; %s' % (summary, self.count, ', '.join(buckets))
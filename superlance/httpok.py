@@ -22,11 +22,18 @@
 #
 # [eventlistener:httpok]
 # command=python -u /bin/httpok http://localhost:8080/tasty/service
-# events=TICK_60
+# events=TICK_60,PROCESS_STATE
 
 doc = """\
 httpok.py [-p processname] [-a] [-g] [-t timeout] [-c status_code] [-b inbody]
-          [-m mail_address] [-s sendmail] URL
+          [-m mail_address] [-s sendmail] [--statsd=[host:]port]
+          [--dogstatsd] [--resync=seconds] [-f config_file]
+          [--deadline=seconds] [--fresh] [-l milliseconds]
+          [--percentile=percent] [--window=checks] [--failures=checks]
+          [--grace=seconds] [--max-grace=seconds] [-r] [-N]
+          [--max-body=bytes] [--dns-ttl=seconds] [--insecure]
+          [--cafile=path] [--cert-days=days] [--rolling=processes]
+          [--recovery=seconds] [URL]
 
 Options:
 
@@ -65,7 +72,18 @@ Options:
       from the GET request.  If this string is not present in the
       response, the processes in the RUNNING state specified by -p
       or -a will be restarted.  The default is to ignore the
-      body.
+      body.  The body is read in chunks, searched until the string is
+      found, and at most --max-body bytes of it are read.
+
+-r -- the -b string is a regular expression, which should match
+      (anywhere in) the body.
+
+-N -- restart the processes if the body DOES contain the -b string (or
+      match the -r regular expression).
+
+--max-body -- read at most this much of the body (default 1MB).  A body
+      in which the -b string wasn't found within this many bytes counts
+      as not containing it.
 
 -s -- the sendmail command to use to send email
       (e.g. "/usr/sbin/sendmail -t -i").  Must be a command which accepts
@@ -82,7 +100,94 @@ Options:
 -E -- not "eager":  do not check URL / emit mail if no process we are
       monitoring is in the RUNNING state.
 
-URL -- The URL to which to issue a GET request.
+--statsd -- send probe latencies (httpok.probe timers, and
+      httpok.probe_resolve, httpok.probe_connect, httpok.probe_handshake
+      and httpok.probe_firstbyte for their phases), failed probes
+      (httpok.probe_failures), restarts (httpok.restarts,
+      httpok.restart_failures), --rolling restarts (httpok.recovery timers
+      and httpok.rolling_aborts), expiring certificates
+      (httpok.cert_expiring), connections made, reused and found closed
+      by the server (httpok.connects, httpok.connection_reuses,
+      httpok.reconnects), as well as XML-RPC calls to supervisord
+      (httpok.rpc timers, per method, and httpok.rpc_reconnects), to a
+      StatsD server over UDP, once per tick.  The host defaults to
+      127.0.0.1.
+
+--dogstatsd -- with --statsd, send the URL and process names as
+      DogStatsD tags rather than as part of the metric name.
+
+--resync -- with PROCESS_STATE events subscribed to, the process list is
+      kept current from those events and fetched from supervisord afresh
+      only every this many seconds (default 60).  Without them, it is
+      fetched on every tick.
+
+-f -- read more URLs, each with the processes to restart when it fails,
+      from an ini-style config file (see below).  All URLs are checked
+      at the same time on each tick.
+
+--deadline -- wait at most this many seconds per tick for all URLs to
+      answer; a URL which hasn't answered by then counts as having timed
+      out.  Defaults to the longest -t / timeout of the URLs.
+
+--fresh -- open a new connection for every check instead of keeping
+      one open to each URL's server from one tick to the next, e.g. when
+      connecting (or the TLS handshake) is what should be checked.
+
+-l -- restart the processes when the URL keeps answering too slowly: when
+      the --percentile of its latencies over the last --window checks
+      is over this many milliseconds.  The latencies are also written to
+      stderr on each tick and included in mail.
+
+--percentile -- the latency percentile checked against -l.  Defaults
+      to 95.
+
+--window -- the number of most recent checks -l applies to.  Latencies
+      are checked once the window is half full, and forgotten when the
+      processes are restarted.  Defaults to 20.
+
+--failures -- restart the processes only after the URL failed this many
+      checks in a row.  Defaults to 1.
+
+--grace -- don't check the URL for this many seconds after restarting
+      its processes, to give them time to come back.  If they don't,
+      each following restart doubles the grace period, up to
+      --max-grace seconds, until the URL passes a check again.
+      Defaults to 0.
+
+--max-grace -- the longest grace period.  Defaults to 3600.
+
+--dns-ttl -- remember the addresses a host name resolves to for this
+      many seconds (default 60; 0 looks them up for every connection).
+
+--insecure -- don't verify the certificates of https URLs.  By default
+      the certificate must be valid, signed by a trusted CA and issued
+      for the URL's host name, or the check fails.
+
+--cafile -- a file of PEM CA certificates to verify https certificates
+      against, instead of the system's trusted certificates.
+
+--cert-days -- warn (on stderr, by mail with -m and as
+      httpok.cert_expiring with --statsd) when the (verified) certificate
+      of an https URL expires in fewer than this many days, once a day
+      per certificate.  The processes aren't restarted for it.
+
+--rolling -- restart the processes this many at a time rather than all at
+      once, checking the URL again after each batch until it passes, and
+      giving up on the remaining processes if it doesn't pass within
+      --recovery seconds.  The time each batch took to recover is
+      included in mail.  Defaults to 0 (all at once).
+
+--recovery -- how long to wait for the URL to pass its check after each
+      batch of a --rolling restart.  Defaults to 60.
+
+URL -- The URL to which to issue a GET request.  May be omitted if -f
+      is given.  A URL with fields in braces, e.g.
+      http://127.0.0.1:{8000+process_num}/health, is a template for
+      programs with numprocs > 1: it is checked for each RUNNING process
+      selected by -p (which may name the program) or -a, with the
+      process's own process_num (the trailing digits of its name), name
+      or group filled in, and only the processes whose URL fails are
+      restarted.
 
 The -p option may be specified more than once, allowing for
 specification of multiple processes.  Specifying -a overrides any
@@ -92,29 +197,464 @@ A sample invocation:
 
 httpok.py -p program1 -p group1:program2 http://localhost:8080/tasty
 
+Each [endpoint:name] section of a -f config file is one URL:
+
+[endpoint:tasty]
+url = http://localhost:8080/tasty
+programs = program1 group1:program2
+; optional; defaults are taken from the command line
+any = false
+timeout = 10
+status = 200
+body = tasty
+eager = true
+fresh = false
+latency = 500
+percentile = 95
+window = 20
+failures = 3
+grace = 60
+maxgrace = 3600
+regex = false
+negate = false
+maxbody = 1MB
+verify = true
+cafile = /etc/ssl/certs/internal-ca.pem
+certdays = 14
+rolling = 2
+recovery = 60
+
 """
 
+import ConfigParser
+import copy
+import httplib
 import os
+import socket
+import ssl
 import sys
+import threading
 import time
 import urlparse
-import xmlrpclib
 
 from supervisor import childutils
+from supervisor.datatypes import boolean
+from supervisor.datatypes import byte_size
 from supervisor.states import ProcessStates
 from supervisor.options import make_namespec
 
+import bodymatch
+import histogram
+import multicall
+import processtable
+import statsd
 import timeoutconn
+import transport
+import urltemplate
 
 def usage():
     print doc
     sys.exit(255)
 
+# timeoutconn's timings of the phases of a probe, and their names in mail
+PHASES = [('resolve', 'resolve'), ('connect', 'connect'),
+          ('handshake', 'TLS handshake'), ('firstbyte', 'first byte')]
+
+DAY = 24 * 60 * 60
+
+class Endpoint:
+    """ A URL to probe and the processes to restart when it doesn't answer
+    as expected.
+
+    The connection to the URL's server is kept open from one probe to the
+    next (unless ``fresh`` is true) and only replaced when it fails or the
+    server closes it.
+
+    A templated URL (see urltemplate) isn't probed itself: each of its
+    processes gets an Endpoint of its own (an instance), which probes the
+    URL expanded for that process and restarts only that process. """
+    def __init__(self, url, programs=(), any=False, timeout=10, status='200',
+                 inbody=None, eager=True, name=None, fresh=False,
+                 latency=None, percentile=95, window=20, failures=1,
+                 grace=0, maxgrace=3600, regex=False, negate=False,
+                 maxbody=bodymatch.MAXBYTES, verify=True, cafile=None,
+                 certdays=None, rolling=0, recovery=60):
+        self.parse(url)
+        self.template = urltemplate.is_template(url)
+        if self.template:
+            urltemplate.check(url)
+        self.instances = {} # namespec -> Endpoint, of a templated URL
+        self.name = name or url
+        self.programs = list(programs)
+        self.any = any
+        self.timeout = timeout
+        self.status = status
+        self.inbody = inbody
+        self.matcher = None
+        if inbody:
+            self.matcher = bodymatch.BodyMatcher(inbody, regex, negate,
+                                                 maxbody)
+        self.maxbody = maxbody
+        self.eager = eager
+        self.fresh = fresh
+        self.latency = latency # limit in ms for the percentile, or None
+        self.percentile = percentile
+        self.failures = failures # consecutive failed checks before acting
+        self.grace = grace       # seconds not checked after a restart
+        self.maxgrace = maxgrace
+        self.certdays = certdays # warn when the certificate expires sooner
+        self.rolling = rolling   # processes restarted at a time, or 0: all
+        self.recovery = recovery # seconds to wait for each batch to recover
+        # one TLS context for all connections to the URL, so the CA
+        # certificates are only loaded once
+        self.context = None
+        if self.scheme == 'https':
+            try:
+                self.context = timeoutconn.make_context(verify, cafile)
+            except (IOError, ssl.SSLError), why:
+                raise ValueError('Could not load CA certificates from %s: '
+                                 '%s' % (cafile, why))
+        self.reset(window)
+
+    def parse(self, url):
+        scheme, hostport, path, query, fragment = urlparse.urlsplit(url)
+        scheme = scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise ValueError('Bad scheme %s' % scheme)
+        if query:
+            path += '?' + query
+        self.url = url
+        self.scheme = scheme
+        self.hostport = hostport
+        self.path = path or '/'
+
+    def reset(self, window):
+        """ Start afresh, with nothing learnt from probing """
+        self.histogram = histogram.LatencyHistogram(window)
+        self.failed = 0          # consecutive failed checks
+        self.restarts = 0        # restarts since the last good check
+        self.resume = 0          # when the grace period ends
+        self.phases = {}         # phase -> seconds, of the last probe
+        self.expires = None      # when the server's certificate expires
+        self.warned = (None, 0)  # expires and time of the last warning
+        self.conn = None
+        # held while probing: a probe abandoned at the tick deadline may
+        # still be using the connection when the next tick comes
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.reuses = 0     # probes which found the connection open
+        self.reconnects = 0 # ... and had to replace it, as it was closed
+        # connects, reuses and reconnects already sent to StatsD
+        self.counted = (0, 0, 0)
+
+    def selects(self, spec):
+        """ Is the process ``spec`` one of ours? """
+        if self.any:
+            return True
+        namespec = make_namespec(spec['group'], spec['name'])
+        for name in (spec['name'], namespec, spec['group']):
+            if name in self.programs:
+                return True
+        return False
+
+    def instance(self, spec):
+        """ The Endpoint of the process ``spec`` of a templated URL """
+        namespec = make_namespec(spec['group'], spec['name'])
+        endpoint = copy.copy(self)
+        endpoint.parse(urltemplate.expand(self.url, spec))
+        endpoint.template = False
+        endpoint.instances = {}
+        endpoint.name = '%s %s' % (self.name, namespec)
+        endpoint.programs = [namespec]
+        endpoint.any = False
+        # only the instances of RUNNING processes are probed
+        endpoint.eager = True
+        endpoint.reset(self.histogram.window)
+        return endpoint
+
+    def expand(self, specs):
+        """ The instances of a templated URL to probe: those of its RUNNING
+        processes among ``specs``.  An instance is kept (with its
+        connection and restart history) for as long as its process exists.
+        """
+        running = []
+        seen = {}
+        for spec in specs:
+            if not self.selects(spec):
+                continue
+            namespec = make_namespec(spec['group'], spec['name'])
+            seen[namespec] = True
+            if namespec not in self.instances:
+                self.instances[namespec] = self.instance(spec)
+            if spec['state'] == ProcessStates.RUNNING:
+                running.append((namespec, self.instances[namespec]))
+        for namespec in self.instances.keys():
+            if namespec not in seen:
+                self.instances.pop(namespec).close()
+        running.sort()
+        return [ endpoint for namespec, endpoint in running ]
+
+    def resting(self, now):
+        """ Are we in the grace period after a restart? """
+        return now < self.resume
+
+    def passed(self):
+        self.failed = 0
+        self.restarts = 0
+
+    def fail(self):
+        """ Count a failed check; True if it is time to restart """
+        self.failed += 1
+        return self.failed >= self.failures
+
+    def restarted(self, now):
+        """ Start a grace period, of ``grace`` seconds after the first
+        restart and twice as long after each restart which didn't make the
+        URL pass its check, up to ``maxgrace``.  Returns its length. """
+        self.failed = 0
+        self.restarts += 1
+        grace = min(self.grace * 2 ** (self.restarts - 1), self.maxgrace)
+        self.resume = now + grace
+        return grace
+
+    def connclass(self):
+        if self.scheme == 'https':
+            return timeoutconn.TimeoutHTTPSConnection
+        return timeoutconn.TimeoutHTTPConnection
+
+    def probe(self, connclass=None):
+        """ GET the URL; returns (status, found, message, seconds taken).
+        status is None if there was no response; found is None if there
+        is no body check, else whether the pattern was found. """
+        if not self.lock.acquire(False):
+            msg = ('error contacting %s:\n\n the previous check is still '
+                   'waiting for an answer' % self.url)
+            return None, None, msg, 0.0
+        try:
+            start = time.time()
+            self.phases = {}
+            try:
+                status, reason, found = self.get(connclass)
+                msg = 'status contacting %s: %s %s' % (self.url, status,
+                                                       reason)
+            except Exception, why:
+                self.close()
+                found = None
+                status = None
+                msg = 'error contacting %s:\n\n %s' % (self.url, why)
+            return status, found, msg, time.time() - start
+        finally:
+            self.lock.release()
+
+    def get(self, connclass=None):
+        reused = self.conn is not None
+        try:
+            return self.request(connclass)
+        except (socket.error, httplib.HTTPException), why:
+            self.close()
+            if not reused or isinstance(why, socket.timeout):
+                raise
+            # most likely the server closed the kept-alive connection
+            # between ticks; that says nothing about its health
+            self.reconnects += 1
+            return self.request(connclass)
+
+    def request(self, connclass=None):
+        if self.conn is None:
+            if connclass is None:
+                connclass = self.connclass()
+            if self.context is None:
+                self.conn = connclass(self.hostport)
+            else:
+                self.conn = connclass(self.hostport, context=self.context)
+            self.conn.timeout = self.timeout
+            self.connects += 1
+        else:
+            self.reuses += 1
+        conn = self.conn
+        try:
+            conn.request('GET', self.path)
+            res = conn.getresponse()
+        finally:
+            self.phases = dict(getattr(conn, 'timings', {}))
+        peercert = getattr(conn, 'peercert', None)
+        if peercert and 'notAfter' in peercert:
+            self.expires = ssl.cert_time_to_seconds(peercert['notAfter'])
+        if self.matcher is None:
+            found = None
+            complete = bodymatch.drain(res, self.maxbody)
+        else:
+            found, complete = self.matcher.scan(res)
+        # the connection can only be used again once the whole body has
+        # been read from it
+        if self.fresh or res.will_close or not complete:
+            self.close()
+        return res.status, res.reason, found
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def report_phases(self):
+        """ e.g. 'resolve 0.1ms, connect 1.2ms, first byte 40ms' """
+        return ', '.join([ '%s %s' % (label, histogram.format_ms(
+                                          self.phases[phase] * 1000))
+                           for phase, label in PHASES
+                           if phase in self.phases ])
+
+    def check(self, status, found):
+        """ The subject of the mail about a failed probe, or None if the
+        probe succeeded """
+        if str(status) != str(self.status):
+            return 'httpok for %s: bad status returned' % self.url
+        if self.matcher is not None and not self.matcher.passes(found):
+            return 'httpok for %s: bad body returned' % self.url
+        return None
+
+    def check_latency(self):
+        """ The subject and message of the mail about slow responses, or
+        None.  Latencies are only checked once the window is half full. """
+        recorded = len(self.histogram)
+        if self.latency is None or recorded < (self.histogram.window + 1) // 2:
+            return None
+        latency = self.histogram.percentile(self.percentile)
+        if latency <= self.latency:
+            return None
+        subject = 'httpok for %s: slow responses' % self.url
+        msg = ('p%g latency contacting %s over the last %d checks: %s, over '
+               'the limit of %s' % (self.percentile, self.url, recorded,
+                                    histogram.format_ms(latency),
+                                    histogram.format_ms(self.latency)))
+        return subject, msg
+
+    def check_cert(self, now):
+        """ The subject and message of the warning about a certificate
+        which expires within ``certdays`` days, or None.  Only a
+        certificate which was verified can be checked, and each is warned
+        about at most once a day. """
+        if self.certdays is None or self.expires is None:
+            return None
+        left = (self.expires - now) / float(DAY)
+        if left >= self.certdays:
+            return None
+        expires, warned = self.warned
+        if expires == self.expires and now - warned < DAY:
+            return None
+        self.warned = (self.expires, now)
+        subject = 'httpok for %s: certificate expires soon' % self.url
+        expires = time.strftime('%Y-%m-%d %H:%M:%S UTC',
+                                time.gmtime(self.expires))
+        msg = ('the certificate of %s expires on %s, in %.1f days (less '
+               'than %s)' % (self.url, expires, left, self.certdays))
+        return subject, msg
+
+    def report_latency(self):
+        percentiles = dict.fromkeys([50, self.percentile, 99]).keys()
+        percentiles.sort()
+        return 'latency of %s: %s' % (self.url,
+                                      self.histogram.report(percentiles))
+
+def probe_all(endpoints, connclass=None, deadline=None):
+    """ Probe each endpoint in its own thread; returns their results, in
+    order, once all are in or ``deadline`` seconds have passed (by default
+    the longest of their timeouts).  An endpoint which hasn't answered by
+    then gets a result with no status. """
+    if deadline is None:
+        deadline = max([ e.timeout for e in endpoints ] + [0])
+    results = {}
+    def work(i, endpoint):
+        results[i] = endpoint.probe(connclass)
+    threads = []
+    for i, endpoint in enumerate(endpoints):
+        thread = threading.Thread(target=work, args=(i, endpoint))
+        # a thread still waiting for an answer after the deadline is
+        # left to its socket timeout
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    stop = time.time() + deadline
+    for thread in threads:
+        thread.join(max(0, stop - time.time()))
+
+    probed = []
+    for i, endpoint in enumerate(endpoints):
+        result = results.get(i)
+        if result is None:
+            msg = ('error contacting %s:\n\n no response within the tick '
+                   'deadline of %s seconds' % (endpoint.url, deadline))
+            result = (None, None, msg, deadline)
+        probed.append(result)
+    return probed
+
+def read_config(path, timeout=10, status='200', inbody=None, eager=True,
+                fresh=False, latency=None, percentile=95, window=20,
+                failures=1, grace=0, maxgrace=3600, regex=False,
+                negate=False, maxbody=bodymatch.MAXBYTES, verify=True,
+                cafile=None, certdays=None, rolling=0, recovery=60):
+    """ Endpoints from the [endpoint:x] sections of an ini-style file.
+    The keyword arguments are the defaults for options a section doesn't
+    set. """
+    parser = ConfigParser.RawConfigParser()
+    if not parser.read([path]):
+        raise ValueError('Could not read config file %s' % path)
+
+    def get(section, option, default, convert=str):
+        if not parser.has_option(section, option):
+            return default
+        value = parser.get(section, option)
+        try:
+            return convert(value)
+        except ValueError:
+            raise ValueError('Bad value %r for %s in [%s]' % (value, option,
+                                                             section))
+
+    endpoints = []
+    for section in parser.sections():
+        if not section.startswith('endpoint:'):
+            continue
+        if not parser.has_option(section, 'url'):
+            raise ValueError('No url in [%s]' % section)
+        endpoints.append(Endpoint(
+            parser.get(section, 'url'),
+            get(section, 'programs', '').split(),
+            get(section, 'any', False, boolean),
+            get(section, 'timeout', timeout, int),
+            get(section, 'status', status),
+            get(section, 'body', inbody),
+            get(section, 'eager', eager, boolean),
+            section[len('endpoint:'):],
+            get(section, 'fresh', fresh, boolean),
+            get(section, 'latency', latency, float),
+            get(section, 'percentile', percentile, float),
+            get(section, 'window', window, int),
+            get(section, 'failures', failures, int),
+            get(section, 'grace', grace, float),
+            get(section, 'maxgrace', maxgrace, float),
+            get(section, 'regex', regex, boolean),
+            get(section, 'negate', negate, boolean),
+            get(section, 'maxbody', maxbody, byte_size),
+            get(section, 'verify', verify, boolean),
+            get(section, 'cafile', cafile),
+            get(section, 'certdays', certdays, float),
+            get(section, 'rolling', rolling, int),
+            get(section, 'recovery', recovery, float)))
+    if not endpoints:
+        raise ValueError('No [endpoint:x] sections in %s' % path)
+    return endpoints
+
 class HTTPOk:
     connclass = None
+    recheck = 1 # seconds between checks while waiting for a recovery
     def __init__(self, rpc, programs, any, url, timeout, status, inbody,
-                 email, sendmail, coredir, gcore, eager):
+                 email, sendmail, coredir, gcore, eager, stats=None,
+                 resync=60, endpoints=(), deadline=None, fresh=False,
+                 latency=None, percentile=95, window=20, failures=1,
+                 grace=0, maxgrace=3600, regex=False, negate=False,
+                 maxbody=bodymatch.MAXBYTES, verify=True, cafile=None,
+                 certdays=None, rolling=0, recovery=60):
         self.rpc = rpc
+        self.table = processtable.ProcessTable(rpc, resync)
         self.programs = programs
         self.any = any
         self.url = url
@@ -126,81 +666,127 @@ class HTTPOk:
         self.coredir = coredir
         self.gcore = gcore
         self.eager = eager
+        self.stats = stats
+        self.endpoints = list(endpoints)
+        if url is not None:
+            self.endpoints.insert(0, Endpoint(url, programs, any, timeout,
+                                              status, inbody, eager,
+                                              None, fresh, latency,
+                                              percentile, window, failures,
+                                              grace, maxgrace, regex, negate,
+                                              maxbody, verify, cafile,
+                                              certdays, rolling, recovery))
+        self.deadline = deadline
+        self.clock = time.time
+        self.sleep = time.sleep
         self.stdin = sys.stdin
         self.stdout = sys.stdout
         self.stderr = sys.stderr
 
-    def listProcesses(self, state=None):
-        return [x for x in self.rpc.supervisor.getAllProcessInfo()
-                   if x['name'] in self.programs and
+    def listProcesses(self, state=None, programs=None):
+        if programs is None:
+            programs = self.programs
+        return [x for x in self.table.all()
+                   if x['name'] in programs and
                       (state is None or x['state'] == state)]
 
     def runforever(self, test=False):
-        parsed = urlparse.urlsplit(self.url)
-        scheme = parsed[0].lower()
-        hostport = parsed[1]
-        path = parsed[2]
-        params = parsed[3]
-        query = parsed[4]
-
-        if self.connclass:
-            ConnClass = self.connclass
-        elif scheme == 'http':
-            ConnClass = timeoutconn.TimeoutHTTPConnection
-        elif scheme == 'https':
-            ConnClass = timeoutconn.TimeoutHTTPSConnection
-        else:
-            raise ValueError('Bad scheme %s' % scheme)
-
         while 1:
             # we explicitly use self.stdin, self.stdout, and self.stderr
             # instead of sys.* so we can unit test this code
             headers, payload = childutils.listener.wait(self.stdin, self.stdout)
 
             if not headers['eventname'].startswith('TICK'):
-                # do nothing with non-TICK events
+                # keep the process table current from PROCESS_STATE
+                # events; do nothing with other non-TICK events
+                self.table.handle(headers, payload)
                 childutils.listener.ok(self.stdout)
                 if test:
                     break
                 continue
 
-            conn = ConnClass(hostport)
-            conn.timeout = self.timeout
-
-            if query:
-                path += '?' + query
-
-            act = False
-
-            specs = self.listProcesses(ProcessStates.RUNNING)
-            if self.eager or len(specs) > 0:
-
-                try:
-                    conn.request('GET', path)
-                    res = conn.getresponse()
-                    body = res.read()
-                    status = res.status
-                    msg = 'status contacting %s: %s %s' % (self.url,
-                                                           res.status,
-                                                           res.reason)
-                except Exception, why:
-                    body = ''
-                    status = None
-                    msg = 'error contacting %s:\n\n %s' % (self.url, why)
-
-                if str(status) != str(self.status):
-                    subject = 'httpok for %s: bad status returned' % self.url
-                    self.act(subject, msg)
-                elif self.inbody and self.inbody not in res.body:
-                    act = True
-                    subject = 'httpok for %s: bad body returned' % self.url
-                    self.act(subject, msg)
-
+            now = self.clock()
+            due = []
+            for endpoint in self.expanded():
+                if endpoint.resting(now):
+                    self.stderr.write('Not checking %s for another %d seconds '
+                                      'after restarting\n' % (
+                                      endpoint.url, endpoint.resume - now))
+                elif endpoint.eager or self.listProcesses(
+                    ProcessStates.RUNNING, endpoint.programs):
+                    due.append(endpoint)
+            if due:
+                results = probe_all(due, self.connclass, self.deadline)
+            else:
+                results = []
+
+            # restart decisions are made one endpoint at a time, here,
+            # since the RPC interface mustn't be shared between threads
+            for endpoint, (status, found, msg, elapsed) in zip(due, results):
+                tags = [('url', endpoint.url)]
+                if self.stats is not None:
+                    self.stats.timing('probe', elapsed * 1000, tags)
+                    for phase, label in PHASES:
+                        if phase in endpoint.phases:
+                            self.stats.timing('probe_%s' % phase,
+                                              endpoint.phases[phase] * 1000,
+                                              tags)
+                    self.count_connections(endpoint, tags)
+                if status is not None:
+                    endpoint.histogram.add(elapsed * 1000)
+                subject = endpoint.check(status, found)
+                if subject is None:
+                    slow = endpoint.check_latency()
+                    if slow is not None:
+                        subject, msg = slow
+                if endpoint.phases:
+                    msg = '%s\n\ntimings: %s' % (msg, endpoint.report_phases())
+                if endpoint.latency is not None:
+                    report = endpoint.report_latency()
+                    self.stderr.write('%s\n' % report)
+                    msg = '%s\n\n%s' % (msg, report)
+                # restarting doesn't renew a certificate, so one which
+                # expires soon is only warned about
+                expiring = endpoint.check_cert(now)
+                if expiring is not None:
+                    self.warn(expiring[0], expiring[1], tags)
+                if subject is None:
+                    endpoint.passed()
+                    continue
+                self.count('probe_failures', tags)
+                if not endpoint.fail():
+                    self.stderr.write('Check of %s failed %d of %d times in '
+                                      'a row, not restarting yet\n' % (
+                                      endpoint.url, endpoint.failed,
+                                      endpoint.failures))
+                    continue
+                grace = endpoint.restarted(now)
+                self.act(subject, msg, endpoint, grace)
+                # the latencies before the restart say nothing about those
+                # after it
+                endpoint.histogram.clear()
+
+            if self.stats is not None:
+                self.stats.flush()
             childutils.listener.ok(self.stdout)
             if test:
                 break
 
-    def act(self, subject, msg):
+    def expanded(self):
+        """ Our endpoints, with each templated one replaced by its
+        instances to probe """
+        endpoints = []
+        for endpoint in self.endpoints:
+            if endpoint.template:
+                endpoints.extend(endpoint.expand(self.table.all()))
+            else:
+                endpoints.append(endpoint)
+        return endpoints
+
+    def act(self, subject, msg, endpoint=None, grace=0):
+        if endpoint is None:
+            endpoint = self.endpoints[0]
+        programs = endpoint.programs
         messages = [msg]
 
         def write(msg):
@@ -209,47 +795,77 @@ class HTTPOk:
             messages.append(msg)
 
         try:
-            specs = self.rpc.supervisor.getAllProcessInfo()
+            specs = self.table.all()
         except Exception, why:
             write('Exception retrieving process info %s, not acting' % why)
             return
             
-        waiting = list(self.programs)
-            
-        if self.any:
+        waiting = list(programs)
+
+        if endpoint.any:
             write('Restarting all running processes')
-            for spec in specs:
-                name = spec['name']
-                group = spec['group']
-                self.restart(spec, write)
-                namespec = make_namespec(name, group)
-                if name in waiting:
-                    waiting.remove(name)
-                if namespec in waiting:
-                    waiting.remove(namespec)
+            selected = specs
         else:
-            write('Restarting selected processes %s' % self.programs)
+            write('Restarting selected processes %s' % programs)
+            selected = []
             for spec in specs:
                 name = spec['name']
-                group = spec['group']
-                namespec = make_namespec(name, group)
-                if (name in self.programs) or (namespec in self.programs):
-                    self.restart(spec, write)
-                    if name in waiting:
-                        waiting.remove(name)
-                    if namespec in waiting:
-                        waiting.remove(namespec)
+                namespec = make_namespec(spec['group'], name)
+                if (name in programs) or (namespec in programs):
+                    selected.append(spec)
+
+        for spec in selected:
+            name = spec['name']
+            namespec = make_namespec(spec['group'], name)
+            if name in waiting:
+                waiting.remove(name)
+            if namespec in waiting:
+                waiting.remove(namespec)
+
+        if endpoint.rolling:
+            self.restart_rolling(selected, endpoint, write)
+        else:
+            self.restart_many(selected, write)
 
         if waiting:
             write(
                 'Programs not restarted because they did not exist: %s' %
                 waiting)
 
+        if grace:
+            write('Not checking %s for %d seconds after restarting' % (
+                endpoint.url, grace))
+
         if self.email:
             now = time.asctime()
             message = '\n'.join(messages)
             self.mail(self.email, subject, message)
 
+    def warn(self, subject, msg, tags):
+        self.stderr.write('%s\n' % msg)
+        self.count('cert_expiring', tags)
+        if self.email:
+            self.mail(self.email, subject, msg)
+
+    def count(self, stat, tags):
+        if self.stats is not None:
+            self.stats.incr(stat, tags=tags)
+
+    def count_connections(self, endpoint, tags):
+        """ Count the connections made, reused and replaced since the last
+        tick """
+        connects, reuses, reconnects = endpoint.counted
+        if endpoint.connects > connects:
+            self.stats.incr('connects', endpoint.connects - connects, tags)
+        if endpoint.reuses > reuses:
+            self.stats.incr('connection_reuses', endpoint.reuses - reuses,
+                            tags)
+        if endpoint.reconnects > reconnects:
+            self.stats.incr('reconnects', endpoint.reconnects - reconnects,
+                            tags)
+        endpoint.counted = (endpoint.connects, endpoint.reuses,
+                            endpoint.reconnects)
+
     def mail(self, email, subject, msg):
         body =  'To: %s\n' % self.email
         body += 'Subject: %s\n' % subject
@@ -262,35 +878,103 @@ class HTTPOk:
         self.mailed = body
 
     def restart(self, spec, write):
-        namespec = make_namespec(spec['group'], spec['name'])
-        if spec['state'] is ProcessStates.RUNNING:
-            if self.coredir and self.gcore:
-                corename = os.path.join(self.coredir, namespec)
-                m = os.popen(self.gcore + ' "%s" %s' % (corename, spec['pid']))
-                write('gcore output for %s:\n\n %s' % (namespec, m.read()))
-                m.close()
-            write('%s is in RUNNING state, restarting' % namespec)
-            try:
-                self.rpc.supervisor.stopProcess(namespec)
-            except xmlrpclib.Fault, what:
-                write('Failed to stop process %s: %s' % (
-                    namespec, what))
-
-            try:
-                self.rpc.supervisor.startProcess(namespec)
-            except xmlrpclib.Fault, what:
-                write('Failed to start process %s: %s' % (
-                    namespec, what))
+        self.restart_many([spec], write)
+
+    def restart_rolling(self, specs, endpoint, write):
+        """ Restart the processes in the RUNNING state among specs
+        ``endpoint.rolling`` at a time, waiting after each batch for the
+        endpoint to pass its check again.  The rest are left alone if it
+        doesn't within ``endpoint.recovery`` seconds. """
+        running = []
+        others = []
+        for spec in specs:
+            if spec['state'] is ProcessStates.RUNNING:
+                running.append(spec)
+            else:
+                others.append(spec)
+        self.restart_many(others, write)
+
+        size = endpoint.rolling
+        batches = [ running[i:i + size] for i in range(0, len(running), size) ]
+        for number, batch in enumerate(batches):
+            write('Restarting batch %d of %d' % (number + 1, len(batches)))
+            self.restart_many(batch, write)
+            recovered = self.recover(endpoint)
+            if recovered is None:
+                write('%s did not recover within %s seconds, not restarting '
+                      'the remaining processes' % (endpoint.url,
+                                                   endpoint.recovery))
+                left = [ make_namespec(spec['group'], spec['name'])
+                         for batch in batches[number + 1:] for spec in batch ]
+                if left:
+                    write('Processes not restarted: %s' % ', '.join(left))
+                self.count('rolling_aborts', [('url', endpoint.url)])
+                return
+            write('%s recovered %s after restarting batch %d' % (
+                endpoint.url, histogram.format_ms(recovered * 1000),
+                number + 1))
+
+    def recover(self, endpoint):
+        """ Probe ``endpoint`` until it passes its check; returns how long
+        that took, or None if it didn't within ``endpoint.recovery``
+        seconds """
+        start = self.clock()
+        while 1:
+            status, found, msg, elapsed = endpoint.probe(self.connclass)
+            waited = self.clock() - start
+            if status is not None and endpoint.check(status, found) is None:
+                if self.stats is not None:
+                    self.stats.timing('recovery', waited * 1000,
+                                      [('url', endpoint.url)])
+                return waited
+            if waited >= endpoint.recovery:
+                return None
+            self.sleep(min(self.recheck, endpoint.recovery - waited))
+
+    def restart_many(self, specs, write):
+        """ Restart the processes in the RUNNING state among specs, with one
+        system.multicall for the stops and one for the starts """
+        running = []
+        for spec in specs:
+            namespec = make_namespec(spec['group'], spec['name'])
+            if spec['state'] is ProcessStates.RUNNING:
+                if self.coredir and self.gcore:
+                    corename = os.path.join(self.coredir, namespec)
+                    m = os.popen(self.gcore + ' "%s" %s' % (corename,
+                                                            spec['pid']))
+                    write('gcore output for %s:\n\n %s' % (namespec,
+                                                            m.read()))
+                    m.close()
+                write('%s is in RUNNING state, restarting' % namespec)
+                running.append(namespec)
+
+        # a process is started even if it failed to stop
+        stops = multicall.call_each(self.rpc, 'supervisor.stopProcess',
+                                    running)
+        starts = multicall.call_each(self.rpc, 'supervisor.startProcess',
+                                     running)
+        results = dict(zip(running, zip(stops, starts)))
+
+        for spec in specs:
+            namespec = make_namespec(spec['group'], spec['name'])
+            tags = [('group', spec['group']), ('name', spec['name'])]
+            if namespec not in results:
+                write('%s not in RUNNING state, NOT restarting' % namespec)
+                continue
+            stop, start = results[namespec]
+            if multicall.is_fault(stop):
+                write('Failed to stop process %s: %s' % (namespec, stop))
+                self.count('restart_failures', tags)
+            if multicall.is_fault(start):
+                write('Failed to start process %s: %s' % (namespec, start))
+                self.count('restart_failures', tags)
             else:
                 write('%s restarted' % namespec)
-
-        else:
-            write('%s not in RUNNING state, NOT restarting' % namespec)
-            
+                self.count('restarts', tags)
 
 def main(argv=sys.argv):
     import getopt
-    short_args="hp:at:c:b:s:m:g:d:eE"
+    short_args="hp:at:c:b:s:m:g:d:eEf:l:rN"
     long_args=[
         "help",
         "program=",
@@ -304,6 +988,27 @@ def main(argv=sys.argv):
         "coredir=",
         "eager",
         "not-eager",
+        "statsd=",
+        "dogstatsd",
+        "resync=",
+        "config=",
+        "deadline=",
+        "fresh",
+        "latency=",
+        "percentile=",
+        "window=",
+        "failures=",
+        "grace=",
+        "max-grace=",
+        "regex",
+        "not-body",
+        "max-body=",
+        "dns-ttl=",
+        "insecure",
+        "cafile=",
+        "cert-days=",
+        "rolling=",
+        "recovery=",
         ]
     arguments = argv[1:]
     try:
@@ -311,8 +1016,6 @@ def main(argv=sys.argv):
     except:
         usage()
 
-    if not args:
-        usage()
     if len(args) > 1:
         usage()
 
@@ -326,6 +1029,26 @@ def main(argv=sys.argv):
     timeout = 10
     status = '200'
     inbody = None
+    stats = None
+    dogstatsd = False
+    resync = 60
+    config = None
+    deadline = None
+    fresh = False
+    latency = None
+    percentile = 95
+    window = 20
+    failures = 1
+    grace = 0
+    maxgrace = 3600
+    regex = False
+    negate = False
+    maxbody = bodymatch.MAXBYTES
+    verify = True
+    cafile = None
+    certdays = None
+    rolling = 0
+    recovery = 60
 
     for option, value in opts:
 
@@ -365,10 +1088,117 @@ def main(argv=sys.argv):
         if option in ('-E', '--not-eager'):
             eager = False
 
-    url = arguments[-1]
+        if option == '--statsd':
+            try:
+                stats = statsd.parse_address(value)
+            except ValueError, why:
+                print why
+                usage()
+
+        if option == '--dogstatsd':
+            dogstatsd = True
+
+        if option == '--resync':
+            resync = float(value)
+
+        if option in ('-f', '--config'):
+            config = value
+
+        if option == '--deadline':
+            deadline = float(value)
+
+        if option == '--fresh':
+            fresh = True
+
+        if option in ('-l', '--latency'):
+            latency = float(value)
+
+        if option == '--percentile':
+            percentile = float(value)
+            if not 0 < percentile <= 100:
+                usage()
+
+        if option == '--window':
+            window = int(value)
+            if window < 1:
+                usage()
+
+        if option == '--failures':
+            failures = int(value)
+            if failures < 1:
+                usage()
+
+        if option == '--grace':
+            grace = float(value)
+
+        if option == '--max-grace':
+            maxgrace = float(value)
+
+        if option in ('-r', '--regex'):
+            regex = True
+
+        if option in ('-N', '--not-body'):
+            negate = True
+
+        if option == '--dns-ttl':
+            timeoutconn.default_resolver.ttl = float(value)
+
+        if option == '--insecure':
+            verify = False
+
+        if option == '--cafile':
+            cafile = value
+
+        if option == '--cert-days':
+            certdays = float(value)
+
+        if option == '--rolling':
+            rolling = int(value)
+            if rolling < 0:
+                usage()
+
+        if option == '--recovery':
+            recovery = float(value)
+
+        if option == '--max-body':
+            try:
+                maxbody = byte_size(value)
+            except ValueError:
+                print 'Bad size %r for --max-body' % value
+                usage()
+
+    if not args and config is None:
+        usage()
+
+    if inbody and regex:
+        try:
+            bodymatch.BodyMatcher(inbody, regex)
+        except ValueError, why:
+            print why
+            usage()
+
+    url = None
+    if args:
+        url = args[0]
+
+    endpoints = []
+    if config is not None:
+        try:
+            endpoints = read_config(config, timeout, status, inbody, eager,
+                                    fresh, latency, percentile, window,
+                                    failures, grace, maxgrace, regex,
+                                    negate, maxbody, verify, cafile,
+                                    certdays, rolling, recovery)
+        except (ValueError, ConfigParser.Error), why:
+            print why
+            usage()
+
+    if stats is not None:
+        host, port = stats
+        stats = statsd.StatsClient(host, port, 'httpok', dogstatsd)
 
     try:
-        rpc = childutils.getRPCInterface(os.environ)
+        rpc = transport.getRPCInterface(os.environ, stats)
     except KeyError, why:
         if why[0] != 'SUPERVISOR_SERVER_URL':
             raise
@@ -377,8 +1207,15 @@ def main(argv=sys.argv):
         sys.stderr.flush()
         return
 
-    prog = HTTPOk(rpc, programs, any, url, timeout, status, inbody, email,
-                  sendmail, coredir, gcore, eager)
+    try:
+        prog = HTTPOk(rpc, programs, any, url, timeout, status, inbody,
+                      email, sendmail, coredir, gcore, eager, stats, resync,
+                      endpoints, deadline, fresh, latency, percentile, window,
+                      failures, grace, maxgrace, regex, negate, maxbody,
+                      verify, cafile, certdays, rolling, recovery)
+    except ValueError, why:
+        print why
+        usage()
     prog.runforever()
 
 if __name__ == '__main__':
@@ -0,0 +1,155 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Memory growth prediction for memmon.  Recent samples of each process are
+kept in a fixed-size ring buffer, a growth rate is fitted to them, and a
+restart is recommended when the projected time to reach the limit drops
+below a horizon -- preferably inside an off-peak window.
+"""
+
+import time
+from array import array
+
+RESTART = 'restart'
+DEFER = 'defer'
+
+class SampleRing:
+    """ A fixed-size ring buffer of (time, value) samples, backed by two
+    arrays of doubles. """
+
+    def __init__(self, size, pid=None):
+        if size < 2:
+            raise ValueError('A ring needs room for at least two samples')
+        self.size = size
+        self.pid = pid
+        self.times = array('d', [0.0]) * size
+        self.values = array('d', [0.0]) * size
+        self.count = 0
+        self.next = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, when, value):
+        self.times[self.next] = when
+        self.values[self.next] = value
+        self.next = (self.next + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def latest(self):
+        if not self.count:
+            return None
+        return self.values[(self.next - 1) % self.size]
+
+    def slope(self):
+        """ Least-squares growth rate (value units per second), or None if
+        there are not enough samples to fit one. """
+        n = self.count
+        if n < 2:
+            return None
+        times = self.times[:n]
+        values = self.values[:n]
+        mean_t = sum(times) / n
+        mean_v = sum(values) / n
+        num = 0.0
+        den = 0.0
+        for i in range(n):
+            dt = times[i] - mean_t
+            num += dt * (values[i] - mean_v)
+            den += dt * dt
+        if not den:
+            return None
+        return num / den
+
+def parse_window(value):
+    """ Parse 'HH:MM-HH:MM' into a (start, end) pair of minutes past
+    midnight.  The window may wrap around midnight. """
+    try:
+        start, end = value.split('-')
+        result = []
+        for part in start, end:
+            hours, minutes = part.split(':')
+            hours, minutes = int(hours), int(minutes)
+            if not (0 <= hours < 24 and 0 <= minutes < 60):
+                raise ValueError(value)
+            result.append(hours * 60 + minutes)
+    except ValueError:
+        raise ValueError('Bad time window %r, expected HH:MM-HH:MM' % value)
+    return tuple(result)
+
+def seconds_until_window(window, now, localtime=time.localtime):
+    """ 0 if ``now`` is inside the window, else the seconds until it
+    next opens. """
+    start, end = window
+    t = localtime(now)
+    minute = t.tm_hour * 60 + t.tm_min
+    if start <= end:
+        inside = start <= minute < end
+    else:
+        inside = minute >= start or minute < end
+    if inside:
+        return 0
+    minutes = (start - minute) % (24 * 60)
+    return minutes * 60 - t.tm_sec
+
+class LeakPredictor:
+    """ Keeps a SampleRing per process name.  A new pid for the same name
+    (i.e. the process was restarted) starts a fresh ring. """
+
+    def __init__(self, horizon, size=10, window=None, minsamples=3,
+                 localtime=time.localtime):
+        self.horizon = horizon
+        self.size = size
+        self.window = window
+        self.minsamples = min(minsamples, size)
+        self.localtime = localtime
+        self.rings = {}
+
+    def observe(self, name, pid, when, value):
+        ring = self.rings.get(name)
+        if ring is None or ring.pid != pid:
+            ring = self.rings[name] = SampleRing(self.size, pid)
+        ring.append(when, value)
+
+    def forget(self, names):
+        for name in self.rings.keys():
+            if name not in names:
+                del self.rings[name]
+
+    def projection(self, name, limit):
+        """ Seconds until the process named ``name`` reaches ``limit`` at its
+        current growth rate, or None if it isn't growing (or we don't know
+        yet). """
+        ring = self.rings.get(name)
+        if ring is None or len(ring) < self.minsamples:
+            return None
+        slope = ring.slope()
+        if not slope or slope <= 0:
+            return None
+        return max(limit - ring.latest(), 0) / slope
+
+    def decide(self, name, limit, now):
+        """ Returns (decision, projection, wait): decision is RESTART, DEFER
+        or None; wait is the number of seconds until the off-peak window
+        opens when deferring. """
+        projected = self.projection(name, limit)
+        if projected is None or projected >= self.horizon:
+            return None, projected, 0
+        if self.window is None:
+            return RESTART, projected, 0
+        wait = seconds_until_window(self.window, now, self.localtime)
+        if wait and projected > wait:
+            return DEFER, projected, wait
+        return RESTART, projected, 0
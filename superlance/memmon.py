@@ -15,30 +15,36 @@
 
 # A event listener meant to be subscribed to TICK_60 (or TICK_5)
 # events, which restarts any processes that are children of
-# supervisord that consume "too much" memory.  Performs horrendous
-# screenscrapes of ps output.  Works on Linux and OS X (Tiger/Leopard)
-# as far as I know.
+# supervisord that consume "too much" memory.  On Linux, memory usage
+# is read from /proc; elsewhere it performs horrendous screenscrapes of
+# ps output.  Works on Linux and OS X (Tiger/Leopard) as far as I know.
 
 # A supervisor config snippet that tells supervisor to use this script
 # as a listener is below.
 #
 # [eventlistener:memmon]
 # command=python memmon.py [options]
-# events=TICK_60
+# events=TICK_60,PROCESS_STATE
 
 doc = """\
 memmon.py [-p processname=byte_size]  [-g groupname=byte_size] 
-          [-a byte_size] [-s sendmail] [-m email_address]
+          [-a byte_size] [-s sendmail] [-m email_address] [-S sampler]
+          [-T] [-M metric] [-B seconds] [-H seconds] [-n samples]
+          [-w HH:MM-HH:MM] [-R workers] [-i seconds] [-A seconds]
+          [-L count] [-e [host:]port] [--statsd=[host:]port]
+          [--dogstatsd] [--resync=seconds]
 
 Options:
 
 -p -- specify a process_name=byte_size pair.  Restart the supervisor
       process named 'process_name' when it uses more than byte_size
       RSS.  If this process is in a group, it can be specified using
-      the 'process_name:group_name' syntax.
+      the 'group_name:process_name' syntax.  The name may be a glob
+      pattern (e.g. worker_*=200MB).
       
 -g -- specify a group_name=byte_size pair.  Restart any process in this group
-      when it uses more than byte_size RSS.
+      when it uses more than byte_size RSS.  The name may be a glob
+      pattern.
       
 -a -- specify a global byte_size.  Restart any child of the supervisord
       under which this runs if it uses more than byte_size RSS.
@@ -52,160 +58,580 @@ Options:
       address when any process is restarted.  If no email address is
       specified, email will not be sent.
 
+-S -- the sampler used to measure memory usage: "proc" reads
+      /proc/<pid>/statm (Linux only), "psbatch" runs a single ps for
+      all processes, "ps" runs ps once per process.  "cgroup" reads
+      memory.current of the cgroup v2 a process runs in, if that
+      cgroup is its own, falling back to "proc" otherwise (both are
+      reported as RSS); kernel OOM kills within those cgroups are
+      reported (and mailed).  The default, "auto", uses "proc" when /proc is available and "psbatch"
+      otherwise.
+
+-T -- measure whole process trees: the memory of a supervised process
+      is the sum over the process and all of its descendants (e.g. the
+      workers of a pre-fork server), and the -p, -g and -a limits apply
+      to that sum.
+
+-M -- the memory metric to which limits apply: "rss" (resident set
+      size, the default), "pss" (proportional set size: shared pages
+      are divided among the processes sharing them), "uss" (memory
+      private to the process), "anon" (anonymous memory) or "swap".
+      Metrics other than rss are read from /proc/<pid>/smaps_rollup
+      (or /proc/<pid>/smaps on older kernels) and require Linux.
+
+-B -- the maximum number of seconds (e.g. 0.5) to spend reading smaps
+      per tick.  Processes not measured within this budget keep their
+      previous measurement and are measured first on the next tick.
+      By default there is no budget.
+
+-H -- predict leaks: fit a growth rate to each process' recent
+      measurements, and restart it as soon as it is projected to reach
+      its limit within this many seconds.  Disabled by default.
+
+-n -- the number of recent measurements per process used to fit the
+      growth rate for -H.  Defaults to 10.
+
+-w -- an off-peak window (e.g. 02:00-05:00, local time) for -H.  A
+      predicted restart is deferred until the window opens, unless the
+      process is projected to reach its limit before then.
+
+-R -- restart processes in this many background worker threads instead
+      of in the event handler, so that a process which is slow to stop
+      doesn't keep memmon from acknowledging events.  At most one restart
+      per process is pending at any time.  The default, 0, restarts
+      processes synchronously.
+
+-i -- measure processes every this many seconds (e.g. 0.5) in a
+      background thread, rather than once per TICK event.  Processes are
+      restarted as soon as they are found over their limit; TICK events
+      only refresh the process list and report the latest measurements.
+
+-A -- measure each process adaptively: a process is measured again after
+      at most this many seconds, less the closer it is to its limit and
+      the faster it grows.  Processes close to their limit are measured
+      on every tick (or every -i interval).
+
+-L -- with -A, measure at most this many processes per tick (or per -i
+      interval).  Processes which are due but don't fit are measured
+      first next time.
+
+-e -- serve the latest measurements, limits and restart counts in the
+      OpenMetrics (Prometheus) text format at http://host:port/metrics
+      from a background thread.  The host defaults to all interfaces.
+
+--statsd -- send measurements (gauges named after the metric, e.g.
+      memmon.rss.group.process) and restart counts (memmon.restarts...,
+      memmon.restart_failures...) to a StatsD server over UDP, once per
+      tick, along with the time each XML-RPC call to supervisord takes
+      (memmon.rpc timers, per method) and how often the connection to it
+      had to be reopened (memmon.rpc_reconnects).  The host defaults to
+      127.0.0.1.
+
+--dogstatsd -- with --statsd, send the group and process name as
+      DogStatsD tags rather than as part of the metric name.
+
+--resync -- with PROCESS_STATE events subscribed to, the process list is
+      kept current from those events and fetched from supervisord afresh
+      only every this many seconds (default 60).  Without them, it is
+      fetched on every tick.
+
 The -p and -g options may be specified more than once, allowing for
 specification of multiple groups and processes.
 
+Only one limit applies to each process.  A -p limit naming the process
+(by group_name:process_name, then by process_name) wins over a matching
+-p pattern, which wins over a -g limit naming its group, then a matching
+-g pattern, then -a.  Among several matching patterns, the most specific
+(most non-wildcard characters) wins.
+
 Any byte_size can be specified as a plain integer (10000) or a
 suffix-multiplied integer (e.g. 1GB).  Valid suffixes are 'KB', 'MB'
 and 'GB'.
 
 A sample invocation:
 
-memmon.py -p program1=200MB -p theprog:thegroup=100MB -g thegroup=100MB -a 1GB -s "/usr/sbin/sendmail -t -i" -m chrism@plope.com
+memmon.py -p program1=200MB -p thegroup:theprog=100MB -g thegroup=100MB -a 1GB -s "/usr/sbin/sendmail -t -i" -m chrism@plope.com
 """
 
 import os
+import select
 import sys
+import threading
 import time
-import xmlrpclib
+import Queue
 
 from supervisor import childutils
 from supervisor.datatypes import byte_size
 
+from superlance import adaptive
+from superlance import exporter
+from superlance import leakrate
+from superlance import multicall
+from superlance import processtable
+from superlance import restartpool
+from superlance import rules
+from superlance import samplers
+from superlance import statsd
+from superlance import transport
+
 def usage():
     print doc
     sys.exit(255)
 
-def shell(cmd):
-    return os.popen(cmd).read()
+class SamplingThread(threading.Thread):
+    """ Measures the processes memmon watches every ``interval`` seconds,
+    independently of TICK events.  Processes to restart are put on the
+    ``breaches`` queue (once per pid, unless the listener forget()s it)
+    for the listener to act on. """
+
+    def __init__(self, memmon, interval):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.memmon = memmon
+        self.interval = interval
+        self.breaches = Queue.Queue()
+        self.lock = threading.Lock()
+        self.watched = []
+        self.latest = []
+        self.reported = {}
+        self.stopped = threading.Event()
+
+    def watch(self, watched):
+        self.lock.acquire()
+        self.watched = watched
+        self.lock.release()
+
+    def run(self):
+        while not self.stopped.isSet():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+    def sample(self):
+        self.lock.acquire()
+        watched = self.watched
+        self.lock.release()
+
+        current = dict([ (info['pid'], 1) for info, limit in watched ])
+        for pid in self.reported.keys():
+            if pid not in current:
+                del self.reported[pid]
+
+        self.latest = self.memmon.evaluate(watched, time.time(), self.breach,
+                                           verbose=False)
+
+    def breach(self, pid, name, mem, reason):
+        if pid not in self.reported:
+            self.reported[pid] = True
+            self.breaches.put((pid, name, mem, reason))
+
+    def forget(self, pid):
+        """ Report a breach of ``pid`` again the next time it is found,
+        e.g. when its restart couldn't be queued """
+        self.reported.pop(pid, None)
 
 class Memmon:
-    def __init__(self, programs, groups, any, sendmail, email, rpc):
+    progname = 'memmon'
+    # names of the exported measurement and limit gauges
+    metric_name = 'process_memory_bytes'
+    limit_name = 'process_limit_bytes'
+
+    def __init__(self, programs, groups, any, sendmail, email, rpc,
+                 sampler=None, tree=False, predictor=None, workers=0,
+                 interval=None, scheduler=None, exporter=None, stats=None,
+                 resync=60):
         self.programs = programs
         self.groups = groups
         self.any = any
+        self.rules = rules.Rules(programs, groups, any)
         self.sendmail = sendmail
         self.email = email
         self.rpc = rpc
+        self.table = processtable.ProcessTable(rpc, resync)
         self.stdin = sys.stdin
         self.stdout = sys.stdout
         self.stderr = sys.stderr
-        self.pscommand = 'ps -orss= -p %s'
+        if sampler is None:
+            sampler = samplers.make_sampler()
+        self.sampler = sampler
+        self.tree = tree
+        self.predictor = predictor
+        self.pool = None
+        if workers:
+            rpcfactory = lambda: transport.getRPCInterface(os.environ,
+                                                           stats)
+            self.pool = restartpool.RestartPool(self.restart, rpcfactory,
+                                                workers)
+        self.scheduler = scheduler
+        self.exporter = exporter
+        self.exported = {} # name -> (group, process name, value, limit)
+        self.restarts = {} # name -> number of restarts
+        self.stats = stats
+        self.pending = [] # (name, mem, reason) to restart at end of tick
+        self.watched = []
+        self.thread = None
+        if interval:
+            self.thread = SamplingThread(self, interval)
         self.mailed = False # for unit tests
 
     def runforever(self, test=False):
+        if self.thread is not None and not test and not self.thread.isAlive():
+            self.thread.start()
         while 1:
-            # we explicitly use self.stdin, self.stdout, and self.stderr
-            # instead of sys.* so we can unit test this code
-            headers, payload = childutils.listener.wait(self.stdin, self.stdout)
+            headers, payload = self.wait()
 
             if not headers['eventname'].startswith('TICK'):
-                # do nothing with non-TICK events
+                # keep the process table current from PROCESS_STATE
+                # events; do nothing with other non-TICK events
+                self.table.handle(headers, payload)
                 childutils.listener.ok(self.stdout)
                 if test:
                     break
                 continue
 
-            status = []
-            if self.programs:
-                status.append(
-                    'Checking programs %s' % ', '.join(
-                    [ '%s=%s' % x for x in self.programs.items() ] )
-                    )
-
-            if self.groups:
-                status.append(
-                    'Checking groups %s' % ', '.join(
-                    [ '%s=%s' % x for x in self.groups.items() ] )
-                    )
-            if self.any is not None:
-                status.append('Checking any=%s' % self.any)
-
-            self.stderr.write('\n'.join(status) + '\n')
-
-            infos = self.rpc.supervisor.getAllProcessInfo()
-
-            for info in infos:
-                pid = info['pid']
-                name = info['name']
-                group = info['group']
-                pname = '%s:%s' % (group, name)
-
-                if not pid:
-                    # ps throws an error in this case (for processes
-                    # in standby mode, non-auto-started).
-                    continue
-
-                data = shell(self.pscommand % pid)
-                if not data:
-                    # no such pid (deal with race conditions)
-                    continue
-
-                try:
-                    rss = data.lstrip().rstrip()
-                    rss = int(rss) * 1024 # rss is in KB
-                except ValueError:
-                    # line doesn't contain any data, or rss cant be intified
-                    continue
-
-                for n in name, pname:
-                    if n in self.programs:
-                        self.stderr.write('RSS of %s is %s\n' % (pname, rss))
-                        if  rss > self.programs[name]:
-                            self.restart(pname, rss)
-                            continue
-
-                if group in self.groups:
-                    self.stderr.write('RSS of %s is %s\n' % (pname, rss))
-                    if rss > self.groups[group]:
-                        self.restart(pname, rss)
-                        continue
-
-                if self.any is not None:
-                    self.stderr.write('RSS of %s is %s\n' % (pname, rss))
-                    if rss > self.any:
-                        self.restart(pname, rss)
-                        continue
+            self.tick()
 
             self.stderr.flush()
             childutils.listener.ok(self.stdout)
             if test:
                 break
 
-    def restart(self, name, rss):
-        self.stderr.write('Restarting %s\n' % name)
+    def wait(self):
+        # we explicitly use self.stdin, self.stdout, and self.stderr
+        # instead of sys.* so we can unit test this code
+        if self.thread is None or not hasattr(self.stdin, 'fileno'):
+            return childutils.listener.wait(self.stdin, self.stdout)
 
-        try:
-            self.rpc.supervisor.stopProcess(name)
-        except xmlrpclib.Fault, what:
-            msg = ('Failed to stop process %s (RSS %s), exiting: %s' %
-                   (name, rss, what))
-            self.stderr.write(str(msg))
+        # act on breaches found by the sampling thread while we wait
+        childutils.listener.ready(self.stdout)
+        while 1:
+            self.drain()
+            r, w, x = select.select([self.stdin], [], [], self.thread.interval)
+            if r:
+                break
+        line = self.stdin.readline()
+        headers = childutils.get_headers(line)
+        payload = self.stdin.read(int(headers['len']))
+        return headers, payload
+
+    def tick(self):
+        status = []
+        if self.programs:
+            status.append(
+                'Checking programs %s' % ', '.join(
+                [ '%s=%s' % x for x in self.programs.items() ] )
+                )
+
+        if self.groups:
+            status.append(
+                'Checking groups %s' % ', '.join(
+                [ '%s=%s' % x for x in self.groups.items() ] )
+                )
+        if self.any is not None:
+            status.append('Checking any=%s' % self.any)
+        if self.pool is not None:
+            # a restart which failed in a worker exits the listener,
+            # just as it would have when restarting synchronously
+            self.pool.reraise()
+            status.append(self.pool.status())
+
+        self.stderr.write('\n'.join(status) + '\n')
+
+        infos = self.table.all()
+        self.watched = self.watch(infos)
+
+        if self.thread is None:
+            self.evaluate(self.watched, time.time(), self.act)
+            self.restart_pending()
+            return
+
+        # the sampling thread does the measuring; report its latest findings
+        self.thread.watch(self.watched)
+        label = self.sampler.metric.upper()
+        for name, mem in self.thread.latest:
+            self.stderr.write('%s of %s is %s\n' % (label, name, mem))
+        self.drain()
+
+    def watch(self, infos):
+        """ (info, limit) of every running process which a rule applies to
+        """
+        self.rules.refresh(infos)
+        watched = []
+        for info in infos:
+            # processes in standby mode (non-auto-started) have pid 0
+            if not info['pid']:
+                continue
+            rule = self.rules.resolve(info['group'], info['name'])
+            if rule is not None:
+                watched.append((info, rule[2]))
+        return watched
+
+    def evaluate(self, watched, now, act, verbose=True):
+        """ Measure the watched processes and call act(pid, name, mem,
+        reason) for each one which should be restarted.  Returns a list of
+        (name, mem) measurements. """
+        names = dict([ ('%s:%s' % (info['group'], info['name']), 1)
+                       for info, limit in watched ])
+        if self.scheduler is not None:
+            due = self.scheduler.due([ info['pid'] for info, limit in watched ],
+                                     now)
+            due = dict.fromkeys(due)
+            watched = [ x for x in watched if x[0]['pid'] in due ]
+
+        sampled = self.measure([ info['pid'] for info, limit in watched ])
+        label = self.sampler.metric.upper()
+        if hasattr(self.sampler, 'oom_kills'):
+            infos = [ info for info, limit in watched ]
+            self.report_oom_kills(infos, self.sampler.oom_kills())
+
+        result = []
+        for info, limit in watched:
+            pid = info['pid']
+            pname = '%s:%s' % (info['group'], info['name'])
+
+            mem = sampled.get(pid)
+            if mem is None:
+                # no such pid (deal with race conditions)
+                continue
+            result.append((pname, mem))
+
+            if self.predictor is not None:
+                self.predictor.observe(pname, pid, now, mem)
+            if self.scheduler is not None:
+                self.scheduler.update(pid, now, mem, limit)
+            if self.exporter is not None:
+                self.exported[pname] = (info['group'], info['name'], mem,
+                                        limit)
+            if self.stats is not None:
+                self.stats.gauge(self.sampler.metric, mem,
+                                 [('group', info['group']),
+                                  ('name', info['name'])])
+
+            if verbose:
+                self.stderr.write('%s of %s is %s\n' % (label, pname, mem))
+            reason = self.check(pname, mem, limit, now, verbose)
+            if reason is not None:
+                act(pid, pname, mem, reason)
+
+        if self.predictor is not None:
+            self.predictor.forget(names)
+        if self.exporter is not None:
+            for pname in self.exported.keys():
+                if pname not in names:
+                    del self.exported[pname]
+        self.publish()
+        return result
+
+    def publish(self):
+        """ Hand the latest metrics to the exporter and the StatsD client """
+        if self.exporter is not None:
+            self.exporter.update(self.render_metrics())
+        if self.stats is not None:
+            self.stats.flush()
+
+    def render_metrics(self):
+        label = self.sampler.metric
+        values = []
+        limits = []
+        exported = self.exported.items()
+        exported.sort()
+        for pname, (group, name, value, limit) in exported:
+            labels = [('group', group), ('name', name)]
+            values.append((labels + [('metric', label)], value))
+            limits.append((labels, limit))
+        restarts = []
+        groups = {}
+        counts = self.restarts.items()
+        counts.sort()
+        for pname, count in counts:
+            group, name = pname.split(':', 1)
+            restarts.append(([('group', group), ('name', name)], count))
+            groups[group] = groups.get(group, 0) + count
+        groups = [ ([('group', group)], count)
+                   for group, count in sorted(groups.items()) ]
+        prefix = self.progname + '_'
+        return exporter.render([
+            (prefix + self.metric_name, 'gauge',
+             'Latest measurement of the process', values),
+            (prefix + self.limit_name, 'gauge',
+             'Limit above which the process is restarted', limits),
+            (prefix + 'restarts', 'counter',
+             'Processes restarted by %s' % self.progname, restarts),
+            (prefix + 'group_restarts', 'counter',
+             'Processes restarted by %s, per group' % self.progname, groups),
+            ])
+
+    def act(self, pid, name, mem, reason):
+        self.schedule(name, mem, reason)
+
+    def drain(self):
+        """ Restart the processes the sampling thread found in breach """
+        current = dict([ (info['pid'], 1) for info, limit in self.watched ])
+        while 1:
+            try:
+                pid, name, mem, reason = self.thread.breaches.get_nowait()
+            except Queue.Empty:
+                break
+            if pid in current and not self.schedule(name, mem, reason):
+                self.thread.forget(pid)
+        self.restart_pending()
+
+    def measure(self, pids):
+        if not self.tree:
+            return self.sampler.sample(pids)
+
+        # one process table scan per tick, shared by every supervised pid
+        tree = samplers.ProcessTree(self.sampler.ppids())
+        members = {}
+        for pid in pids:
+            members[pid] = tree.descendants(pid)
+        allpids = {}
+        for descendants in members.values():
+            for pid in descendants:
+                allpids[pid] = True
+        sampled = self.sampler.sample(allpids.keys())
+
+        result = {}
+        for pid, descendants in members.items():
+            if pid in sampled:
+                result[pid] = sum([ sampled.get(x, 0) for x in descendants ])
+        return result
+
+    def report_oom_kills(self, infos, events):
+        names = dict([ (x['pid'], '%s:%s' % (x['group'], x['name']))
+                       for x in infos ])
+        for pid, cgroup, kills in events:
+            name = names.get(pid, 'pid %s' % pid)
+            msg = ('The kernel OOM killer killed %s process(es) in the '
+                   'cgroup %s of %s' % (kills, cgroup, name))
+            self.stderr.write('%s\n' % msg)
             if self.email:
-                subject = 'memmon: failed to stop process %s, exiting' % name
-                self.mail(self.email, subject, msg)
-            raise
-
-        try:
-            self.rpc.supervisor.startProcess(name)
-        except xmlrpclib.Fault, what:
-            msg = ('Failed to start process %s after stopping it, '
-                   'exiting: %s' % (name, what))
-            self.stderr.write(str(msg))
+                subject = '%s: process %s OOM-killed by the kernel' % (
+                    self.progname, name)
+                self.mail(self.email, subject, '%s at %s' % (
+                    msg, time.asctime()))
+
+    def check(self, name, mem, limit, now, verbose=True):
+        """ The reason to restart the process, or None """
+        label = self.sampler.metric.upper()
+        if mem > limit:
+            return 'it was consuming too much memory (%s bytes %s)' % (
+                mem, label)
+
+        if self.predictor is None:
+            return None
+
+        decision, projected, wait = self.predictor.decide(name, limit, now)
+        if projected is None:
+            return None
+        if verbose:
+            self.stderr.write('%s of %s projected to reach %s in %d '
+                              'seconds\n' % (label, name, limit, projected))
+        if decision == leakrate.RESTART:
+            return ('its memory usage (%s bytes %s) was projected to reach '
+                    'its limit of %s bytes within %d seconds' % (
+                    mem, label, limit, projected))
+        if decision == leakrate.DEFER and verbose:
+            self.stderr.write('Deferring restart of %s until the off-peak '
+                              'window opens in %d seconds\n' % (name, wait))
+        return None
+
+    def schedule(self, name, mem, reason=None):
+        """ Restart the process now or queue its restart; False if it
+        couldn't be queued """
+        if self.pool is None:
+            # restarted in one batch with the others found this tick,
+            # see restart_pending()
+            self.stderr.write('Restarting %s\n' % name)
+            self.pending.append((name, mem, reason))
+        elif self.pool.submit(name, mem, reason):
+            self.stderr.write('Queued restart of %s\n' % name)
+        else:
+            self.stderr.write('Not queueing restart of %s: a restart is '
+                              'already pending or the queue is full\n' % name)
+            return False
+        return True
+
+    def restart_pending(self):
+        pending, self.pending = self.pending, []
+        if pending:
+            try:
+                self.restart_many(pending)
+            finally:
+                self.publish()
+
+    def restart(self, name, mem, reason=None, rpc=None):
+        self.stderr.write('Restarting %s\n' % name)
+        self.restart_many([(name, mem, reason)], rpc)
+
+    def restart_many(self, restarts, rpc=None):
+        """ Stop, then start, each (name, mem, reason) in restarts, using
+        one system.multicall for the stops and one for the starts.  If a
+        process fails to stop or start, the first fault is re-raised once
+        every outcome has been reported. """
+        if rpc is None:
+            rpc = self.rpc
+        names = [ x[0] for x in restarts ]
+        stops = multicall.call_each(rpc, 'supervisor.stopProcess', names)
+        stopped = [ name for name, result in zip(names, stops)
+                    if not multicall.is_fault(result) ]
+        starts = dict(zip(stopped, multicall.call_each(
+            rpc, 'supervisor.startProcess', stopped)))
+
+        fault = None
+        for (name, mem, reason), result in zip(restarts, stops):
+            if multicall.is_fault(result):
+                msg = ('Failed to stop process %s (%s %s), exiting: %s' %
+                       (name, self.sampler.metric.upper(), mem, result))
+                self.stderr.write(str(msg))
+                if self.email:
+                    subject = '%s: failed to stop process %s, exiting' % (
+                        self.progname, name)
+                    self.mail(self.email, subject, msg)
+                self.count('restart_failures', name, flush=True)
+                fault = fault or result
+                continue
+
+            result = starts[name]
+            if multicall.is_fault(result):
+                msg = ('Failed to start process %s after stopping it, '
+                       'exiting: %s' % (name, result))
+                self.stderr.write(str(msg))
+                if self.email:
+                    subject = '%s: failed to start process %s, exiting' % (
+                        self.progname, name)
+                    self.mail(self.email, subject, msg)
+                self.count('restart_failures', name, flush=True)
+                fault = fault or result
+                continue
+
+            self.restarts[name] = self.restarts.get(name, 0) + 1
+            self.count('restarts', name)
+
             if self.email:
-                subject = 'memmon: failed to start process %s, exiting' % name
+                now = time.asctime()
+                if reason is None:
+                    reason = ('it was consuming too much memory (%s bytes '
+                              '%s)' % (mem, self.sampler.metric.upper()))
+                msg = (
+                    '%s.py restarted the process named %s at %s because '
+                    '%s' % (self.progname, name, now, reason)
+                    )
+                subject = '%s: process %s restarted' % (self.progname, name)
                 self.mail(self.email, subject, msg)
-            raise
-
-        if self.email:
-            now = time.asctime()
-            msg = (
-                'memmon.py restarted the process named %s at %s because '
-                'it was consuming too much memory (%s bytes RSS)' % (
-                name, now, rss)
-                )
-            subject = 'memmon: process %s restarted' % name
-            self.mail(self.email, subject, msg)
+
+        if fault is not None:
+            raise fault
+
+    def count(self, stat, name, flush=False):
+        if self.stats is not None:
+            group, name = name.split(':', 1)
+            self.stats.incr(stat, tags=[('group', group), ('name', name)])
+            if flush:
+                # we're about to exit; don't wait for the end of the tick
+                self.stats.flush()
 
     def mail(self, email, subject, msg):
         body =  'To: %s\n' % self.email
@@ -235,9 +661,23 @@ def parse_size(option, value):
         
     return size
 
+def parse_number(option, value, type):
+    try:
+        return type(value)
+    except ValueError:
+        print 'Unparseable number %r for %r' % (value, option)
+        usage()
+
+def parse_address(option, value, module=exporter):
+    try:
+        return module.parse_address(value)
+    except ValueError, why:
+        print '%s for %r' % (why, option)
+        usage()
+
 def main():
     import getopt
-    short_args="hp:g:a:s:m:"
+    short_args="hp:g:a:s:m:S:TM:B:H:n:w:R:i:A:L:e:"
     long_args=[
         "help",
         "program=",
@@ -245,6 +685,21 @@ def main():
         "any=",
         "sendmail_program=",
         "email=",
+        "sampler=",
+        "tree",
+        "metric=",
+        "budget=",
+        "horizon=",
+        "samples=",
+        "window=",
+        "workers=",
+        "interval=",
+        "adaptive=",
+        "sample-limit=",
+        "metrics=",
+        "statsd=",
+        "dogstatsd",
+        "resync=",
         ]
     arguments = sys.argv[1:]
     if not arguments:
@@ -260,6 +715,21 @@ def main():
     any = None
     sendmail = '/usr/sbin/sendmail -t -i'
     email = None
+    sampler = 'auto'
+    tree = False
+    metric = 'rss'
+    budget = None
+    horizon = None
+    samples = 10
+    window = None
+    workers = 0
+    interval = None
+    adaptive_max = None
+    sample_limit = None
+    metrics = None
+    statsd_address = None
+    dogstatsd = False
+    resync = 60
 
     for option, value in opts:
 
@@ -284,8 +754,92 @@ def main():
         if option in ('-m', '--email'):
             email = value
 
-    rpc = childutils.getRPCInterface(os.environ)
-    memmon = Memmon(programs, groups, any, sendmail, email, rpc)
+        if option in ('-S', '--sampler'):
+            sampler = value
+
+        if option in ('-T', '--tree'):
+            tree = True
+
+        if option in ('-M', '--metric'):
+            metric = value
+
+        if option in ('-B', '--budget'):
+            budget = parse_number(option, value, float)
+
+        if option in ('-H', '--horizon'):
+            horizon = parse_number(option, value, float)
+
+        if option in ('-n', '--samples'):
+            samples = parse_number(option, value, int)
+            if samples < 2:
+                print 'At least 2 samples are needed for %r' % option
+                usage()
+
+        if option in ('-R', '--workers'):
+            workers = parse_number(option, value, int)
+
+        if option in ('-i', '--interval'):
+            interval = parse_number(option, value, float)
+
+        if option in ('-A', '--adaptive'):
+            adaptive_max = parse_number(option, value, float)
+
+        if option in ('-L', '--sample-limit'):
+            sample_limit = parse_number(option, value, int)
+
+        if option in ('-e', '--metrics'):
+            metrics = parse_address(option, value)
+
+        if option == '--statsd':
+            statsd_address = parse_address(option, value, statsd)
+
+        if option == '--dogstatsd':
+            dogstatsd = True
+
+        if option == '--resync':
+            resync = parse_number(option, value, float)
+
+        if option in ('-w', '--window'):
+            try:
+                window = leakrate.parse_window(value)
+            except ValueError, why:
+                print why
+                usage()
+
+    scheduler = None
+    if adaptive_max is not None:
+        scheduler = adaptive.AdaptiveScheduler(adaptive_max,
+                                               budget=sample_limit)
+
+    predictor = None
+    if horizon is not None:
+        predictor = leakrate.LeakPredictor(horizon, samples, window)
+
+    if tree and sampler == 'cgroup':
+        print 'A cgroup already accounts for the whole process tree'
+        usage()
+
+    try:
+        sampler = samplers.make_sampler(sampler, metric=metric,
+                                        budget=budget)
+    except ValueError, why:
+        print why
+        usage()
+
+    metrics_exporter = None
+    if metrics is not None:
+        metrics_exporter = exporter.MetricsExporter(*metrics)
+        metrics_exporter.start()
+
+    stats = None
+    if statsd_address is not None:
+        host, port = statsd_address
+        stats = statsd.StatsClient(host, port, 'memmon', dogstatsd)
+
+    rpc = transport.getRPCInterface(os.environ, stats)
+    memmon = Memmon(programs, groups, any, sendmail, email, rpc, sampler,
+                    tree, predictor, workers, interval, scheduler,
+                    metrics_exporter, stats, resync)
     memmon.runforever()
 
 if __name__ == '__main__':
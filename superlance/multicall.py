@@ -0,0 +1,74 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Batching of independent supervisor XML-RPC calls into system.multicall
+requests, so that restarting a hundred processes takes two round trips
+rather than two hundred.
+
+supervisord still runs the calls of a batch one after the other (a
+stopProcess waits for its process to stop before the next call starts);
+what is saved is the per-request HTTP overhead.
+"""
+
+import xmlrpclib
+
+# calls per system.multicall request; keeps request and response bodies
+# (and the time supervisord spends on one request) bounded
+BATCHSIZE = 100
+
+def unwrap(value):
+    """ A system.multicall result: a fault struct becomes an
+    xmlrpclib.Fault instance, anything else is the call's return value.
+    (supervisord returns values as they are, not wrapped in one-item
+    arrays as the multicall convention has it.) """
+    if isinstance(value, dict) and 'faultCode' in value:
+        return xmlrpclib.Fault(value['faultCode'], value.get('faultString'))
+    return value
+
+class MultiCall:
+    """ Collects calls with add() and makes them with execute(), which
+    returns one result per call, in order.  A call which failed has an
+    xmlrpclib.Fault as its result rather than raising, so one bad process
+    name doesn't hide the outcome of the others. """
+
+    def __init__(self, rpc, batchsize=BATCHSIZE):
+        self.rpc = rpc
+        self.batchsize = batchsize
+        self.calls = []
+
+    def __len__(self):
+        return len(self.calls)
+
+    def add(self, method, *params):
+        self.calls.append({'methodName': method, 'params': list(params)})
+
+    def execute(self):
+        calls, self.calls = self.calls, []
+        results = []
+        for i in range(0, len(calls), self.batchsize):
+            batch = calls[i:i + self.batchsize]
+            results.extend([ unwrap(x)
+                             for x in self.rpc.system.multicall(batch) ])
+        return results
+
+def call_each(rpc, method, names, batchsize=BATCHSIZE):
+    """ Call ``method`` once for each name, e.g.
+    call_each(rpc, 'supervisor.stopProcess', ['foo:foo', 'bar:bar']) """
+    calls = MultiCall(rpc, batchsize)
+    for name in names:
+        calls.add(method, name)
+    return calls.execute()
+
+def is_fault(result):
+    return isinstance(result, xmlrpclib.Fault)
@@ -17,6 +17,7 @@ import sys
 import smtplib
 import copy
 from email.mime.text import MIMEText
+from superlance import statsd
 from superlance.process_state_monitor import ProcessStateMonitor
 
 doc = """\
@@ -39,6 +40,12 @@ class ProcessStateEmailMonitor(ProcessStateMonitor):
                           help="source email address")
         parser.add_option("-s", "--subject", dest="subject",
                           help="email subject")
+        parser.add_option("--statsd", dest="statsd",
+                          help="[host:]port of a StatsD server to count "
+                               "events on")
+        parser.add_option("--dogstatsd", dest="dogstatsd",
+                          action="store_true", default=False,
+                          help="send DogStatsD tags to the StatsD server")
         (options, args) = parser.parse_args()
 
         if not options.toEmail:
@@ -52,7 +59,19 @@ class ProcessStateEmailMonitor(ProcessStateMonitor):
             sys.stderr.write('Must run as a supervisor event listener\n')
             sys.exit(1)
 
-        return cls(**options.__dict__)
+        kwargs = options.__dict__
+        address = kwargs.pop('statsd')
+        dogstatsd = kwargs.pop('dogstatsd')
+        if address:
+            try:
+                host, port = statsd.parse_address(address)
+            except ValueError, why:
+                parser.error(str(why))
+            kwargs['stats'] = statsd.StatsClient(host, port,
+                                                 cls.__name__.lower(),
+                                                 dogstatsd)
+
+        return cls(**kwargs)
 
     def __init__(self, **kwargs):
         ProcessStateMonitor.__init__(self, **kwargs)
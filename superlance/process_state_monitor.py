@@ -33,6 +33,7 @@ class ProcessStateMonitor:
         self.stdin = kwargs.get('stdin', sys.stdin)
         self.stdout = kwargs.get('stdout', sys.stdout)
         self.stderr = kwargs.get('stderr', sys.stderr)
+        self.stats = kwargs.get('stats', None)
         
         self.batchMsgs = []
         self.batchMins = 0
@@ -54,6 +55,16 @@ class ProcessStateMonitor:
         if msg:
             self.writeToStderr('%s\n' % msg)
             self.batchMsgs.append(msg)
+            if self.stats is not None:
+                self.countEvent(headers, payload)
+
+    def countEvent(self, headers, payload):
+        # e.g. crashmailbatch.process_state_exited
+        pheaders, pdata = childutils.eventdata(payload+'\n')
+        self.stats.incr(headers['eventname'].lower(), tags=[
+            ('group', pheaders['groupname']),
+            ('name', pheaders['processname'])])
+        self.stats.flush()
 
     """
     Override this method in child classes to customize messaging
@@ -0,0 +1,92 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+A table of supervisord's processes kept current from PROCESS_STATE events,
+so that listeners needn't call getAllProcessInfo() on every tick.
+
+The full list is fetched on first use.  After that, each PROCESS_STATE_*
+event a listener passes to handle() updates the process it names.  The
+list is fetched again when an event names an unknown process, when
+processes are added or removed (PROCESS_GROUP_* events), and in any case
+every ``resync`` seconds as a safety net against missed events.
+
+Until the listener has seen a PROCESS_STATE event (e.g. because it isn't
+subscribed to them) the table is fetched afresh on every use, just as
+the listeners used to.
+"""
+
+import time
+
+from supervisor import childutils
+from supervisor.options import make_namespec
+from supervisor.states import ProcessStates
+
+# states in which a process has a pid
+ALIVE = (ProcessStates.RUNNING, ProcessStates.STOPPING)
+
+class ProcessTable:
+    def __init__(self, rpc, resync=60, clock=time.time):
+        self.rpc = rpc
+        self.resync = resync
+        self.clock = clock
+        self.infos = []  # as returned by getAllProcessInfo, in its order
+        self.byname = {} # namespec -> info
+        self.synced = None
+        self.tracking = False # have we seen a PROCESS_STATE event yet?
+        self.stale = True
+
+    def all(self):
+        """ Process info dicts, as getAllProcessInfo() would return them """
+        if self.stale or not self.tracking or (
+            self.clock() - self.synced >= self.resync):
+            self.sync()
+        return self.infos
+
+    def sync(self):
+        # copies, since handle() updates them in place
+        infos = [ dict(x) for x in self.rpc.supervisor.getAllProcessInfo() ]
+        self.infos = infos
+        self.byname = dict([ (make_namespec(x['group'], x['name']), x)
+                             for x in infos ])
+        self.synced = self.clock()
+        self.stale = False
+
+    def handle(self, headers, payload):
+        """ Apply an event; returns True if it was one the table uses """
+        eventname = headers['eventname']
+        if eventname.startswith('PROCESS_GROUP_'):
+            self.stale = True
+            return True
+        if not eventname.startswith('PROCESS_STATE_'):
+            return False
+        self.tracking = True
+
+        statename = eventname[len('PROCESS_STATE_'):]
+        state = getattr(ProcessStates, statename, None)
+        pheaders, pdata = childutils.eventdata(payload + '\n')
+        namespec = make_namespec(pheaders['groupname'],
+                                 pheaders['processname'])
+        info = self.byname.get(namespec)
+        if info is None or state is None:
+            # added since we last synced, or a state we don't know
+            self.stale = True
+            return True
+
+        info['state'] = state
+        info['statename'] = statename
+        if state in ALIVE and 'pid' in pheaders:
+            info['pid'] = int(pheaders['pid'])
+        elif state not in ALIVE:
+            info['pid'] = 0
+        return True
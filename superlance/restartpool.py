@@ -0,0 +1,115 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+A bounded pool of worker threads which restart processes on behalf of an
+event listener, so that a slow stopProcess (long stopwaitsecs) doesn't keep
+the listener from acknowledging events.
+"""
+
+import sys
+import threading
+import Queue
+
+QUEUED = 'queued'
+RUNNING = 'in flight'
+
+class RestartPool:
+    """ Runs ``restart(name, *args, rpc=rpc)`` in one of ``workers``
+    threads.  Each worker gets its own RPC interface from ``rpcfactory``
+    because an xmlrpclib proxy must not be shared between threads.
+
+    At most one restart per process name is queued or in flight at a
+    time, and at most ``maxqueue`` restarts wait for a worker. """
+
+    def __init__(self, restart, rpcfactory, workers=4, maxqueue=64):
+        self.restart = restart
+        self.queue = Queue.Queue(maxqueue)
+        self.lock = threading.Lock()
+        self.pending = {} # name -> QUEUED or RUNNING
+        self.completed = 0
+        self.failed = 0
+        self.errors = []  # exc_info of failed restarts, see reraise()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.work, args=(rpcfactory(),))
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, name, *args):
+        """ Queue a restart; False if one is already pending for ``name``
+        or the queue is full. """
+        self.lock.acquire()
+        try:
+            if name in self.pending:
+                return False
+            try:
+                self.queue.put_nowait((name, args))
+            except Queue.Full:
+                return False
+            self.pending[name] = QUEUED
+            return True
+        finally:
+            self.lock.release()
+
+    def work(self, rpc):
+        while 1:
+            name, args = self.queue.get()
+            self.lock.acquire()
+            self.pending[name] = RUNNING
+            self.lock.release()
+            try:
+                try:
+                    self.restart(name, *args, **{'rpc': rpc})
+                except:
+                    self.lock.acquire()
+                    self.failed += 1
+                    self.errors.append(sys.exc_info())
+                    self.lock.release()
+                else:
+                    self.lock.acquire()
+                    self.completed += 1
+                    self.lock.release()
+            finally:
+                self.lock.acquire()
+                del self.pending[name]
+                self.lock.release()
+                self.queue.task_done()
+
+    def join(self):
+        """ Wait until every submitted restart has finished """
+        self.queue.join()
+
+    def reraise(self):
+        """ Re-raise the first error from a failed restart in the calling
+        thread, so a listener fails the same way it would have had it
+        restarted the process itself. """
+        self.lock.acquire()
+        try:
+            if not self.errors:
+                return
+            exc_info = self.errors.pop(0)
+        finally:
+            self.lock.release()
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    def status(self):
+        self.lock.acquire()
+        try:
+            states = self.pending.values()
+            return ('Restarts: %d queued, %d in flight, %d completed, '
+                    '%d failed' % (states.count(QUEUED), states.count(RUNNING),
+                                   self.completed, self.failed))
+        finally:
+            self.lock.release()
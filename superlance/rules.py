@@ -0,0 +1,111 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Resolution of per-process limits from -p (program), -g (group) and -a (any)
+rules.  Program and group names may be glob patterns (e.g. worker_*).
+
+Exactly one rule applies to a process, picked in this order:
+
+1. a program rule naming the process by namespec (group:name)
+2. a program rule naming the process by name
+3. a program glob pattern; a pattern containing ':' is matched against the
+   namespec, any other against the name
+4. a group rule naming the process' group
+5. a group glob pattern
+6. the any rule
+
+When several glob patterns match, the one with the most literal (non
+wildcard) characters wins, then the alphabetically first.
+"""
+
+import fnmatch
+import re
+
+PROGRAM = 'program'
+GROUP = 'group'
+ANY = 'any'
+
+def is_glob(name):
+    for c in '*?[':
+        if c in name:
+            return True
+    return False
+
+def specificity(pattern):
+    literal = re.sub(r'\[[^]]*\]|[*?]', '', pattern)
+    return len(literal)
+
+def compile_patterns(rules):
+    """ Split a {name: limit} dict into exact names and a list of
+    (pattern, match, limit) in the order they should be tried. """
+    exact = {}
+    patterns = []
+    for name, limit in rules.items():
+        if is_glob(name):
+            match = re.compile(fnmatch.translate(name)).match
+            patterns.append((-specificity(name), name, match, limit))
+        else:
+            exact[name] = limit
+    patterns.sort()
+    return exact, [ x[1:] for x in patterns ]
+
+class Rules:
+    """ Compiled program/group/any rules.  resolve() results are cached per
+    process and the cache is dropped whenever refresh() sees a different
+    set of processes. """
+
+    def __init__(self, programs, groups, any):
+        self.programs, self.program_patterns = compile_patterns(programs)
+        self.groups, self.group_patterns = compile_patterns(groups)
+        self.any = any
+        self.cache = {}
+        self.processes = None
+
+    def refresh(self, infos):
+        processes = [ (x['group'], x['name']) for x in infos ]
+        processes.sort()
+        if processes != self.processes:
+            self.processes = processes
+            self.cache = {}
+
+    def resolve(self, group, name):
+        """ Returns (kind, rule name, limit) of the rule which applies to
+        the process, or None.  The rule name of the any rule is None. """
+        key = (group, name)
+        try:
+            return self.cache[key]
+        except KeyError:
+            result = self.cache[key] = self._resolve(group, name)
+            return result
+
+    def _resolve(self, group, name):
+        namespec = '%s:%s' % (group, name)
+        for n in namespec, name:
+            if n in self.programs:
+                return PROGRAM, n, self.programs[n]
+        for pattern, match, limit in self.program_patterns:
+            if ':' in pattern:
+                subject = namespec
+            else:
+                subject = name
+            if match(subject):
+                return PROGRAM, pattern, limit
+        if group in self.groups:
+            return GROUP, group, self.groups[group]
+        for pattern, match, limit in self.group_patterns:
+            if match(group):
+                return GROUP, pattern, limit
+        if self.any is not None:
+            return ANY, None, self.any
+        return None
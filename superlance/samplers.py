@@ -0,0 +1,493 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+Memory samplers used by memmon.  A sampler turns a list of pids into a
+mapping of pid -> resident memory in bytes.  Pids which vanished between
+getAllProcessInfo() and sampling are simply left out of the mapping.
+
+Every sampler has a ``metric`` naming what it measures ('rss', 'pss',
+'uss', 'anon' or 'swap').  The cpu sampler, used by cpumon, measures CPU
+usage as a percentage of one CPU instead.
+
+Samplers also provide ppids(), a pid -> parent pid mapping of every
+process on the system, from which a ProcessTree is built for whole
+process-tree accounting.
+"""
+
+import errno
+import os
+import time
+
+def shell(cmd):
+    return os.popen(cmd).read()
+
+def ps_pairs(data):
+    """ Parse lines of two integer columns, skipping anything else """
+    for line in data.splitlines():
+        try:
+            first, second = line.split()
+            yield int(first), int(second)
+        except ValueError:
+            continue
+
+def ps_ppids(ppidcommand):
+    return dict(ps_pairs(shell(ppidcommand)))
+
+class ProcessTree:
+    """ A parent -> children index over one snapshot of the process
+    table.  Build it once per tick and share it between all processes. """
+
+    def __init__(self, ppids):
+        self.children = {}
+        for pid, ppid in ppids.items():
+            self.children.setdefault(ppid, []).append(pid)
+
+    def descendants(self, pid):
+        """ pid and all of its (transitive) children """
+        result = []
+        stack = [pid]
+        seen = {}
+        while stack:
+            pid = stack.pop()
+            if pid in seen:
+                continue
+            seen[pid] = True
+            result.append(pid)
+            stack.extend(self.children.get(pid, ()))
+        return result
+
+class PSSampler:
+    """ Runs ``ps`` once for every pid.  Works anywhere ``ps`` does, but
+    costs one fork/exec per process per sample. """
+    name = 'ps'
+    metric = 'rss'
+    ppidcommand = 'ps -A -o pid=,ppid='
+
+    def __init__(self, pscommand='ps -orss= -p %s'):
+        self.pscommand = pscommand
+
+    def ppids(self):
+        return ps_ppids(self.ppidcommand)
+
+    def sample(self, pids):
+        result = {}
+        for pid in pids:
+            data = shell(self.pscommand % pid)
+            if not data:
+                # no such pid (deal with race conditions)
+                continue
+            try:
+                result[pid] = int(data.strip()) * 1024 # rss is in KB
+            except ValueError:
+                # line doesn't contain any data, or rss cant be intified
+                continue
+        return result
+
+class BatchPSSampler:
+    """ Runs a single ``ps`` for all pids (split into several invocations
+    only when the pid list would exceed ``maxlen`` characters). """
+    name = 'psbatch'
+    metric = 'rss'
+    ppidcommand = 'ps -A -o pid=,ppid='
+
+    def __init__(self, pscommand='ps -o pid=,rss= -p %s', maxlen=16384):
+        self.pscommand = pscommand
+        self.maxlen = maxlen
+
+    def ppids(self):
+        return ps_ppids(self.ppidcommand)
+
+    def chunks(self, pids):
+        chunk = []
+        size = 0
+        for pid in pids:
+            pid = str(pid)
+            if chunk and size + len(pid) + 1 > self.maxlen:
+                yield ','.join(chunk)
+                chunk = []
+                size = 0
+            chunk.append(pid)
+            size += len(pid) + 1
+        if chunk:
+            yield ','.join(chunk)
+
+    def sample(self, pids):
+        wanted = dict([ (int(pid), pid) for pid in pids ])
+        result = {}
+        for chunk in self.chunks(pids):
+            for pid, rss in ps_pairs(shell(self.pscommand % chunk)):
+                if pid in wanted:
+                    result[wanted[pid]] = rss * 1024 # rss is in KB
+        return result
+
+class ProcSampler:
+    """ Reads ``/proc/<pid>/statm`` in-process (Linux).  No processes are
+    spawned, so the cost of a sample is a few syscalls per pid. """
+    name = 'proc'
+    metric = 'rss'
+
+    def __init__(self, procroot='/proc', pagesize=None):
+        self.procroot = procroot
+        if pagesize is None:
+            pagesize = os.sysconf('SC_PAGE_SIZE')
+        self.pagesize = pagesize
+
+    def read(self, pid, filename):
+        f = open(os.path.join(self.procroot, str(pid), filename))
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def ppids(self):
+        result = {}
+        for name in os.listdir(self.procroot):
+            if not name.isdigit():
+                continue
+            try:
+                # stat: pid (comm) state ppid ...; comm may contain spaces
+                stat = self.read(name, 'stat')
+                ppid = stat[stat.rindex(')') + 2:].split()[1]
+                result[int(name)] = int(ppid)
+            except (IOError, OSError, IndexError, ValueError):
+                continue
+        return result
+
+    def sample(self, pids):
+        result = {}
+        for pid in pids:
+            try:
+                # statm: size resident shared text lib data dt (in pages)
+                resident = self.read(pid, 'statm').split()[1]
+                result[pid] = int(resident) * self.pagesize
+            except (IOError, OSError, IndexError, ValueError):
+                # pid went away or isn't readable
+                continue
+        return result
+
+# smaps fields (in kB) which add up to each metric
+SMAPS_FIELDS = {
+    'rss': ('Rss:',),
+    'pss': ('Pss:',),
+    'uss': ('Private_Clean:', 'Private_Dirty:'),
+    'anon': ('Anonymous:',),
+    'swap': ('Swap:',),
+    }
+
+METRICS = ('rss', 'pss', 'uss', 'anon', 'swap')
+
+class SmapsSampler(ProcSampler):
+    """ Reads ``/proc/<pid>/smaps_rollup`` (Linux 4.14+), or sums
+    ``/proc/<pid>/smaps`` on older kernels, to measure proportional (pss),
+    unique (uss), anonymous or swapped memory.
+
+    smaps is expensive to read for large processes, so ``budget`` caps the
+    seconds spent sampling per call.  Pids not reached within the budget
+    keep their previous value, and are the first to be sampled next call.
+    """
+    name = 'smaps'
+
+    def __init__(self, metric, procroot='/proc', budget=None, clock=None):
+        ProcSampler.__init__(self, procroot, pagesize=1)
+        if metric not in SMAPS_FIELDS:
+            raise ValueError('Unknown metric %r' % metric)
+        self.metric = metric
+        self.fields = dict([ (f, True) for f in SMAPS_FIELDS[metric] ])
+        self.budget = budget
+        if clock is None:
+            clock = time.time
+        self.clock = clock
+        self.rollup = None # unknown until the first read
+        self.values = {}   # pid -> bytes, as of the last read
+        self.sampled = {}  # pid -> when it was last read
+
+    def parse(self, f):
+        fields = self.fields
+        total = 0
+        for line in f:
+            # field lines look like "Pss:                 123 kB"; the
+            # mapping header lines never have a known field name
+            i = line.find(':') + 1
+            if i and line[:i] in fields:
+                total += int(line[i:].split()[0])
+        return total * 1024
+
+    def read_metric(self, pid):
+        if self.rollup is not False:
+            try:
+                f = open(os.path.join(self.procroot, str(pid),
+                                      'smaps_rollup'))
+            except IOError, why:
+                if why.errno != errno.ENOENT or self.rollup:
+                    raise
+                if not os.path.exists(os.path.join(self.procroot, str(pid))):
+                    raise
+                # the pid exists, the kernel just doesn't have rollups
+                self.rollup = False
+            else:
+                self.rollup = True
+                try:
+                    return self.parse(f)
+                finally:
+                    f.close()
+        f = open(os.path.join(self.procroot, str(pid), 'smaps'))
+        try:
+            return self.parse(f)
+        finally:
+            f.close()
+
+    def sample(self, pids):
+        sampled = self.sampled
+        # never-sampled pids first, then the stalest
+        order = [ (sampled.get(pid, None), pid) for pid in pids ]
+        order.sort()
+
+        start = self.clock()
+        values = {}
+        for when, pid in order:
+            if (self.budget is not None and values and
+                self.clock() - start >= self.budget):
+                break
+            try:
+                values[pid] = self.read_metric(pid)
+            except (IOError, OSError, IndexError, ValueError):
+                continue
+            sampled[pid] = self.clock()
+
+        result = {}
+        for pid in pids:
+            if pid in values:
+                result[pid] = values[pid]
+            elif pid in self.values:
+                result[pid] = self.values[pid]
+        self.values = result.copy()
+        for pid in sampled.keys():
+            if pid not in result:
+                del sampled[pid]
+        return result
+
+class CgroupSampler:
+    """ Reads ``memory.current`` of each process' cgroup (cgroup v2).  A
+    cgroup's accounting covers every process in it, and is far cheaper to
+    read than walking the pids.
+
+    Each pid's cgroup is discovered from ``/proc/<pid>/cgroup`` once and
+    cached.  A cgroup is only used for a pid if every process in it (as
+    listed in ``cgroup.procs``) is that pid or one of its descendants, and
+    if it isn't our own (i.e. supervisord's) cgroup; other pids are
+    measured with the ``fallback`` sampler.
+
+    Increases of ``oom_kill`` in ``memory.events`` are collected, and handed
+    out by oom_kills().
+    """
+    name = 'cgroup'
+    # memory.current is the resident memory charged to the cgroup, and
+    # the fallback measures RSS, so both are reported as RSS
+    metric = 'rss'
+
+    def __init__(self, procroot='/proc', cgroot=None, fallback=None):
+        self.procroot = procroot
+        if cgroot is None:
+            cgroot = find_cgroup2()
+        self.cgroot = cgroot
+        if fallback is None:
+            fallback = ProcSampler(procroot)
+        self.fallback = fallback
+        self.cgroups = {} # pid -> cgroup path ('' if it has none)
+        self.ooms = {}    # cgroup path -> last seen oom_kill count
+        self.events = []  # (pid, cgroup path, kills) not yet handed out
+        try:
+            self.own = self.read_cgroup('self')
+        except (IOError, OSError):
+            self.own = ''
+
+    def ppids(self):
+        return self.fallback.ppids()
+
+    def read_cgroup(self, pid):
+        f = open(os.path.join(self.procroot, str(pid), 'cgroup'))
+        try:
+            for line in f:
+                # the v2 hierarchy is "0::/path"
+                parts = line.rstrip('\n').split(':', 2)
+                if len(parts) == 3 and parts[0] == '0' and not parts[1]:
+                    return parts[2]
+        finally:
+            f.close()
+        return ''
+
+    def read(self, path, filename):
+        f = open(os.path.join(self.cgroot, path.lstrip('/'), filename))
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def exclusive(self, pid, path, tree):
+        """ Is every process in the cgroup ``path`` pid or a descendant of
+        it?  ``tree`` is a one-item list holding the ProcessTree, built the
+        first time it is needed. """
+        procs = [ int(x) for x in self.read(path, 'cgroup.procs').split() ]
+        others = [ x for x in procs if x != pid ]
+        if not others:
+            return True
+        if not tree:
+            tree.append(ProcessTree(self.fallback.ppids()))
+        family = dict.fromkeys(tree[0].descendants(pid))
+        for other in others:
+            if other not in family:
+                return False
+        return True
+
+    def check_events(self, pid, path):
+        for line in self.read(path, 'memory.events').splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[0] == 'oom_kill':
+                count = int(parts[1])
+                previous = self.ooms.get(path)
+                self.ooms[path] = count
+                if previous is not None and count > previous:
+                    self.events.append((pid, path, count - previous))
+
+    def oom_kills(self):
+        events = self.events
+        self.events = []
+        return events
+
+    def sample(self, pids):
+        members = {}
+        for pid in pids:
+            path = self.cgroups.get(pid)
+            if path is None:
+                try:
+                    path = self.cgroups[pid] = self.read_cgroup(pid)
+                except (IOError, OSError):
+                    # pid went away
+                    continue
+            if path and path != '/' and path != self.own:
+                members.setdefault(path, []).append(pid)
+
+        result = {}
+        rest = []
+        tree = []
+        for pid in pids:
+            path = self.cgroups.get(pid)
+            if path in members and len(members[path]) == 1:
+                try:
+                    if self.exclusive(pid, path, tree):
+                        result[pid] = int(self.read(path, 'memory.current'))
+                        self.check_events(pid, path)
+                        continue
+                except (IOError, OSError, ValueError):
+                    pass
+            rest.append(pid)
+        result.update(self.fallback.sample(rest))
+
+        wanted = dict.fromkeys(pids)
+        for pid in self.cgroups.keys():
+            if pid not in wanted:
+                del self.cgroups[pid]
+        for path in self.ooms.keys():
+            if path not in members:
+                del self.ooms[path]
+        return result
+
+class CPUSampler(ProcSampler):
+    """ Reads utime + stime from ``/proc/<pid>/stat`` and reports the CPU
+    used since the previous sample, as a percentage of one CPU.  A pid's
+    first sample only primes its counters, so it is left out of the
+    result.
+
+    Previous counters are kept per (pid, start time): a reused pid is a
+    different process and starts afresh rather than yielding a bogus
+    (even negative) delta. """
+    name = 'cpu'
+    metric = 'cpu'
+
+    def __init__(self, procroot='/proc', clktck=None, clock=None):
+        ProcSampler.__init__(self, procroot, pagesize=1)
+        if clktck is None:
+            clktck = os.sysconf('SC_CLK_TCK')
+        self.clktck = float(clktck)
+        if clock is None:
+            clock = time.time
+        self.clock = clock
+        self.previous = {} # (pid, start time) -> (cpu ticks, when)
+
+    def read_times(self, pid):
+        """ (start time, utime + stime), both in clock ticks """
+        stat = self.read(pid, 'stat')
+        # fields after comm, starting with state (field 3 of proc(5))
+        fields = stat[stat.rindex(')') + 2:].split()
+        return int(fields[19]), int(fields[11]) + int(fields[12])
+
+    def sample(self, pids):
+        result = {}
+        previous = {}
+        for pid in pids:
+            try:
+                start, ticks = self.read_times(pid)
+            except (IOError, OSError, IndexError, ValueError):
+                continue
+            now = self.clock()
+            key = (pid, start)
+            previous[key] = (ticks, now)
+            last = self.previous.get(key)
+            if last is None or now <= last[1]:
+                continue
+            used = (ticks - last[0]) / self.clktck
+            result[pid] = round(100 * used / (now - last[1]), 1)
+        # only the pids sampled this time are remembered
+        self.previous = previous
+        return result
+
+def find_cgroup2(candidates=('/sys/fs/cgroup', '/sys/fs/cgroup/unified')):
+    """ The mount point of the cgroup v2 hierarchy, or None """
+    for path in candidates:
+        if os.path.exists(os.path.join(path, 'cgroup.controllers')):
+            return path
+    return None
+
+def have_proc(procroot='/proc'):
+    return os.path.exists(os.path.join(procroot, 'self', 'statm'))
+
+def make_sampler(name='auto', procroot='/proc', metric='rss', budget=None):
+    if name == 'cgroup':
+        if metric != 'rss':
+            raise ValueError('The cgroup sampler measures memory.current '
+                             'and cannot measure %s' % metric)
+        if not have_proc(procroot) or find_cgroup2() is None:
+            raise ValueError('The cgroup sampler requires /proc and a '
+                             'cgroup v2 hierarchy')
+        return CgroupSampler(procroot)
+    if metric != 'rss':
+        if name not in ('auto', 'proc', 'smaps'):
+            raise ValueError('The %s sampler can only measure rss' % name)
+        if not have_proc(procroot):
+            raise ValueError('Measuring %s requires /proc' % metric)
+        return SmapsSampler(metric, procroot, budget)
+    if name == 'smaps':
+        return SmapsSampler(metric, procroot, budget)
+    if name == 'auto':
+        if have_proc(procroot):
+            name = 'proc'
+        else:
+            name = 'psbatch'
+    if name == 'proc':
+        return ProcSampler(procroot)
+    if name == 'psbatch':
+        return BatchPSSampler()
+    if name == 'ps':
+        return PSSampler()
+    raise ValueError('Unknown sampler %r' % name)
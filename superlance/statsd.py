@@ -0,0 +1,120 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+A StatsD / DogStatsD client shared by the superlance listeners.
+
+Metrics are buffered and sent by flush(), which listeners call once per
+event (or tick), packing as many metrics as fit into each UDP datagram.
+Sending is fire-and-forget: a missing or unreachable StatsD server never
+affects the listener.
+
+Tags are (name, value) pairs.  A DogStatsD server gets them as tags; for
+plain StatsD their values are appended to the metric name instead, e.g.
+memmon.rss.mygroup.myprocess, with any dots and slashes in them replaced
+so that each value is one level of a Graphite path.
+"""
+
+import re
+import socket
+import threading
+
+# the largest UDP payload which fits an Ethernet frame without IP
+# fragmentation: 1500 - 20 (IPv4 header) - 8 (UDP header), with a margin
+# for IP options and tunnels
+MAXSIZE = 1432
+
+def sanitize(name):
+    """ Replace the characters StatsD uses as separators """
+    return re.sub(r'[:|@#,\s]', '_', str(name))
+
+def sanitize_part(value):
+    """ Also replace the characters Graphite splits a metric name at, for
+    a tag value which becomes one part of the name """
+    return re.sub(r'[./]', '_', sanitize(value))
+
+class StatsClient:
+    def __init__(self, host='127.0.0.1', port=8125, prefix='',
+                 dogstatsd=False, maxsize=MAXSIZE):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.dogstatsd = dogstatsd
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.sent = 0 # datagrams, for unit tests and diagnostics
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def gauge(self, name, value, tags=()):
+        self.add(name, value, 'g', tags)
+
+    def incr(self, name, count=1, tags=()):
+        self.add(name, count, 'c', tags)
+
+    def timing(self, name, ms, tags=()):
+        self.add(name, ms, 'ms', tags)
+
+    def add(self, name, value, kind, tags=()):
+        if self.prefix:
+            name = '%s.%s' % (self.prefix, name)
+        if isinstance(value, float):
+            value = '%.3f' % value
+        if not tags:
+            line = '%s:%s|%s' % (sanitize(name), value, kind)
+        elif self.dogstatsd:
+            line = '%s:%s|%s|#%s' % (sanitize(name), value, kind, ','.join(
+                [ '%s:%s' % (sanitize(k), sanitize(v)) for k, v in tags ]))
+        else:
+            name = '.'.join([name] + [ sanitize_part(v) for k, v in tags ])
+            line = '%s:%s|%s' % (sanitize(name), value, kind)
+        self.lock.acquire()
+        self.buffer.append(line)
+        self.lock.release()
+
+    def packets(self, lines):
+        """ Join lines into as few newline-separated packets of at most
+        maxsize bytes as possible (a longer line is sent on its own) """
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + 1 + len(line) > self.maxsize:
+                yield '\n'.join(packet)
+                packet = []
+                size = 0
+            if packet:
+                size += 1
+            packet.append(line)
+            size += len(line)
+        if packet:
+            yield '\n'.join(packet)
+
+    def flush(self):
+        self.lock.acquire()
+        lines, self.buffer = self.buffer, []
+        self.lock.release()
+        for packet in self.packets(lines):
+            try:
+                self.sock.sendto(packet, self.address)
+            except socket.error:
+                continue
+            self.sent += 1
+
+def parse_address(value):
+    """ Parse '[host:]port' into a (host, port) pair; host defaults to
+    127.0.0.1 """
+    host, sep, port = value.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('Bad address %r, expected [host:]port' % value)
+    return host or '127.0.0.1', port
@@ -0,0 +1,62 @@
+import unittest
+
+class AdaptiveSchedulerTests(unittest.TestCase):
+    def _getTargetClass(self):
+        from superlance.adaptive import AdaptiveScheduler
+        return AdaptiveScheduler
+
+    def _makeOne(self, *arg, **kw):
+        return self._getTargetClass()(*arg, **kw)
+
+    def test_new_keys_due_right_away(self):
+        scheduler = self._makeOne(60)
+        self.assertEqual(sorted(scheduler.due([1, 2], 100)), [1, 2])
+        # still due until measured
+        self.assertEqual(sorted(scheduler.due([1, 2], 100)), [1, 2])
+
+    def test_update_reschedules(self):
+        scheduler = self._makeOne(60)
+        scheduler.due([1], 100)
+        interval = scheduler.update(1, 100, 250, 1000)
+        self.assertEqual(interval, 45.0)
+        self.assertEqual(scheduler.due([1], 144), [])
+        self.assertEqual(scheduler.due([1], 145), [1])
+
+    def test_budget(self):
+        scheduler = self._makeOne(60, budget=2)
+        self.assertEqual(scheduler.due([1, 2, 3], 100), [1, 2])
+        scheduler.update(1, 100, 0, 1000)
+        scheduler.update(2, 100, 0, 1000)
+        # the leftover goes first
+        self.assertEqual(scheduler.due([1, 2, 3], 101), [3])
+
+    def test_interval_over_limit(self):
+        scheduler = self._makeOne(60, mininterval=1)
+        self.assertEqual(scheduler.interval(1, 100, 1000, 1000), 1)
+        self.assertEqual(scheduler.interval(1, 100, 10, 0), 1)
+
+    def test_interval_growth(self):
+        scheduler = self._makeOne(60)
+        scheduler.update(1, 100, 0, 1000)
+        # 10 bytes/second with 900 bytes to go: 90 seconds to the limit
+        self.assertEqual(scheduler.interval(1, 110, 100, 1000), 22.5)
+        # shrinking doesn't shorten the interval
+        self.assertEqual(scheduler.interval(1, 110, 0, 1000), 60.0)
+
+    def test_forgets_keys(self):
+        scheduler = self._makeOne(60)
+        scheduler.due([1, 2], 100)
+        scheduler.update(1, 100, 0, 1000)
+        self.assertEqual(scheduler.due([2], 200), [2])
+        self.assertEqual(scheduler.next.keys(), [2])
+        self.assertEqual(scheduler.last, {})
+
+    def test_compact(self):
+        scheduler = self._makeOne(0.5)
+        for i in range(100):
+            scheduler.due([1], i)
+            scheduler.update(1, i, 0, 1000)
+        self.failUnless(len(scheduler.heap) <= 2 + 16)
+
+if __name__ == '__main__':
+    unittest.main()
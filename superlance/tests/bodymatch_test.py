@@ -0,0 +1,108 @@
+import unittest
+
+class DummyBody:
+    def __init__(self, body):
+        self.body = body
+        self.offset = 0
+        self.reads = 0
+
+    def read(self, amt):
+        self.reads += 1
+        data = self.body[self.offset:self.offset + amt]
+        self.offset += len(data)
+        return data
+
+class BodyMatcherTests(unittest.TestCase):
+    def _getTargetClass(self):
+        from superlance.bodymatch import BodyMatcher
+        return BodyMatcher
+
+    def _makeOne(self, pattern, **kw):
+        return self._getTargetClass()(pattern, **kw)
+
+    def test_found(self):
+        matcher = self._makeOne('tasty', chunksize=4)
+        res = DummyBody('very tasty indeed')
+        self.assertEqual(matcher.scan(res), (True, True))
+        # the rest is read, so the connection can be used again
+        self.assertEqual(res.offset, 17)
+        self.failUnless(matcher.passes(True))
+
+    def test_found_maxbytes(self):
+        matcher = self._makeOne('tasty', chunksize=4, maxbytes=10)
+        res = DummyBody('tasty' + 'x' * 100)
+        self.assertEqual(matcher.scan(res), (True, False))
+        self.failUnless(res.offset < 100)
+
+    def test_straddles_chunks(self):
+        for chunksize in range(1, 8):
+            matcher = self._makeOne('tasty', chunksize=chunksize)
+            self.assertEqual(matcher.scan(DummyBody('xxtastyxx')),
+                             (True, True), chunksize)
+
+    def test_not_found(self):
+        matcher = self._makeOne('tasty', chunksize=4)
+        res = DummyBody('tast ytas ty')
+        self.assertEqual(matcher.scan(res), (False, True))
+        self.failIf(matcher.passes(False))
+
+    def test_empty_body(self):
+        matcher = self._makeOne('tasty')
+        self.assertEqual(matcher.scan(DummyBody('')), (False, True))
+
+    def test_maxbytes(self):
+        matcher = self._makeOne('tasty', chunksize=4, maxbytes=10)
+        res = DummyBody('x' * 10 + 'tasty')
+        self.assertEqual(matcher.scan(res), (False, False))
+        self.assertEqual(res.offset, 11)
+
+    def test_maxbytes_whole_body(self):
+        matcher = self._makeOne('tasty', chunksize=4, maxbytes=10)
+        self.assertEqual(matcher.scan(DummyBody('x' * 10)), (False, True))
+
+    def test_regex(self):
+        matcher = self._makeOne(r'"status":\s*"ok"', regex=True,
+                                chunksize=8)
+        self.assertEqual(matcher.scan(DummyBody('{"db": 1, "status": "ok"}')),
+                         (True, True))
+        self.assertEqual(matcher.scan(DummyBody('{"status": "down"}')),
+                         (False, True))
+
+    def test_regex_bad(self):
+        self.assertRaises(ValueError, self._makeOne, '(', regex=True)
+
+    def test_regex_overlap(self):
+        body = 'x' * 20 + 'abcdef' + 'x' * 20
+        matcher = self._makeOne('a.*f', regex=True, chunksize=4, overlap=8)
+        self.assertEqual(matcher.scan(DummyBody(body)), (True, True))
+        # a match longer than the overlap is missed
+        matcher = self._makeOne('a.*f', regex=True, chunksize=4, overlap=2)
+        self.assertEqual(matcher.scan(DummyBody(body)), (False, True))
+
+    def test_negate(self):
+        matcher = self._makeOne('Traceback', negate=True)
+        self.failIf(matcher.passes(True))
+        self.failUnless(matcher.passes(False))
+
+    def test_str(self):
+        self.assertEqual(str(self._makeOne('ok')), "must contain 'ok'")
+        self.assertEqual(str(self._makeOne('o+k', regex=True, negate=True)),
+                         "must not match 'o+k'")
+
+class DrainTests(unittest.TestCase):
+    def _callFUT(self, res, maxbytes):
+        from superlance.bodymatch import drain
+        return drain(res, maxbytes, chunksize=4)
+
+    def test_complete(self):
+        res = DummyBody('x' * 10)
+        self.assertEqual(self._callFUT(res, 10), True)
+        self.assertEqual(res.offset, 10)
+
+    def test_too_long(self):
+        res = DummyBody('x' * 100)
+        self.assertEqual(self._callFUT(res, 10), False)
+        self.failUnless(res.offset < 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+from StringIO import StringIO
+from superlance.tests.dummy import *
+
+class CpumonTests(unittest.TestCase):
+    def _getTargetClass(self):
+        from superlance.cpumon import Cpumon
+        return Cpumon
+
+    def _makeOne(self, *opts, **kw):
+        return self._getTargetClass()(*opts, **kw)
+
+    def _makeOnePopulated(self, programs, groups, any, values, samples=3):
+        rpc = DummyRPCServer()
+        sendmail = 'cat - > /dev/null'
+        email = 'chrism@plope.com'
+        cpumon = self._makeOne(programs, groups, any, sendmail, email, rpc,
+                               DummySampler(values), samples=samples)
+        cpumon.sampler.metric = 'cpu'
+        cpumon.stdin = StringIO()
+        cpumon.stdout = StringIO()
+        cpumon.stderr = StringIO()
+        return cpumon
+
+    def _tick(self, cpumon, count=1):
+        cpumon.stdin.write('eventname:TICK len:0\n' * count)
+        cpumon.stdin.seek(0)
+        for i in range(count):
+            cpumon.runforever(test=True)
+        return cpumon.stderr.getvalue().split('\n')
+
+    def test_runforever_tick_sustained(self):
+        cpumon = self._makeOnePopulated({'foo': 90.0}, {}, None,
+                                        {11: 99.5}, samples=2)
+        lines = self._tick(cpumon, 2)
+        self.assertEqual(lines, [
+            'Checking programs foo=90.0',
+            'CPU of foo:foo is 99.5',
+            'CPU of foo:foo over its limit of 90.0% for 1 of 2 samples',
+            'Checking programs foo=90.0',
+            'CPU of foo:foo is 99.5',
+            'Restarting foo:foo',
+            '',
+            ])
+        mailed = cpumon.mailed.split('\n')
+        self.assertEqual(mailed[1], 'Subject: cpumon: process foo:foo restarted')
+        self.failUnless(mailed[3].startswith(
+            'cpumon.py restarted the process named foo:foo'))
+        self.failUnless(mailed[3].endswith(
+            'its CPU usage was over its limit of 90.0% for 2 consecutive '
+            'samples (99.5% when last measured)'))
+        self.assertEqual(cpumon.over, {})
+
+    def test_runforever_tick_not_sustained(self):
+        cpumon = self._makeOnePopulated({}, {}, 90.0, {11: 99.5}, samples=2)
+        self._tick(cpumon)
+        self.assertEqual(cpumon.over, {'foo:foo': 1})
+        cpumon.sampler.values[11] = 10.0
+        self._tick(cpumon)
+        self.assertEqual(cpumon.over, {})
+        self.assertEqual(cpumon.mailed, False)
+
+    def test_runforever_tick_first_sample(self):
+        # the first sample of a process primes the sampler; no value yet
+        cpumon = self._makeOnePopulated({}, {}, 90.0, {})
+        lines = self._tick(cpumon)
+        self.assertEqual(lines, ['Checking any=90.0', ''])
+
+    def test_watch_forgets_processes(self):
+        cpumon = self._makeOnePopulated({'foo': 90.0}, {}, None, {})
+        cpumon.over = {'foo:foo': 1, 'gone:gone': 2}
+        cpumon.watch(cpumon.rpc.supervisor.getAllProcessInfo())
+        self.assertEqual(cpumon.over, {'foo:foo': 1})
+
+class ParsePercentTests(unittest.TestCase):
+    def _callFUT(self, value):
+        from superlance.cpumon import parse_percent
+        return parse_percent('-a', value)
+
+    def test_plain(self):
+        self.assertEqual(self._callFUT('90'), 90.0)
+
+    def test_percent_sign(self):
+        self.assertEqual(self._callFUT('150%'), 150.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import sys
 import unittest
 from StringIO import StringIO
+from superlance.tests.dummy import DummyStats
 
 class CrashMailTests(unittest.TestCase):
     def _getTargetClass(self):
@@ -79,5 +80,19 @@ class CrashMailTests(unittest.TestCase):
         self.failUnless(
             'Process foo in group bar exited unexpectedly' in mail)
 
+    def test_runforever_unexpected_exit_statsd(self):
+        prog = self._makeOnePopulated(['foo'], None)
+        prog.stats = DummyStats()
+        payload=('expected:0 processname:foo groupname:bar '
+                 'from_state:RUNNING pid:1')
+        prog.stdin.write(
+            'eventname:PROCESS_STATE_EXITED len:%s\n' % len(payload))
+        prog.stdin.write(payload)
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        self.assertEqual(prog.stats.metrics, [
+            ('crashes', 1, 'c', [('group', 'bar'), ('name', 'foo')])])
+        self.assertEqual(prog.stats.flushed, 1)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
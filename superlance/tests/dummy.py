@@ -1,17 +1,135 @@
 class DummyRPCServer:
     def __init__(self):
         self.supervisor = DummySupervisorRPCNamespace()
-        self.system = DummySystemRPCNamespace()
+        self.system = DummySystemRPCNamespace(self)
 
 class DummyResponse:
     status = 200
     reason = 'OK'
     body = 'OK'
-    def read(self):
-        return self.body 
+    will_close = False
+    offset = 0
+    def read(self, amt=None):
+        if amt is None:
+            amt = len(self.body)
+        data = self.body[self.offset:self.offset + amt]
+        self.offset += len(data)
+        return data
+
+class DummyConnection:
+    """ Stands in for timeoutconn's connection classes; configure it with
+    make_connection().  Every connection made is added to ``made``. """
+    response = None # a copy of it answers each request (or a DummyResponse)
+    exc = None      # raised by every request
+    failures = None # raised (if not None) by each request in turn
+    statuses = None # the status of each response in turn, then the last
+    ports = None    # port -> status of its responses (default 200)
+    delay = 0       # seconds to wait for each response
+    peercert = None # the TLS certificate the server presented
+    made = ()
+
+    def __init__(self, hostport, context=None):
+        self.hostport = hostport
+        self.context = context
+        self.requests = 0
+        self.closed = False
+        self.made.append(self)
+
+    def request(self, method, path):
+        self.requests += 1
+        self.method = method
+        self.path = path
+        if self.exc is not None:
+            raise self.exc
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure is not None:
+                raise failure
+
+    def getresponse(self):
+        import copy
+        if self.delay:
+            time.sleep(self.delay)
+        response = copy.copy(self.response or DummyResponse())
+        if self.statuses:
+            response.status = self.statuses[0]
+            if len(self.statuses) > 1:
+                self.statuses.pop(0)
+        if self.ports is not None:
+            port = int(self.hostport.split(':')[1])
+            response.status = self.ports.get(port, 200)
+        return response
+
+    def close(self):
+        self.closed = True
+
+def make_connection(response=None, **kw):
+    """ A DummyConnection class answering with ``response``; the keyword
+    arguments set its other class attributes """
+    class Connection(DummyConnection):
+        pass
+    Connection.response = response
+    Connection.made = []
+    for name, value in kw.items():
+        setattr(Connection, name, value)
+    return Connection
         
 class DummySystemRPCNamespace:
-    pass
+    def __init__(self, rpc=None):
+        self.rpc = rpc
+        self.multicalls = []
+
+    def multicall(self, calls):
+        from xmlrpclib import Fault
+        self.multicalls.append(calls)
+        results = []
+        for call in calls:
+            namespace, method = call['methodName'].split('.')
+            method = getattr(getattr(self.rpc, namespace), method)
+            try:
+                results.append(method(*call['params']))
+            except Fault, e:
+                results.append({'faultCode': e.faultCode,
+                                'faultString': e.faultString})
+        return results
+
+class DummySampler:
+    name = 'dummy'
+    metric = 'rss'
+    def __init__(self, values, ppids=None):
+        self.values = values
+        if ppids is None:
+            ppids = {}
+        self._ppids = ppids
+        self.sampled = []
+
+    def ppids(self):
+        return self._ppids
+
+    def sample(self, pids):
+        self.sampled.append(sorted(pids))
+        result = {}
+        for pid in pids:
+            if pid in self.values:
+                result[pid] = self.values[pid]
+        return result
+
+class DummyStats:
+    def __init__(self):
+        self.metrics = []
+        self.flushed = 0
+
+    def gauge(self, name, value, tags=()):
+        self.metrics.append((name, value, 'g', list(tags)))
+
+    def incr(self, name, count=1, tags=()):
+        self.metrics.append((name, count, 'c', list(tags)))
+
+    def timing(self, name, ms, tags=()):
+        self.metrics.append((name, ms, 'ms', list(tags)))
+
+    def flush(self):
+        self.flushed += 1
 
 
 import time
@@ -0,0 +1,70 @@
+import unittest
+
+class RenderTests(unittest.TestCase):
+    def _callFUT(self, families):
+        from superlance.exporter import render
+        return render(families)
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT([]), '# EOF\n')
+
+    def test_render(self):
+        body = self._callFUT([
+            ('memmon_process_memory_bytes', 'gauge', 'Memory',
+             [([('group', 'foo'), ('name', 'bar')], 1024L)]),
+            ('memmon_restarts', 'counter', 'Restarts',
+             [([], 2)]),
+            ('cpumon_process_cpu_percent', 'gauge', 'CPU',
+             [([('name', 'a"b\\c\nd')], 99.5)]),
+            ])
+        self.assertEqual(body.split('\n'), [
+            '# TYPE memmon_process_memory_bytes gauge',
+            '# HELP memmon_process_memory_bytes Memory',
+            'memmon_process_memory_bytes{group="foo",name="bar"} 1024',
+            '# TYPE memmon_restarts counter',
+            '# HELP memmon_restarts Restarts',
+            'memmon_restarts_total 2',
+            '# TYPE cpumon_process_cpu_percent gauge',
+            '# HELP cpumon_process_cpu_percent CPU',
+            'cpumon_process_cpu_percent{name="a\\"b\\\\c\\nd"} 99.5',
+            '# EOF',
+            '',
+            ])
+
+class ParseAddressTests(unittest.TestCase):
+    def _callFUT(self, value):
+        from superlance.exporter import parse_address
+        return parse_address(value)
+
+    def test_port(self):
+        self.assertEqual(self._callFUT('9100'), ('', 9100))
+
+    def test_host_port(self):
+        self.assertEqual(self._callFUT('127.0.0.1:9100'), ('127.0.0.1', 9100))
+
+    def test_bad(self):
+        self.assertRaises(ValueError, self._callFUT, 'localhost')
+
+class MetricsExporterTests(unittest.TestCase):
+    def _makeOne(self):
+        from superlance.exporter import MetricsExporter
+        return MetricsExporter('127.0.0.1', 0)
+
+    def test_serves_cached_body(self):
+        import urllib2
+        from superlance.exporter import CONTENT_TYPE
+        exporter = self._makeOne()
+        exporter.start()
+        try:
+            exporter.update('foo 1\n# EOF\n')
+            url = 'http://127.0.0.1:%s/metrics' % exporter.port
+            response = urllib2.urlopen(url)
+            self.assertEqual(response.info()['Content-Type'], CONTENT_TYPE)
+            self.assertEqual(response.read(), 'foo 1\n# EOF\n')
+            self.assertRaises(urllib2.HTTPError, urllib2.urlopen,
+                              'http://127.0.0.1:%s/other' % exporter.port)
+        finally:
+            exporter.stop()
+
+if __name__ == '__main__':
+    unittest.main()
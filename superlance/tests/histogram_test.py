@@ -0,0 +1,79 @@
+import unittest
+
+class LatencyHistogramTests(unittest.TestCase):
+    def _getTargetClass(self):
+        from superlance.histogram import LatencyHistogram
+        return LatencyHistogram
+
+    def _makeOne(self, window=20):
+        return self._getTargetClass()(window)
+
+    def test_too_small(self):
+        self.assertRaises(ValueError, self._makeOne, 0)
+
+    def test_empty(self):
+        histogram = self._makeOne()
+        self.assertEqual(len(histogram), 0)
+        self.assertEqual(histogram.percentile(50), None)
+        self.assertEqual(histogram.report(), 'no latencies')
+
+    def test_percentile(self):
+        histogram = self._makeOne()
+        for ms in [10] * 18 + [4000, 4000]:
+            histogram.add(ms)
+        self.assertEqual(len(histogram), 20)
+        # estimates are within about 10% of the latencies
+        self.failUnless(9 < histogram.percentile(50) < 11)
+        self.failUnless(9 < histogram.percentile(90) < 11)
+        self.failUnless(3600 < histogram.percentile(95) < 4400)
+        self.failUnless(3600 < histogram.percentile(100) < 4400)
+
+    def test_rolling(self):
+        histogram = self._makeOne(3)
+        for ms in (4000, 4000, 4000, 10, 10, 10):
+            histogram.add(ms)
+        self.assertEqual(len(histogram), 3)
+        self.failUnless(histogram.percentile(100) < 11)
+        self.assertEqual(sum(histogram.counts), 3)
+
+    def test_clear(self):
+        histogram = self._makeOne(3)
+        histogram.add(10)
+        histogram.clear()
+        self.assertEqual(len(histogram), 0)
+        histogram.add(20)
+        self.failUnless(18 < histogram.percentile(50) < 22)
+
+    def test_extremes(self):
+        histogram = self._makeOne()
+        histogram.add(0)
+        histogram.add(10 ** 9)
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertEqual(histogram.percentile(100), 2 ** 20)
+
+    def test_report(self):
+        histogram = self._makeOne()
+        for ms in (10, 10, 90, 10 ** 9):
+            histogram.add(ms)
+        self.assertEqual(histogram.report([50, 99]),
+                         'p50 10.4ms, p99 1048.6s of 4; <=11.3ms: 2, '
+                         '<=90.5ms: 1, >1048.6s: 1')
+
+    def test_report_float_percentiles(self):
+        histogram = self._makeOne()
+        histogram.add(10)
+        self.assertEqual(histogram.report([50.0, 99.9]),
+                         'p50 10.4ms, p99.9 10.4ms of 1; <=11.3ms: 1')
+
+class FormatTests(unittest.TestCase):
+    def _callFUT(self, ms):
+        from superlance.histogram import format_ms
+        return format_ms(ms)
+
+    def test_it(self):
+        self.assertEqual(self._callFUT(0.5), '0.5ms')
+        self.assertEqual(self._callFUT(123.456), '123ms')
+        self.assertEqual(self._callFUT(4100), '4.1s')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,21 +32,482 @@ _FAIL = [ {
         'description':'foo description',
         },]
 
-def make_connection(response, exc=None):
-    class TestConnection:
-        def __init__(self, hostport):
-            self.hostport = hostport
+def process_info(name, group, state=ProcessStates.RUNNING):
+    from supervisor.states import getProcessStateDescription
+    return {'name': name, 'group': group, 'pid': 100, 'state': state,
+            'statename': getProcessStateDescription(state), 'start': 0,
+            'stop': 0, 'spawnerr': '', 'now': 0, 'description': ''}
 
-        def request(self, method, path):
-            if exc:
-                raise ValueError('foo')
-            self.method = method
-            self.path = path
+class EndpointTests(unittest.TestCase):
+    def _getTargetClass(self):
+        from superlance.httpok import Endpoint
+        return Endpoint
+
+    def _makeOne(self, url, **kw):
+        return self._getTargetClass()(url, **kw)
+
+    def test_ctor(self):
+        endpoint = self._makeOne('HTTPS://foo:8443/bar?baz=1', programs=['a'])
+        self.assertEqual(endpoint.name, 'HTTPS://foo:8443/bar?baz=1')
+        self.assertEqual(endpoint.scheme, 'https')
+        self.assertEqual(endpoint.hostport, 'foo:8443')
+        self.assertEqual(endpoint.path, '/bar?baz=1')
+        self.assertEqual(endpoint.programs, ['a'])
+
+    def test_ctor_no_path(self):
+        self.assertEqual(self._makeOne('http://foo').path, '/')
+
+    def test_ctor_bad_scheme(self):
+        self.assertRaises(ValueError, self._makeOne, 'ftp://foo/bar')
+
+    def test_ctor_tls_context(self):
+        import ssl
+        self.assertEqual(self._makeOne('http://foo/').context, None)
+        endpoint = self._makeOne('https://foo/')
+        self.assertEqual(endpoint.context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertEqual(endpoint.context.check_hostname, True)
+        endpoint = self._makeOne('https://foo/', verify=False)
+        self.assertEqual(endpoint.context.verify_mode, ssl.CERT_NONE)
+
+    def test_ctor_bad_cafile(self):
+        self.assertRaises(ValueError, self._makeOne, 'https://foo/',
+                          cafile='/nonexistent/ca.pem')
+
+    def test_probe_tls(self):
+        cert = {'notAfter': 'Jun  1 12:00:00 2030 GMT'}
+        connclass = make_connection(peercert=cert,
+                                    timings={'handshake': 0.002})
+        endpoint = self._makeOne('https://foo/bar', certdays=14)
+        status, found, msg, elapsed = endpoint.probe(connclass)
+        self.assertEqual(status, 200)
+        # every connection gets the endpoint's one context
+        endpoint.close()
+        endpoint.probe(connclass)
+        self.assertEqual(len(connclass.made), 2)
+        for conn in connclass.made:
+            self.failUnless(conn.context is endpoint.context)
+        self.assertEqual(endpoint.report_phases(), 'TLS handshake 2ms')
+        self.assertEqual(endpoint.expires, 1906545600)
+
+    def test_template(self):
+        endpoint = self._makeOne('http://127.0.0.1:{8000+process_num}/ok',
+                                 programs=['web'], latency=100)
+        self.assertEqual(endpoint.template, True)
+        self.assertEqual(self._makeOne('http://foo/').template, False)
+        specs = [process_info('web_01', 'web'),
+                 process_info('web_00', 'web'),
+                 process_info('web_02', 'web', ProcessStates.STARTING),
+                 process_info('other', 'other')]
+        instances = endpoint.expand(specs)
+        # only those of RUNNING processes are probed
+        self.assertEqual([ x.url for x in instances ],
+                         ['http://127.0.0.1:8000/ok',
+                          'http://127.0.0.1:8001/ok'])
+        web_00 = instances[0]
+        self.assertEqual(web_00.name,
+                         'http://127.0.0.1:{8000+process_num}/ok web:web_00')
+        self.assertEqual(web_00.hostport, '127.0.0.1:8000')
+        self.assertEqual(web_00.programs, ['web:web_00'])
+        self.assertEqual(web_00.template, False)
+        self.assertEqual(web_00.latency, 100)
+        self.failIf(web_00.histogram is endpoint.histogram)
+        self.assertEqual(sorted(endpoint.instances.keys()),
+                         ['web:web_00', 'web:web_01', 'web:web_02'])
+        # an instance lasts as long as its process
+        web_00.failed = 1
+        instances = endpoint.expand(specs[:1])
+        self.assertEqual(endpoint.instances.keys(), ['web:web_01'])
+        instances = endpoint.expand(specs)
+        self.assertEqual(instances[0].failed, 0)
+        self.failUnless(instances[1] is endpoint.instances['web:web_01'])
+
+    def test_template_any(self):
+        endpoint = self._makeOne('http://127.0.0.1:{8000+process_num}/',
+                                 any=True)
+        specs = [process_info('web_01', 'web'), process_info('api_00', 'api')]
+        self.assertEqual([ x.programs for x in endpoint.expand(specs) ],
+                         [['api:api_00'], ['web:web_01']])
+
+    def test_bad_template(self):
+        self.assertRaises(ValueError, self._makeOne,
+                          'http://127.0.0.1:{8000*process_num}/')
+
+    def test_check_cert(self):
+        endpoint = self._makeOne('https://foo/bar', certdays=14)
+        now = 1906545600 - 14 * 86400
+        self.assertEqual(endpoint.check_cert(now), None) # not yet known
+        endpoint.expires = 1906545600
+        self.assertEqual(endpoint.check_cert(now), None)
+        subject, msg = endpoint.check_cert(now + 43200)
+        self.assertEqual(subject,
+                         'httpok for https://foo/bar: certificate expires soon')
+        self.assertEqual(msg, 'the certificate of https://foo/bar expires on '
+                         '2030-06-01 12:00:00 UTC, in 13.5 days (less than '
+                         '14)')
+        # once a day
+        self.assertEqual(endpoint.check_cert(now + 86400), None)
+        self.failIf(endpoint.check_cert(now + 43200 + 86400) is None)
+        # a renewed certificate which also expires soon: right away
+        endpoint.expires += 3600
+        self.failIf(endpoint.check_cert(now + 43200 + 86401) is None)
+        endpoint.certdays = None
+        self.assertEqual(endpoint.check_cert(now + 3 * 86400), None)
+
+    def test_probe(self):
+        endpoint = self._makeOne('http://foo/bar')
+        status, found, msg, elapsed = endpoint.probe(
+            make_connection(DummyResponse()))
+        self.assertEqual(status, 200)
+        self.assertEqual(found, None)
+        self.assertEqual(msg, 'status contacting http://foo/bar: 200 OK')
+        self.failIf(endpoint.conn is None)
+
+    def test_probe_body(self):
+        response = DummyResponse()
+        response.body = 'x' * 10000 + 'tasty' + 'x' * 10000
+        endpoint = self._makeOne('http://foo/bar', inbody='tasty')
+        status, found, msg, elapsed = endpoint.probe(make_connection(response))
+        self.assertEqual(found, True)
+        self.assertEqual(endpoint.check(status, found), None)
+        # the whole body was read, so the connection is kept
+        self.failIf(endpoint.conn is None)
+
+    def test_probe_body_found_keeps_connection(self):
+        response = DummyResponse()
+        response.body = '<p>tasty</p>'
+        endpoint = self._makeOne('http://foo/bar', inbody='tasty')
+        connclass = make_connection(response)
+        for i in range(3):
+            status, found, msg, elapsed = endpoint.probe(connclass)
+            self.assertEqual(found, True)
+        self.failIf(endpoint.conn is None)
+        self.assertEqual(endpoint.connects, 1)
+        self.assertEqual(endpoint.reuses, 2)
+
+    def test_probe_body_not_found(self):
+        response = DummyResponse()
+        response.body = 'x' * 10000
+        endpoint = self._makeOne('http://foo/bar', inbody='tasty')
+        status, found, msg, elapsed = endpoint.probe(make_connection(response))
+        self.assertEqual(found, False)
+        self.assertEqual(endpoint.check(status, found),
+                         'httpok for http://foo/bar: bad body returned')
+        self.failIf(endpoint.conn is None)
+
+    def test_probe_body_too_long(self):
+        response = DummyResponse()
+        response.body = 'x' * 10000
+        endpoint = self._makeOne('http://foo/bar', maxbody=100)
+        endpoint.probe(make_connection(response))
+        self.assertEqual(endpoint.conn, None)
+
+    def test_probe_body_negate_regex(self):
+        response = DummyResponse()
+        response.body = '<p>Error 1234</p>'
+        endpoint = self._makeOne('http://foo/bar', inbody=r'Error \d+',
+                                 regex=True, negate=True)
+        status, found, msg, elapsed = endpoint.probe(make_connection(response))
+        self.assertEqual(found, True)
+        self.assertEqual(endpoint.check(status, found),
+                         'httpok for http://foo/bar: bad body returned')
+
+    def test_probe_error(self):
+        endpoint = self._makeOne('http://foo/bar')
+        status, body, msg, elapsed = endpoint.probe(
+            make_connection(exc=ValueError('foo')))
+        self.assertEqual(status, None)
+        self.assertEqual(msg, 'error contacting http://foo/bar:\n\n foo')
+
+    def test_probe_reuses_connection(self):
+        endpoint = self._makeOne('http://foo/bar')
+        connclass = make_connection(failures=[None, None, None])
+        for i in range(3):
+            self.assertEqual(endpoint.probe(connclass)[0], 200)
+        self.assertEqual(len(connclass.made), 1)
+        self.assertEqual(connclass.made[0].requests, 3)
+        self.assertEqual(endpoint.connects, 1)
+        self.assertEqual(endpoint.reuses, 2)
+        self.assertEqual(endpoint.reconnects, 0)
+
+    def test_probe_fresh(self):
+        endpoint = self._makeOne('http://foo/bar', fresh=True)
+        connclass = make_connection(failures=[None, None])
+        endpoint.probe(connclass)
+        endpoint.probe(connclass)
+        self.assertEqual(len(connclass.made), 2)
+        self.failUnless(connclass.made[0].closed)
+        self.assertEqual(endpoint.conn, None)
+        self.assertEqual(endpoint.reuses, 0)
+
+    def test_probe_server_closes(self):
+        response = DummyResponse()
+        response.will_close = True
+        endpoint = self._makeOne('http://foo/bar')
+        endpoint.probe(make_connection(response))
+        self.assertEqual(endpoint.conn, None)
+
+    def test_probe_reconnects(self):
+        import httplib
+        endpoint = self._makeOne('http://foo/bar')
+        connclass = make_connection(
+            failures=[None, httplib.BadStatusLine(''), None])
+        endpoint.probe(connclass)
+        status, body, msg, elapsed = endpoint.probe(connclass)
+        # the stale connection is replaced without failing the check
+        self.assertEqual(status, 200)
+        self.assertEqual(len(connclass.made), 2)
+        self.failUnless(connclass.made[0].closed)
+        self.assertEqual(endpoint.connects, 2)
+        self.assertEqual(endpoint.reconnects, 1)
+
+    def test_probe_no_reconnect_on_timeout(self):
+        import socket
+        endpoint = self._makeOne('http://foo/bar')
+        connclass = make_connection(
+            failures=[None, socket.timeout('timed out'), None])
+        endpoint.probe(connclass)
+        status, body, msg, elapsed = endpoint.probe(connclass)
+        self.assertEqual(status, None)
+        self.assertEqual(msg, 'error contacting http://foo/bar:\n\n timed out')
+        self.assertEqual(endpoint.conn, None)
+        self.assertEqual(endpoint.reconnects, 0)
+
+    def test_probe_fresh_connection_fails(self):
+        import socket
+        endpoint = self._makeOne('http://foo/bar')
+        connclass = make_connection(failures=[socket.error(111, 'refused')])
+        self.assertEqual(endpoint.probe(connclass)[0], None)
+        self.assertEqual(len(connclass.made), 1)
+
+    def test_probe_still_busy(self):
+        endpoint = self._makeOne('http://foo/bar')
+        endpoint.lock.acquire()
+        status, body, msg, elapsed = endpoint.probe(make_connection(None))
+        self.assertEqual(status, None)
+        self.assertEqual(msg, 'error contacting http://foo/bar:\n\n the '
+                         'previous check is still waiting for an answer')
+
+    def test_check_latency(self):
+        endpoint = self._makeOne('http://foo/bar', latency=500, window=4)
+        endpoint.histogram.add(4000)
+        # not checked until the window is half full
+        self.assertEqual(endpoint.check_latency(), None)
+        endpoint.histogram.add(10)
+        subject, msg = endpoint.check_latency()
+        self.assertEqual(subject, 'httpok for http://foo/bar: slow responses')
+        self.assertEqual(msg, 'p95 latency contacting http://foo/bar over the '
+                         'last 2 checks: 3.8s, over the limit of 500ms')
+        endpoint.histogram.add(10)
+        endpoint.histogram.add(10)
+        endpoint.histogram.add(10)
+        self.assertEqual(endpoint.check_latency(), None)
+
+    def test_check_latency_off(self):
+        endpoint = self._makeOne('http://foo/bar', window=1)
+        endpoint.histogram.add(4000)
+        self.assertEqual(endpoint.check_latency(), None)
+
+    def test_report_latency(self):
+        endpoint = self._makeOne('http://foo/bar', latency=500, percentile=90)
+        endpoint.histogram.add(10)
+        self.assertEqual(endpoint.report_latency(),
+                         'latency of http://foo/bar: p50 10.4ms, p90 10.4ms, '
+                         'p99 10.4ms of 1; <=11.3ms: 1')
+
+    def test_float_percentile(self):
+        # --percentile=95 is parsed as 95.0, shown as p95
+        endpoint = self._makeOne('http://foo/bar', latency=5, percentile=95.0,
+                                 window=1)
+        endpoint.histogram.add(10)
+        self.assertEqual(endpoint.report_latency(),
+                         'latency of http://foo/bar: p50 10.4ms, p95 10.4ms, '
+                         'p99 10.4ms of 1; <=11.3ms: 1')
+        subject, msg = endpoint.check_latency()
+        self.assertEqual(msg, 'p95 latency contacting http://foo/bar over the '
+                         'last 1 checks: 10.4ms, over the limit of 5ms')
+
+    def test_fail_threshold(self):
+        endpoint = self._makeOne('http://foo/bar', failures=3)
+        self.assertEqual(endpoint.fail(), False)
+        self.assertEqual(endpoint.fail(), False)
+        endpoint.passed()
+        self.assertEqual(endpoint.fail(), False)
+        self.assertEqual(endpoint.fail(), False)
+        self.assertEqual(endpoint.fail(), True)
+        self.assertEqual(endpoint.failed, 3)
 
-        def getresponse(self):
-            return response
+    def test_restarted_backoff(self):
+        endpoint = self._makeOne('http://foo/bar', grace=60, maxgrace=200)
+        self.assertEqual(endpoint.resting(0), False)
+        self.assertEqual(endpoint.restarted(1000), 60)
+        self.failUnless(endpoint.resting(1059))
+        self.failIf(endpoint.resting(1060))
+        self.assertEqual(endpoint.restarted(1060), 120)
+        self.assertEqual(endpoint.resume, 1180)
+        self.assertEqual(endpoint.restarted(1180), 200)
+        # a good check starts over
+        endpoint.passed()
+        self.assertEqual(endpoint.restarted(2000), 60)
 
-    return TestConnection
+    def test_restarted_no_grace(self):
+        endpoint = self._makeOne('http://foo/bar')
+        self.assertEqual(endpoint.restarted(1000), 0)
+        self.failIf(endpoint.resting(1000))
+
+    def test_check(self):
+        endpoint = self._makeOne('http://foo/bar', inbody='tasty')
+        self.assertEqual(endpoint.check(200, True), None)
+        self.assertEqual(endpoint.check(None, None),
+                         'httpok for http://foo/bar: bad status returned')
+        self.assertEqual(endpoint.check(200, False),
+                         'httpok for http://foo/bar: bad body returned')
+
+    def test_check_no_body_check(self):
+        endpoint = self._makeOne('http://foo/bar')
+        self.assertEqual(endpoint.check(200, None), None)
+
+class ProbeAllTests(unittest.TestCase):
+    def _callFUT(self, endpoints, connclass, deadline=None):
+        from superlance.httpok import probe_all
+        return probe_all(endpoints, connclass, deadline)
+
+    def _makeEndpoints(self, count):
+        from superlance.httpok import Endpoint
+        return [ Endpoint('http://foo/%d' % i) for i in range(count) ]
+
+    def test_concurrent(self):
+        endpoints = self._makeEndpoints(10)
+        start = time.time()
+        results = self._callFUT(endpoints, make_connection(delay=0.2))
+        # bounded by the slowest probe, not the sum of them
+        self.failUnless(time.time() - start < 1.0)
+        self.assertEqual([ x[0] for x in results ], [200] * 10)
+
+    def test_deadline(self):
+        endpoints = self._makeEndpoints(2)
+        start = time.time()
+        results = self._callFUT(endpoints, make_connection(delay=2), 0.1)
+        self.failUnless(time.time() - start < 1.0)
+        status, body, msg, elapsed = results[1]
+        self.assertEqual(status, None)
+        self.assertEqual(msg, 'error contacting http://foo/1:\n\n no '
+                         'response within the tick deadline of 0.1 seconds')
+
+class ReadConfigTests(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tempdir)
+
+    def _callFUT(self, text, **kw):
+        import os
+        from superlance.httpok import read_config
+        path = os.path.join(self.tempdir, 'httpok.conf')
+        f = open(path, 'w')
+        f.write(text)
+        f.close()
+        return read_config(path, **kw)
+
+    def test_it(self):
+        endpoints = self._callFUT("""\
+[endpoint:tasty]
+url = http://localhost:8080/tasty
+programs = program1 group1:program2
+body = tasty
+fresh = true
+
+[other]
+url = http://ignored/
+
+[endpoint:all]
+url = http://localhost:8081/
+any = true
+timeout = 3
+status = 204
+eager = false
+latency = 250
+percentile = 99
+window = 10
+failures = 3
+grace = 30
+maxgrace = 600
+regex = true
+negate = true
+maxbody = 64KB
+""", timeout=5)
+        self.assertEqual(len(endpoints), 2)
+        tasty, all = endpoints
+        self.assertEqual(tasty.name, 'tasty')
+        self.assertEqual(tasty.url, 'http://localhost:8080/tasty')
+        self.assertEqual(tasty.programs, ['program1', 'group1:program2'])
+        self.assertEqual(tasty.any, False)
+        self.assertEqual(tasty.timeout, 5)
+        self.assertEqual(tasty.status, '200')
+        self.assertEqual(tasty.inbody, 'tasty')
+        self.assertEqual(tasty.eager, True)
+        self.assertEqual(tasty.fresh, True)
+        self.assertEqual(all.fresh, False)
+        self.assertEqual(tasty.latency, None)
+        self.assertEqual(all.latency, 250)
+        self.assertEqual(all.percentile, 99)
+        self.assertEqual(all.histogram.window, 10)
+        self.assertEqual(tasty.failures, 1)
+        self.assertEqual(tasty.grace, 0)
+        self.assertEqual(all.failures, 3)
+        self.assertEqual(all.grace, 30)
+        self.assertEqual(all.maxgrace, 600)
+        self.assertEqual(str(tasty.matcher), "must contain 'tasty'")
+        self.assertEqual(all.matcher, None)
+        self.assertEqual(all.maxbody, 65536)
+        self.assertEqual(all.any, True)
+        self.assertEqual(all.timeout, 3)
+        self.assertEqual(all.status, '204')
+        self.assertEqual(all.eager, False)
+
+    def test_tls(self):
+        import os
+        import ssl
+        cafile = os.path.join(os.path.dirname(__file__), 'localhost.pem')
+        secure, insecure = self._callFUT("""\
+[endpoint:secure]
+url = https://localhost:8443/
+cafile = %s
+
+[endpoint:insecure]
+url = https://localhost:8444/
+verify = false
+certdays = 7
+""" % cafile, certdays=14)
+        self.assertEqual(secure.context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertEqual(secure.certdays, 14)
+        self.assertEqual(insecure.context.verify_mode, ssl.CERT_NONE)
+        self.assertEqual(insecure.certdays, 7)
+
+    def test_rolling(self):
+        endpoint, = self._callFUT("""\
+[endpoint:x]
+url = http://foo/
+rolling = 2
+""", recovery=30)
+        self.assertEqual(endpoint.rolling, 2)
+        self.assertEqual(endpoint.recovery, 30)
+
+    def test_no_url(self):
+        self.assertRaises(ValueError, self._callFUT, '[endpoint:x]\n')
+
+    def test_bad_value(self):
+        self.assertRaises(ValueError, self._callFUT,
+                          '[endpoint:x]\nurl = http://foo/\ntimeout = x\n')
+
+    def test_no_endpoints(self):
+        self.assertRaises(ValueError, self._callFUT, '[other]\n')
+
+    def test_missing_file(self):
+        from superlance.httpok import read_config
+        self.assertRaises(ValueError, read_config, '/nonexistent/httpok')
 
 class HTTPOkTests(unittest.TestCase):
     def _getTargetClass(self):
@@ -74,6 +535,8 @@ class HTTPOkTests(unittest.TestCase):
         prog.stdin = StringIO()
         prog.stdout = StringIO()
         prog.stderr = StringIO()
+        if exc:
+            exc = ValueError('foo')
         prog.connclass = make_connection(response, exc=exc)
         return prog
 
@@ -119,6 +582,22 @@ class HTTPOkTests(unittest.TestCase):
         prog.runforever(test=True)
         self.assertEqual(prog.stderr.getvalue(), '')
 
+    def test_runforever_process_state_event(self):
+        programs = ['foo']
+        prog = self._makeOnePopulated(programs, None, exc=True, eager=False)
+        # seed the table, then foo stops
+        prog.listProcesses()
+        payload = 'processname:foo groupname:foo from_state:STOPPING pid:11'
+        prog.stdin.write('eventname:PROCESS_STATE_STOPPED len:%s\n%s' % (
+            len(payload), payload))
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        prog.runforever(test=True)
+        # no process is running, so the URL isn't checked
+        self.assertEqual(prog.stderr.getvalue(), '')
+        self.assertEqual(prog.listProcesses(ProcessStates.RUNNING), [])
+
     def test_runforever_eager_error_on_request_some(self):
         programs = ['foo', 'bar', 'baz_01', 'notexisting']
         any = None
@@ -145,6 +624,48 @@ class HTTPOkTests(unittest.TestCase):
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
 
+    def test_runforever_statsd(self):
+        prog = self._makeOnePopulated(['foo'], None, exc=True)
+        prog.stats = DummyStats()
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        metrics = prog.stats.metrics
+        self.assertEqual(metrics[0][0], 'probe')
+        self.assertEqual(metrics[0][2:], ('ms', [('url', 'http://foo/bar')]))
+        self.assertEqual(metrics[1:], [
+            ('connects', 1, 'c', [('url', 'http://foo/bar')]),
+            ('probe_failures', 1, 'c', [('url', 'http://foo/bar')]),
+            ('restarts', 1, 'c', [('group', 'foo'), ('name', 'foo')]),
+            ])
+        self.assertEqual(prog.stats.flushed, 1)
+
+    def test_runforever_statsd_connection_reuse(self):
+        prog = self._makeOnePopulated(['foo'], None)
+        prog.stats = DummyStats()
+        prog.stdin.write('eventname:TICK len:0\n' * 3)
+        prog.stdin.seek(0)
+        for i in range(3):
+            prog.runforever(test=True)
+        counted = [ x[:2] for x in prog.stats.metrics if x[2] == 'c' ]
+        self.assertEqual(counted, [('connects', 1), ('connection_reuses', 1),
+                                   ('connection_reuses', 1)])
+
+    def test_runforever_statsd_reconnects(self):
+        import httplib
+        prog = self._makeOnePopulated(['foo'], None)
+        prog.connclass = make_connection(
+            failures=[None, httplib.BadStatusLine(''), None])
+        prog.stats = DummyStats()
+        prog.stdin.write('eventname:TICK len:0\n' * 2)
+        prog.stdin.seek(0)
+        for i in range(2):
+            prog.runforever(test=True)
+        counted = [ x[:2] for x in prog.stats.metrics if x[2] == 'c' ]
+        self.assertEqual(counted, [('connects', 1), ('connects', 1),
+                                   ('connection_reuses', 1),
+                                   ('reconnects', 1)])
+
     def test_runforever_eager_error_on_request_any(self):
         programs = []
         any = True
@@ -209,6 +730,34 @@ class HTTPOkTests(unittest.TestCase):
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
 
+    def test_runforever_eager_restart_batched(self):
+        programs = []
+        any = True
+        prog = self._makeOnePopulated(programs, any, exc=True)
+        prog.rpc.supervisor.all_process_info = _FAIL
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        lines = prog.stderr.getvalue().split('\n')
+        self.assertEqual(lines[0], 'Restarting all running processes')
+        self.assertEqual(lines[1], 'foo:FAILED is in RUNNING state, restarting')
+        self.assertEqual(lines[2],
+                         'foo:SPAWN_ERROR is in RUNNING state, restarting')
+        self.assertEqual(lines[3],
+                    "Failed to stop process foo:FAILED: <Fault 30: 'FAILED'>")
+        self.assertEqual(lines[4], 'foo:FAILED restarted')
+        self.assertEqual(lines[5],
+           "Failed to start process foo:SPAWN_ERROR: <Fault 50: 'SPAWN_ERROR'>")
+        # one round trip for the stops, one for the starts
+        multicalls = prog.rpc.system.multicalls
+        self.assertEqual([ [ (x['methodName'], x['params']) for x in calls ]
+                           for calls in multicalls ], [
+            [('supervisor.stopProcess', ['foo:FAILED']),
+             ('supervisor.stopProcess', ['foo:SPAWN_ERROR'])],
+            [('supervisor.startProcess', ['foo:FAILED']),
+             ('supervisor.startProcess', ['foo:SPAWN_ERROR'])],
+            ])
+
     def test_runforever_eager_gcore(self):
         programs = ['foo', 'bar', 'baz_01', 'notexisting']
         any = None
@@ -270,5 +819,213 @@ class HTTPOkTests(unittest.TestCase):
         self.assertEqual(mailed[1],
                     'Subject: httpok for http://foo/bar: bad status returned')
 
+    def test_runforever_latency(self):
+        prog = self._makeOnePopulated(['foo'], None)
+        endpoint = prog.endpoints[0]
+        endpoint.latency = 500
+        for i in range(10):
+            endpoint.histogram.add(4000)
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        lines = prog.stderr.getvalue().split('\n')
+        self.failUnless(lines[0].startswith(
+            'latency of http://foo/bar: p50 3.8s, p95 3.8s, p99 3.8s of 11; '
+            '<=1ms: 1, <=4.1s: 10'), lines[0])
+        self.assertEqual(lines[1], "Restarting selected processes ['foo']")
+        self.assertEqual(lines[2], 'foo is in RUNNING state, restarting')
+        mailed = prog.mailed.split('\n')
+        self.assertEqual(mailed[1],
+                         'Subject: httpok for http://foo/bar: slow responses')
+        self.assertEqual(mailed[3], 'p95 latency contacting http://foo/bar '
+                         'over the last 11 checks: 3.8s, over the limit of '
+                         '500ms')
+        self.assertEqual(mailed[5], lines[0])
+        self.assertEqual(len(endpoint.histogram), 0)
+
+    def _tick(self, prog, now):
+        prog.clock = lambda: now
+        prog.stderr = StringIO()
+        prog.stdin = StringIO('eventname:TICK len:0\n')
+        prog.runforever(test=True)
+        return prog.stderr.getvalue().split('\n')
+
+    def test_runforever_cert_expiring(self):
+        from superlance.httpok import Endpoint
+        prog = self._makeOnePopulated(['foo'], None)
+        endpoint = Endpoint('https://foo/bar', ['foo'], certdays=30)
+        prog.endpoints = [endpoint]
+        prog.connclass = make_connection(
+            peercert={'notAfter': 'Jun  1 12:00:00 2030 GMT'})
+        lines = self._tick(prog, 1906545600 - 31 * 86400)
+        self.failIf('mailed' in prog.__dict__)
+        prog.stats = DummyStats()
+        lines = self._tick(prog, 1906545600 - 29 * 86400)
+        self.assertEqual(lines[0], 'the certificate of https://foo/bar '
+                         'expires on 2030-06-01 12:00:00 UTC, in 29.0 days '
+                         '(less than 30)')
+        self.failUnless('Subject: httpok for https://foo/bar: certificate '
+                        'expires soon' in prog.mailed)
+        self.failUnless(('cert_expiring', 1, 'c',
+                         [('url', 'https://foo/bar')]) in prog.stats.metrics)
+        # not restarted for it, nor warned about again the same day
+        self.assertEqual(prog.rpc.system.multicalls, [])
+        self.assertEqual(endpoint.failed, 0)
+        del prog.mailed
+        lines = self._tick(prog, 1906545600 - 29 * 86400 + 3600)
+        self.failIf('mailed' in prog.__dict__)
+        self.failIf('the certificate' in '\n'.join(lines))
+
+    def test_runforever_failure_threshold(self):
+        prog = self._makeOnePopulated(['foo'], None, exc=True)
+        prog.endpoints[0].failures = 2
+        lines = self._tick(prog, 1000)
+        self.assertEqual(lines[0], 'Check of http://foo/bar failed 1 of 2 '
+                         'times in a row, not restarting yet')
+        self.assertEqual(prog.rpc.system.multicalls, [])
+        self.failIf('mailed' in prog.__dict__)
+        lines = self._tick(prog, 1060)
+        self.assertEqual(lines[0], "Restarting selected processes ['foo']")
+        self.assertEqual(lines[2], 'foo restarted')
+        self.assertEqual(len(prog.rpc.system.multicalls), 2)
+
+    def test_runforever_grace_and_backoff(self):
+        prog = self._makeOnePopulated(['foo'], None, exc=True)
+        endpoint = prog.endpoints[0]
+        endpoint.grace = 60
+        lines = self._tick(prog, 1000)
+        self.assertEqual(lines[2], 'foo restarted')
+        self.assertEqual(lines[3], 'Not checking http://foo/bar for 60 '
+                         'seconds after restarting')
+        # not checked, let alone restarted, during the grace period
+        lines = self._tick(prog, 1030)
+        self.assertEqual(lines, ['Not checking http://foo/bar for another 30 '
+                                 'seconds after restarting', ''])
+        self.assertEqual(len(prog.rpc.system.multicalls), 2)
+        # still failing: restarted again, with twice the grace period
+        lines = self._tick(prog, 1060)
+        self.assertEqual(lines[2], 'foo restarted')
+        self.assertEqual(lines[3], 'Not checking http://foo/bar for 120 '
+                         'seconds after restarting')
+        self.assertEqual(len(prog.rpc.system.multicalls), 4)
+        # back to the first grace period once the URL passes again
+        prog.connclass = make_connection(DummyResponse())
+        self.assertEqual(self._tick(prog, 1180), [''])
+        endpoint.close()
+        prog.connclass = make_connection(exc=ValueError('foo'))
+        lines = self._tick(prog, 1240)
+        self.assertEqual(lines[3], 'Not checking http://foo/bar for 60 '
+                         'seconds after restarting')
+
+    def test_runforever_phases(self):
+        prog = self._makeOnePopulated(['foo'], None)
+        prog.stats = DummyStats()
+        response = DummyResponse()
+        response.status = 500
+        connclass = make_connection(response)
+        connclass.timings = {'resolve': 0.001, 'connect': 0.002,
+                             'firstbyte': 0.5}
+        prog.connclass = connclass
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        self.assertEqual([ x[:2] for x in prog.stats.metrics[1:4] ], [
+            ('probe_resolve', 1.0), ('probe_connect', 2.0),
+            ('probe_firstbyte', 500.0)])
+        mailed = prog.mailed.split('\n')
+        self.assertEqual(mailed[3], 'status contacting http://foo/bar: 500 OK')
+        self.assertEqual(mailed[5], 'timings: resolve 1ms, connect 2ms, '
+                         'first byte 500ms')
+
+    def test_runforever_endpoints(self):
+        from superlance.httpok import Endpoint
+        prog = self._makeOnePopulated(['bar'], None)
+        prog.endpoints.append(Endpoint('http://foo/missing', ['foo'],
+                                       status='404'))
+        prog.stdin.write('eventname:TICK len:0\n')
+        prog.stdin.seek(0)
+        prog.runforever(test=True)
+        # only the failing endpoint's processes are restarted
+        lines = prog.stderr.getvalue().split('\n')
+        self.assertEqual(lines[0], "Restarting selected processes ['foo']")
+        self.assertEqual(lines[1], 'foo is in RUNNING state, restarting')
+        self.assertEqual(lines[2], 'foo restarted')
+        mailed = prog.mailed.split('\n')
+        self.assertEqual(mailed[1],
+                    'Subject: httpok for http://foo/missing: bad status returned')
+
+    def test_runforever_template(self):
+        from superlance.httpok import Endpoint
+        prog = self._makeOnePopulated([], None)
+        prog.rpc.supervisor.all_process_info = [
+            process_info('web_%02d' % i, 'web') for i in range(3) ]
+        prog.endpoints = [Endpoint('http://127.0.0.1:{8000+process_num}/',
+                                   ['web'])]
+        prog.connclass = make_connection(ports={8001: 500})
+        lines = self._tick(prog, 1000)
+        # only the failing instance is restarted
+        self.assertEqual(lines[0], "Restarting selected processes "
+                                   "['web:web_01']")
+        self.assertEqual(lines[1], 'web:web_01 is in RUNNING state, '
+                                   'restarting')
+        self.assertEqual(lines[2], 'web:web_01 restarted')
+        stops = [ x['params'] for x in prog.rpc.system.multicalls[0] ]
+        self.assertEqual(stops, [['web:web_01']])
+        self.failUnless('Subject: httpok for http://127.0.0.1:8001/: bad '
+                        'status returned' in prog.mailed)
+
+    def _makeRolling(self, statuses, recovery=60):
+        from superlance.httpok import Endpoint
+        prog = self._makeOnePopulated([], None)
+        prog.rpc.supervisor.all_process_info = [
+            process_info('web_%02d' % i, 'web') for i in range(3) ]
+        prog.endpoints = [Endpoint('http://foo/bar', any=True, rolling=2,
+                                   recovery=recovery)]
+        prog.connclass = make_connection(statuses=statuses)
+        now = [1000]
+        def sleep(seconds):
+            now[0] += seconds
+        prog.clock = lambda: now[0]
+        prog.sleep = sleep
+        prog.stdin = StringIO('eventname:TICK len:0\n')
+        return prog
+
+    def test_runforever_rolling(self):
+        # failing the tick's check, then once after the first batch
+        prog = self._makeRolling([500, 500, 200])
+        prog.runforever(test=True)
+        lines = prog.stderr.getvalue().split('\n')
+        self.assertEqual(lines[:11], [
+            'Restarting all running processes',
+            'Restarting batch 1 of 2',
+            'web:web_00 is in RUNNING state, restarting',
+            'web:web_01 is in RUNNING state, restarting',
+            'web:web_00 restarted',
+            'web:web_01 restarted',
+            'http://foo/bar recovered 1.0s after restarting batch 1',
+            'Restarting batch 2 of 2',
+            'web:web_02 is in RUNNING state, restarting',
+            'web:web_02 restarted',
+            'http://foo/bar recovered 0ms after restarting batch 2',
+            ])
+        self.assertEqual(len(prog.rpc.system.multicalls), 4)
+        self.failUnless('recovered 1.0s after restarting batch 1'
+                        in prog.mailed)
+
+    def test_runforever_rolling_abort(self):
+        prog = self._makeRolling([500], recovery=2.5)
+        prog.runforever(test=True)
+        lines = prog.stderr.getvalue().split('\n')
+        self.assertEqual(lines[5:8], [
+            'web:web_01 restarted',
+            'http://foo/bar did not recover within 2.5 seconds, not '
+            'restarting the remaining processes',
+            'Processes not restarted: web:web_02',
+            ])
+        # gave up after 2.5 seconds
+        self.assertEqual(prog.clock(), 1002.5)
+        # only the first batch was stopped and started
+        self.assertEqual(len(prog.rpc.system.multicalls), 2)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,146 @@
+import time
+import unittest
+
+class SampleRingTests(unittest.TestCase):
+    def _makeOne(self, size, pid=None):
+        from superlance.leakrate import SampleRing
+        return SampleRing(size, pid)
+
+    def test_too_small(self):
+        self.assertRaises(ValueError, self._makeOne, 1)
+
+    def test_empty(self):
+        ring = self._makeOne(4)
+        self.assertEqual(len(ring), 0)
+        self.assertEqual(ring.latest(), None)
+        self.assertEqual(ring.slope(), None)
+
+    def test_slope(self):
+        ring = self._makeOne(4)
+        for when, value in ((0, 100), (10, 200), (20, 300)):
+            ring.append(when, value)
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.latest(), 300)
+        self.assertAlmostEqual(ring.slope(), 10.0)
+
+    def test_slope_same_time(self):
+        ring = self._makeOne(4)
+        ring.append(10, 100)
+        ring.append(10, 200)
+        self.assertEqual(ring.slope(), None)
+
+    def test_wraps(self):
+        ring = self._makeOne(3)
+        # an old burst of growth falls out of the window
+        for when, value in ((0, 0), (10, 1000), (20, 1000), (30, 1000),
+                            (40, 1000)):
+            ring.append(when, value)
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.latest(), 1000)
+        self.assertAlmostEqual(ring.slope(), 0.0)
+        self.assertEqual(list(ring.times), [30.0, 40.0, 20.0])
+
+class ParseWindowTests(unittest.TestCase):
+    def _callFUT(self, value):
+        from superlance.leakrate import parse_window
+        return parse_window(value)
+
+    def test_parse(self):
+        self.assertEqual(self._callFUT('02:00-05:30'), (120, 330))
+        self.assertEqual(self._callFUT('23:00-01:00'), (1380, 60))
+
+    def test_bad(self):
+        for value in ('02:00', '2-5', '25:00-01:00', '02:60-03:00', ''):
+            self.assertRaises(ValueError, self._callFUT, value)
+
+class SecondsUntilWindowTests(unittest.TestCase):
+    def _callFUT(self, window, hour, minute, second=0):
+        from superlance.leakrate import seconds_until_window
+        now = hour * 3600 + minute * 60 + second
+        return seconds_until_window(window, now, time.gmtime)
+
+    def test_inside(self):
+        self.assertEqual(self._callFUT((120, 300), 3, 0), 0)
+        self.assertEqual(self._callFUT((1380, 60), 23, 30), 0)
+        self.assertEqual(self._callFUT((1380, 60), 0, 30), 0)
+
+    def test_before(self):
+        self.assertEqual(self._callFUT((120, 300), 1, 30, 10), 1790)
+
+    def test_after_wraps_to_tomorrow(self):
+        self.assertEqual(self._callFUT((120, 300), 6, 0), 20 * 3600)
+        self.assertEqual(self._callFUT((1380, 60), 2, 0), 21 * 3600)
+
+class LeakPredictorTests(unittest.TestCase):
+    def _makeOne(self, horizon, window=None):
+        from superlance.leakrate import LeakPredictor
+        return LeakPredictor(horizon, 5, window, localtime=time.gmtime)
+
+    def _feed(self, predictor, name='foo:foo', pid=11, rate=10, count=3):
+        for i in range(count):
+            predictor.observe(name, pid, i * 60, 1000 + i * 60 * rate)
+
+    def test_not_enough_samples(self):
+        predictor = self._makeOne(3600)
+        self._feed(predictor, count=2)
+        self.assertEqual(predictor.decide('foo:foo', 2000, 120),
+                         (None, None, 0))
+
+    def test_not_growing(self):
+        predictor = self._makeOne(3600)
+        self._feed(predictor, rate=0)
+        self.assertEqual(predictor.decide('foo:foo', 2000, 120),
+                         (None, None, 0))
+
+    def test_beyond_horizon(self):
+        predictor = self._makeOne(60)
+        self._feed(predictor)
+        # 2200 at 10 bytes/sec, 10000 bytes of headroom
+        self.assertEqual(predictor.decide('foo:foo', 12200, 120),
+                         (None, 1000, 0))
+
+    def test_restart(self):
+        from superlance.leakrate import RESTART
+        predictor = self._makeOne(3600)
+        self._feed(predictor)
+        self.assertEqual(predictor.decide('foo:foo', 12200, 120),
+                         (RESTART, 1000, 0))
+
+    def test_defer_to_window(self):
+        from superlance.leakrate import DEFER
+        predictor = self._makeOne(7200, window=(60, 120))
+        self._feed(predictor, rate=1)
+        # 5000 seconds of headroom, window opens in (3600 - 120) seconds
+        self.assertEqual(predictor.decide('foo:foo', 6120, 120),
+                         (DEFER, 5000, 3480))
+
+    def test_no_time_to_wait_for_window(self):
+        from superlance.leakrate import RESTART
+        predictor = self._makeOne(7200, window=(600, 660))
+        self._feed(predictor)
+        self.assertEqual(predictor.decide('foo:foo', 12200, 120),
+                         (RESTART, 1000, 0))
+
+    def test_restart_inside_window(self):
+        from superlance.leakrate import RESTART
+        predictor = self._makeOne(3600, window=(0, 60))
+        self._feed(predictor)
+        self.assertEqual(predictor.decide('foo:foo', 12200, 120),
+                         (RESTART, 1000, 0))
+
+    def test_new_pid_resets(self):
+        predictor = self._makeOne(3600)
+        self._feed(predictor)
+        predictor.observe('foo:foo', 12, 180, 100)
+        self.assertEqual(len(predictor.rings['foo:foo']), 1)
+        self.assertEqual(predictor.projection('foo:foo', 12200), None)
+
+    def test_forget(self):
+        predictor = self._makeOne(3600)
+        self._feed(predictor, name='foo:foo')
+        self._feed(predictor, name='bar:bar')
+        predictor.forget({'bar:bar': 1})
+        self.assertEqual(predictor.rings.keys(), ['bar:bar'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
+import os
 import sys
 import unittest
 from StringIO import StringIO
 from superlance.tests.dummy import *
+from superlance.samplers import PSSampler
 
 class MemmonTests(unittest.TestCase):
     def _getTargetClass(self):
@@ -19,7 +21,7 @@ class MemmonTests(unittest.TestCase):
         memmon.stdin = StringIO()
         memmon.stdout = StringIO()
         memmon.stderr = StringIO()
-        memmon.pscommand = 'echo 22%s'
+        memmon.sampler = PSSampler('echo 22%s')
         return memmon
         
     def test_runforever_notatick(self):
@@ -58,6 +60,35 @@ class MemmonTests(unittest.TestCase):
         self.assertEqual(mailed[2], '')
         self.failUnless(mailed[3].startswith('memmon.py restarted'))
 
+    def test_runforever_tick_restarts_batched(self):
+        memmon = self._makeOnePopulated({}, {}, 0)
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        names = ['foo:foo', 'bar:bar', 'baz:baz_01']
+        self.assertEqual(memmon.rpc.system.multicalls, [
+            [ {'methodName': 'supervisor.stopProcess', 'params': [x]}
+              for x in names ],
+            [ {'methodName': 'supervisor.startProcess', 'params': [x]}
+              for x in names ],
+            ])
+
+    def test_runforever_process_state_event(self):
+        programs = {'foo': 0}
+        memmon = self._makeOnePopulated(programs, {}, None)
+        memmon.sampler = DummySampler({99: 100})
+        payload = 'processname:foo groupname:foo from_state:STARTING pid:99'
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.write('eventname:PROCESS_STATE_RUNNING len:%s\n%s' % (
+            len(payload), payload))
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        for i in range(3):
+            memmon.runforever(test=True)
+        # the second tick uses the table, not getAllProcessInfo()
+        self.assertEqual(memmon.sampler.sampled, [[11], [99]])
+        self.assertEqual(memmon.rpc.supervisor.all_process_info[0]['pid'], 11)
+
     def test_runforever_tick_groups(self):
         programs = {}
         groups = {'foo':0}
@@ -141,6 +172,317 @@ class MemmonTests(unittest.TestCase):
         self.assertEqual(lines[2], '')
         self.assertEqual(memmon.mailed, False)
 
+    def test_runforever_tick_tree(self):
+        programs = {'foo': 1000}
+        groups = {}
+        any = None
+        memmon = self._makeOnePopulated(programs, groups, any)
+        memmon.tree = True
+        # foo (pid 11) is a pre-fork master with two workers
+        memmon.sampler = DummySampler({11: 100, 20: 600, 21: 600, 12: 5},
+                                      {11: 1, 20: 11, 21: 11, 12: 1})
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[1], 'RSS of foo:foo is 1300')
+        self.assertEqual(lines[2], 'Restarting foo:foo')
+        self.assertEqual(memmon.sampler.sampled, [[11, 20, 21]])
+
+    def test_runforever_tick_metric_label(self):
+        memmon = self._makeOnePopulated({'foo': 0}, {}, None)
+        memmon.sampler = DummySampler({11: 100})
+        memmon.sampler.metric = 'pss'
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[1], 'PSS of foo:foo is 100')
+        self.failUnless(memmon.mailed.endswith('(100 bytes PSS)'))
+
+    def test_runforever_tick_predicted_restart(self):
+        import time
+        from superlance.leakrate import LeakPredictor
+        memmon = self._makeOnePopulated({'foo': 10000}, {}, None)
+        memmon.sampler = DummySampler({11: 5000})
+        memmon.predictor = LeakPredictor(10000, 5)
+        # growing by 1 byte a second
+        now = time.time()
+        for when in (now - 200, now - 100):
+            memmon.predictor.observe('foo:foo', 11, when, 5000 - now + when)
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[1], 'RSS of foo:foo is 5000')
+        self.failUnless(lines[2].startswith(
+            'RSS of foo:foo projected to reach 10000 in '))
+        self.assertEqual(lines[3], 'Restarting foo:foo')
+        self.failUnless('was projected to reach its limit' in memmon.mailed)
+
+    def test_runforever_tick_predicted_restart_deferred(self):
+        import time
+        from superlance.leakrate import LeakPredictor
+        memmon = self._makeOnePopulated({'foo': 10000}, {}, None)
+        memmon.sampler = DummySampler({11: 5000})
+        now = time.time()
+        t = time.localtime(now)
+        minute = t.tm_hour * 60 + t.tm_min
+        # a window which opens in a couple of minutes
+        window = ((minute + 2) % 1440, (minute + 3) % 1440)
+        memmon.predictor = LeakPredictor(100000, 5, window)
+        for when in (now - 200, now - 100):
+            memmon.predictor.observe('foo:foo', 11, when, 5000 - now + when)
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.failUnless(lines[2].startswith(
+            'RSS of foo:foo projected to reach 10000 in '))
+        self.failUnless(lines[3].startswith('Deferring restart of foo:foo'))
+        self.assertEqual(memmon.mailed, False)
+
+    def test_runforever_tick_oom_kills(self):
+        memmon = self._makeOnePopulated({'foo': sys.maxint}, {}, None)
+        memmon.sampler = DummySampler({11: 100})
+        memmon.sampler.oom_kills = lambda: [(11, '/foo.service', 2)]
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[1], 'The kernel OOM killer killed 2 '
+                         'process(es) in the cgroup /foo.service of foo:foo')
+        self.assertEqual(lines[2], 'RSS of foo:foo is 100')
+        mailed = memmon.mailed.split('\n')
+        self.assertEqual(mailed[1],
+            'Subject: memmon: process foo:foo OOM-killed by the kernel')
+
+    def test_runforever_tick_restart_pool(self):
+        import threading
+        from superlance.restartpool import RestartPool
+        memmon = self._makeOnePopulated({'foo': 0}, {}, None)
+        # hold the worker back until the tick is done, so that lines are
+        # written in a predictable order
+        handled = threading.Event()
+        def restart(*arg, **kw):
+            handled.wait()
+            memmon.restart(*arg, **kw)
+        memmon.pool = RestartPool(restart, DummyRPCServer, 1)
+        memmon.stdin.write('eventname:TICK len:0\neventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        handled.set()
+        memmon.pool.join()
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[0], 'Checking programs foo=0')
+        self.assertEqual(lines[1],
+            'Restarts: 0 queued, 0 in flight, 0 completed, 0 failed')
+        self.assertEqual(lines[2], 'RSS of foo:foo is 2264064')
+        self.assertEqual(lines[3], 'Queued restart of foo:foo')
+        self.assertEqual(lines[4], 'Restarting foo:foo')
+        self.failUnless(memmon.stdout.getvalue().endswith('OK'))
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[6],
+            'Restarts: 0 queued, 0 in flight, 1 completed, 0 failed')
+
+    def test_runforever_tick_restart_pool_failure_exits(self):
+        import xmlrpclib
+        from superlance.restartpool import RestartPool
+        memmon = self._makeOnePopulated({'FAILED': 0}, {}, None)
+        memmon.pool = RestartPool(memmon.restart, DummyRPCServer, 1)
+        memmon.rpc.supervisor.all_process_info = [
+            dict(DummySupervisorRPCNamespace.all_process_info[0],
+                 name='FAILED')]
+        memmon.stdin.write('eventname:TICK len:0\neventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        memmon.pool.join()
+        self.assertRaises(xmlrpclib.Fault, memmon.runforever, True)
+
+    def test_runforever_tick_namespec_program(self):
+        programs = {'baz:baz_01': 0}
+        memmon = self._makeOnePopulated(programs, {}, None)
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[1], 'RSS of baz:baz_01 is 2265088')
+        self.assertEqual(lines[2], 'Restarting baz:baz_01')
+        self.assertEqual(len(lines), 4)
+
+    def test_runforever_tick_glob_program(self):
+        programs = {'ba*': 0, 'foo': sys.maxint}
+        memmon = self._makeOnePopulated(programs, {}, None)
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[1], 'RSS of foo:foo is 2264064')
+        self.assertEqual(lines[2], 'RSS of bar:bar is 2265088')
+        self.assertEqual(lines[3], 'Restarting bar:bar')
+        self.assertEqual(lines[4], 'RSS of baz:baz_01 is 2265088')
+        self.assertEqual(lines[5], 'Restarting baz:baz_01')
+        self.assertEqual(len(lines), 7)
+
+    def test_runforever_tick_program_and_group_restart_once(self):
+        programs = {'foo': 0}
+        groups = {'foo': 0}
+        memmon = self._makeOnePopulated(programs, groups, 0)
+        memmon.rpc.supervisor.all_process_info = \
+            DummySupervisorRPCNamespace.all_process_info[:1]
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[3], 'RSS of foo:foo is 2264064')
+        self.assertEqual(lines[4], 'Restarting foo:foo')
+        self.assertEqual(len(lines), 6)
+
+    def test_runforever_tick_only_samples_watched(self):
+        memmon = self._makeOnePopulated({'foo': sys.maxint}, {}, None)
+        memmon.sampler = DummySampler({11: 100, 12: 100})
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        self.assertEqual(memmon.sampler.sampled, [[11]])
+
+    def _makeOneThreaded(self, programs, values):
+        from superlance.memmon import SamplingThread
+        memmon = self._makeOnePopulated(programs, {}, None)
+        memmon.sampler = DummySampler(values)
+        memmon.thread = SamplingThread(memmon, 0.01)
+        return memmon
+
+    def test_sampling_thread_breaches_once_per_pid(self):
+        memmon = self._makeOneThreaded({'foo': 1000, 'bar': 1000},
+                                       {11: 2000, 12: 10})
+        thread = memmon.thread
+        thread.watch(memmon.watch(memmon.rpc.supervisor.getAllProcessInfo()))
+        thread.sample()
+        thread.sample()
+        self.assertEqual(thread.latest, [('foo:foo', 2000), ('bar:bar', 10)])
+        self.assertEqual(thread.breaches.qsize(), 1)
+        pid, name, mem, reason = thread.breaches.get()
+        self.assertEqual((pid, name, mem), (11, 'foo:foo', 2000))
+        self.failUnless(reason.startswith('it was consuming too much memory'))
+        # no lines are written from the thread
+        self.assertEqual(memmon.stderr.getvalue(), '')
+
+    def test_runforever_tick_sampling_thread(self):
+        memmon = self._makeOneThreaded({'foo': 1000}, {11: 2000})
+        memmon.stdin.write('eventname:TICK len:0\neventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        # the first tick only hands the processes to the thread
+        memmon.runforever(test=True)
+        self.failIf(memmon.thread.isAlive())
+        self.assertEqual(memmon.stderr.getvalue(),
+                         'Checking programs foo=1000\n')
+        memmon.thread.sample()
+        memmon.runforever(test=True)
+        lines = memmon.stderr.getvalue().split('\n')
+        self.assertEqual(lines[2], 'RSS of foo:foo is 2000')
+        self.assertEqual(lines[3], 'Restarting foo:foo')
+        self.assertEqual(len(lines), 5)
+
+    def test_wait_drains_breaches(self):
+        memmon = self._makeOneThreaded({'foo': 1000}, {11: 2000})
+        memmon.watched = memmon.watch(
+            memmon.rpc.supervisor.getAllProcessInfo())
+        memmon.thread.breaches.put((11, 'foo:foo', 2000, 'why'))
+        # a breach of a process which has gone away since
+        memmon.thread.breaches.put((99, 'bar:bar', 2000, 'why'))
+        r, w = os.pipe()
+        os.write(w, 'eventname:TICK len:3\nabc')
+        memmon.stdin = os.fdopen(r)
+        try:
+            headers, payload = memmon.wait()
+        finally:
+            memmon.stdin.close()
+            os.close(w)
+        self.assertEqual(headers['eventname'], 'TICK')
+        self.assertEqual(payload, 'abc')
+        self.assertEqual(memmon.stderr.getvalue(), 'Restarting foo:foo\n')
+        self.assertEqual(memmon.stdout.getvalue(), 'READY\n')
+
+    def test_drain_pool_full_reports_again(self):
+        memmon = self._makeOneThreaded({'foo': 1000}, {11: 2000})
+        thread = memmon.thread
+        memmon.watched = memmon.watch(
+            memmon.rpc.supervisor.getAllProcessInfo())
+        thread.watch(memmon.watched)
+        class FullPool:
+            def submit(self, name, *args):
+                return False
+        memmon.pool = FullPool()
+        thread.sample()
+        memmon.drain()
+        self.assertEqual(memmon.stderr.getvalue(),
+                         'Not queueing restart of foo:foo: a restart is '
+                         'already pending or the queue is full\n')
+        # still over its limit, so it is reported again
+        thread.sample()
+        self.assertEqual(thread.breaches.qsize(), 1)
+
+    def test_runforever_tick_adaptive(self):
+        from superlance.adaptive import AdaptiveScheduler
+        memmon = self._makeOnePopulated({}, {}, 1000)
+        memmon.sampler = DummySampler({11: 1000, 12: 100})
+        memmon.scheduler = AdaptiveScheduler(3600)
+        memmon.stdin.write('eventname:TICK len:0\neventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        memmon.runforever(test=True)
+        # foo (pid 11) is at its limit, so it is measured again right away
+        self.assertEqual(memmon.sampler.sampled, [[11, 12, 12], [11]])
+
+    def test_runforever_tick_metrics(self):
+        from superlance.exporter import MetricsExporter
+        memmon = self._makeOnePopulated({'foo': 0, 'bar': sys.maxint}, {},
+                                        None)
+        memmon.exporter = MetricsExporter()
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        lines = memmon.exporter.body.split('\n')
+        self.assertEqual(lines[2], 'memmon_process_memory_bytes'
+                         '{group="bar",name="bar",metric="rss"} 2265088')
+        self.assertEqual(lines[3], 'memmon_process_memory_bytes'
+                         '{group="foo",name="foo",metric="rss"} 2264064')
+        self.assertEqual(lines[6], 'memmon_process_limit_bytes'
+                         '{group="bar",name="bar"} %d' % sys.maxint)
+        self.assertEqual(lines[7], 'memmon_process_limit_bytes'
+                         '{group="foo",name="foo"} 0')
+        self.assertEqual(lines[10], 'memmon_restarts_total'
+                         '{group="foo",name="foo"} 1')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        body = memmon.exporter.body
+        self.failUnless('memmon_restarts_total{group="foo",name="foo"} 2\n'
+                        in body)
+        self.failUnless('memmon_group_restarts_total{group="foo"} 2\n'
+                        in body)
+
+    def test_runforever_tick_statsd(self):
+        memmon = self._makeOnePopulated({'foo': 0}, {}, None)
+        memmon.stats = DummyStats()
+        memmon.stdin.write('eventname:TICK len:0\n')
+        memmon.stdin.seek(0)
+        memmon.runforever(test=True)
+        tags = [('group', 'foo'), ('name', 'foo')]
+        self.assertEqual(memmon.stats.metrics, [
+            ('rss', 2264064, 'g', tags),
+            ('restarts', 1, 'c', tags),
+            ])
+        # once after measuring, once after restarting
+        self.assertEqual(memmon.stats.flushed, 2)
+
+    def test_measure_tree_vanished_root(self):
+        memmon = self._makeOnePopulated({}, {}, None)
+        memmon.tree = True
+        memmon.sampler = DummySampler({20: 600}, {11: 1, 20: 11})
+        self.assertEqual(memmon.measure([11]), {})
+
     def test_stopprocess_fault_tick_programs_norestart(self):
         programs = {'foo': sys.maxint}
         groups = {}
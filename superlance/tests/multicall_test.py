@@ -0,0 +1,55 @@
+import unittest
+from superlance.tests.dummy import DummyRPCServer
+
+class MultiCallTests(unittest.TestCase):
+    def _makeOne(self, rpc, batchsize=100):
+        from superlance.multicall import MultiCall
+        return MultiCall(rpc, batchsize)
+
+    def test_execute(self):
+        import xmlrpclib
+        rpc = DummyRPCServer()
+        calls = self._makeOne(rpc)
+        calls.add('supervisor.stopProcess', 'foo:foo')
+        calls.add('supervisor.stopProcess', 'foo:FAILED')
+        self.assertEqual(len(calls), 2)
+        results = calls.execute()
+        self.assertEqual(results[0], True)
+        self.failUnless(isinstance(results[1], xmlrpclib.Fault))
+        self.assertEqual(results[1].faultString, 'FAILED')
+        self.assertEqual(len(calls), 0)
+        self.assertEqual(rpc.system.multicalls, [[
+            {'methodName': 'supervisor.stopProcess', 'params': ['foo:foo']},
+            {'methodName': 'supervisor.stopProcess',
+             'params': ['foo:FAILED']},
+            ]])
+
+    def test_execute_batches(self):
+        rpc = DummyRPCServer()
+        calls = self._makeOne(rpc, batchsize=2)
+        for name in 'abcde':
+            calls.add('supervisor.startProcess', name)
+        self.assertEqual(calls.execute(), [True] * 5)
+        self.assertEqual([ len(x) for x in rpc.system.multicalls ], [2, 2, 1])
+
+    def test_execute_nothing(self):
+        rpc = DummyRPCServer()
+        self.assertEqual(self._makeOne(rpc).execute(), [])
+        self.assertEqual(rpc.system.multicalls, [])
+
+class CallEachTests(unittest.TestCase):
+    def _callFUT(self, rpc, method, names):
+        from superlance.multicall import call_each
+        return call_each(rpc, method, names)
+
+    def test_call_each(self):
+        from superlance.multicall import is_fault
+        rpc = DummyRPCServer()
+        results = self._callFUT(rpc, 'supervisor.startProcess',
+                                ['foo:foo', 'foo:SPAWN_ERROR'])
+        self.assertEqual(results[0], True)
+        self.failUnless(is_fault(results[1]))
+        self.assertEqual(len(rpc.system.multicalls), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,6 +53,16 @@ pid:58597' % (pname, gname, expected)
         self.assertEquals([unexpectedErrorMsg], monitor.getBatchMsgs())
         self.assertEquals('%s\n' % unexpectedErrorMsg, monitor.stderr.getvalue())
 
+    def test_handleEvent_exit_statsd(self):
+        from superlance.tests.dummy import DummyStats
+        monitor = self._makeOneMocked(stats=DummyStats())
+        hdrs, payload = self.getProcessExitedEvent('foo', 'bar', 0)
+        monitor.handleEvent(hdrs, payload)
+        self.assertEquals([('process_state_exited', 1, 'c',
+                            [('group', 'bar'), ('name', 'foo')])],
+                          monitor.stats.metrics)
+        self.assertEquals(1, monitor.stats.flushed)
+
     def test_handleEvent_non_exit(self):
         monitor = self._makeOneMocked()
         hdrs, payload = self.getProcessExitedEvent('foo', 'bar', 0,
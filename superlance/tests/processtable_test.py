@@ -0,0 +1,99 @@
+import unittest
+from supervisor.states import ProcessStates
+from superlance.tests.dummy import DummyRPCServer
+
+class DummyClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+class ProcessTableTests(unittest.TestCase):
+    def _makeOne(self, resync=60):
+        from superlance.processtable import ProcessTable
+        self.rpc = DummyRPCServer()
+        self.clock = DummyClock()
+        return ProcessTable(self.rpc, resync, self.clock)
+
+    def _event(self, table, eventname, payload):
+        return table.handle({'eventname': eventname}, payload)
+
+    def _break_rpc(self):
+        # any further getAllProcessInfo() would see this
+        self.rpc.supervisor.all_process_info = []
+
+    def test_all_syncs_until_tracking(self):
+        table = self._makeOne()
+        self.assertEqual([ x['name'] for x in table.all() ],
+                         ['foo', 'bar', 'baz_01'])
+        self._break_rpc()
+        self.assertEqual(table.all(), [])
+
+    def test_all_copies(self):
+        table = self._makeOne()
+        table.all()[0]['pid'] = 99
+        self.assertEqual(self.rpc.supervisor.all_process_info[0]['pid'], 11)
+
+    def test_state_event(self):
+        table = self._makeOne()
+        table.all()
+        self.assertEqual(self._event(table, 'PROCESS_STATE_RUNNING',
+                                     'processname:baz_01 groupname:baz '
+                                     'from_state:STARTING pid:99'), True)
+        self._break_rpc()
+        baz = table.all()[2]
+        self.assertEqual(baz['state'], ProcessStates.RUNNING)
+        self.assertEqual(baz['statename'], 'RUNNING')
+        self.assertEqual(baz['pid'], 99)
+
+    def test_state_event_not_alive(self):
+        table = self._makeOne()
+        table.all()
+        self._event(table, 'PROCESS_STATE_EXITED',
+                    'processname:foo groupname:foo from_state:RUNNING '
+                    'expected:0 pid:11')
+        self._break_rpc()
+        foo = table.all()[0]
+        self.assertEqual(foo['state'], ProcessStates.EXITED)
+        self.assertEqual(foo['pid'], 0)
+
+    def test_unknown_process_resyncs(self):
+        table = self._makeOne()
+        table.all()
+        self._event(table, 'PROCESS_STATE_STARTING',
+                    'processname:new groupname:new from_state:STOPPED '
+                    'tries:0')
+        self._break_rpc()
+        self.assertEqual(table.all(), [])
+
+    def test_group_event_resyncs(self):
+        table = self._makeOne()
+        table.all()
+        self._event(table, 'PROCESS_STATE_STOPPED',
+                    'processname:foo groupname:foo from_state:STOPPING '
+                    'pid:11')
+        self.assertEqual(self._event(table, 'PROCESS_GROUP_REMOVED',
+                                     'groupname:foo'), True)
+        self._break_rpc()
+        self.assertEqual(table.all(), [])
+
+    def test_periodic_resync(self):
+        table = self._makeOne(resync=60)
+        table.all()
+        self._event(table, 'PROCESS_STATE_STOPPED',
+                    'processname:foo groupname:foo from_state:STOPPING '
+                    'pid:11')
+        self._break_rpc()
+        self.clock.now = 59
+        self.assertEqual(len(table.all()), 3)
+        self.clock.now = 60
+        self.assertEqual(table.all(), [])
+
+    def test_other_event(self):
+        table = self._makeOne()
+        self.assertEqual(self._event(table, 'TICK_60', 'when:0'), False)
+        self.assertEqual(table.tracking, False)
+
+if __name__ == '__main__':
+    unittest.main()
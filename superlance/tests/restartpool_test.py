@@ -0,0 +1,77 @@
+import threading
+import unittest
+
+class RestartPoolTests(unittest.TestCase):
+    def _makeOne(self, restart, workers=1, maxqueue=64):
+        from superlance.restartpool import RestartPool
+        rpcs = []
+        def rpcfactory():
+            rpcs.append(object())
+            return rpcs[-1]
+        pool = RestartPool(restart, rpcfactory, workers, maxqueue)
+        pool.rpcs = rpcs
+        return pool
+
+    def test_restart_gets_worker_rpc(self):
+        calls = []
+        def restart(name, mem, rpc=None):
+            calls.append((name, mem, rpc))
+        pool = self._makeOne(restart, workers=2)
+        self.assertEqual(len(pool.rpcs), 2)
+        self.failUnless(pool.submit('foo:foo', 100))
+        pool.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0][:2], ('foo:foo', 100))
+        self.failUnless(calls[0][2] in pool.rpcs)
+        self.assertEqual(pool.status(),
+            'Restarts: 0 queued, 0 in flight, 1 completed, 0 failed')
+
+    def test_one_pending_restart_per_name(self):
+        started = threading.Event()
+        release = threading.Event()
+        def restart(name, rpc=None):
+            started.set()
+            release.wait()
+        pool = self._makeOne(restart)
+        self.failUnless(pool.submit('foo:foo'))
+        started.wait()
+        self.failIf(pool.submit('foo:foo'))
+        self.failUnless(pool.submit('bar:bar'))
+        self.failIf(pool.submit('bar:bar'))
+        self.assertEqual(pool.status(),
+            'Restarts: 1 queued, 1 in flight, 0 completed, 0 failed')
+        release.set()
+        pool.join()
+        self.assertEqual(pool.status(),
+            'Restarts: 0 queued, 0 in flight, 2 completed, 0 failed')
+        self.failUnless(pool.submit('foo:foo'))
+        pool.join()
+
+    def test_queue_full(self):
+        started = threading.Event()
+        release = threading.Event()
+        def restart(name, rpc=None):
+            started.set()
+            release.wait()
+        pool = self._makeOne(restart, maxqueue=1)
+        self.failUnless(pool.submit('foo:foo'))
+        started.wait()
+        self.failUnless(pool.submit('bar:bar'))
+        self.failIf(pool.submit('baz:baz'))
+        release.set()
+        pool.join()
+
+    def test_reraise(self):
+        def restart(name, rpc=None):
+            raise ValueError(name)
+        pool = self._makeOne(restart)
+        pool.reraise()
+        pool.submit('foo:foo')
+        pool.join()
+        self.assertEqual(pool.status(),
+            'Restarts: 0 queued, 0 in flight, 0 completed, 1 failed')
+        self.assertRaises(ValueError, pool.reraise)
+        pool.reraise()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+class RulesTests(unittest.TestCase):
+    def _makeOne(self, programs=None, groups=None, any=None):
+        from superlance.rules import Rules
+        return Rules(programs or {}, groups or {}, any)
+
+    def test_no_rules(self):
+        rules = self._makeOne()
+        self.assertEqual(rules.resolve('foo', 'foo'), None)
+
+    def test_precedence(self):
+        from superlance.rules import PROGRAM, GROUP, ANY
+        rules = self._makeOne(
+            programs={'web:worker_01': 1, 'worker_01': 2, 'worker_*': 3,
+                      'web:*': 4},
+            groups={'web': 5, 'w*': 6},
+            any=7)
+        # a namespec beats a name
+        self.assertEqual(rules.resolve('web', 'worker_01'),
+                         (PROGRAM, 'web:worker_01', 1))
+        self.assertEqual(rules.resolve('other', 'worker_01'),
+                         (PROGRAM, 'worker_01', 2))
+        # a name beats a pattern; the more specific pattern wins
+        self.assertEqual(rules.resolve('web', 'worker_02'),
+                         (PROGRAM, 'worker_*', 3))
+        self.assertEqual(rules.resolve('web', 'cron'),
+                         (PROGRAM, 'web:*', 4))
+        # program rules beat group rules
+        self.assertEqual(rules.resolve('other', 'worker_02'),
+                         (PROGRAM, 'worker_*', 3))
+        # a group name beats a group pattern
+        rules = self._makeOne(groups={'web': 5, 'w*': 6}, any=7)
+        self.assertEqual(rules.resolve('web', 'cron'), (GROUP, 'web', 5))
+        self.assertEqual(rules.resolve('www', 'cron'), (GROUP, 'w*', 6))
+        # anything else falls through to any
+        self.assertEqual(rules.resolve('db', 'cron'), (ANY, None, 7))
+
+    def test_pattern_specificity_tie(self):
+        from superlance.rules import PROGRAM
+        rules = self._makeOne(programs={'b*': 1, 'a*': 2, '*_0?': 3})
+        self.assertEqual(rules.resolve('x', 'ab_01'), (PROGRAM, '*_0?', 3))
+        rules = self._makeOne(programs={'*b': 1, 'a*': 2})
+        self.assertEqual(rules.resolve('x', 'ab'), (PROGRAM, '*b', 1))
+
+    def test_pattern_character_class(self):
+        from superlance.rules import PROGRAM
+        rules = self._makeOne(programs={'worker_[0-4]?': 1})
+        self.assertEqual(rules.resolve('x', 'worker_42'),
+                         (PROGRAM, 'worker_[0-4]?', 1))
+        self.assertEqual(rules.resolve('x', 'worker_52'), None)
+
+    def test_pattern_matches_whole_name(self):
+        rules = self._makeOne(programs={'worker*': 1})
+        self.assertEqual(rules.resolve('x', 'oldworker'), None)
+
+    def test_any_zero(self):
+        from superlance.rules import ANY
+        rules = self._makeOne(any=0)
+        self.assertEqual(rules.resolve('x', 'y'), (ANY, None, 0))
+
+    def test_cache(self):
+        rules = self._makeOne(programs={'worker_*': 1})
+        infos = [{'group': 'x', 'name': 'worker_01'}]
+        rules.refresh(infos)
+        rules.resolve('x', 'worker_01')
+        self.assertEqual(rules.cache.keys(), [('x', 'worker_01')])
+        # the same processes, in another order: the cache is kept
+        rules.refresh(list(reversed(infos)))
+        self.assertEqual(rules.cache.keys(), [('x', 'worker_01')])
+        rules.refresh(infos + [{'group': 'x', 'name': 'worker_02'}])
+        self.assertEqual(rules.cache, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,442 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class ProcFixture:
+    def setUp(self):
+        self.procroot = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.procroot)
+
+    def _writeProcFile(self, pid, filename, data):
+        piddir = os.path.join(self.procroot, str(pid))
+        if not os.path.isdir(piddir):
+            os.makedirs(piddir)
+        f = open(os.path.join(piddir, filename), 'w')
+        f.write(data)
+        f.close()
+
+class ProcessTreeTests(unittest.TestCase):
+    def _makeOne(self, ppids):
+        from superlance.samplers import ProcessTree
+        return ProcessTree(ppids)
+
+    def test_descendants(self):
+        tree = self._makeOne({1: 0, 11: 1, 20: 11, 21: 11, 30: 20, 12: 1})
+        self.assertEqual(sorted(tree.descendants(11)), [11, 20, 21, 30])
+        self.assertEqual(tree.descendants(12), [12])
+
+    def test_descendants_unknown_pid(self):
+        tree = self._makeOne({1: 0})
+        self.assertEqual(tree.descendants(99), [99])
+
+    def test_descendants_cycle(self):
+        tree = self._makeOne({11: 12, 12: 11})
+        self.assertEqual(sorted(tree.descendants(11)), [11, 12])
+
+class PSPairsTests(unittest.TestCase):
+    def _callFUT(self, data):
+        from superlance.samplers import ps_pairs
+        return list(ps_pairs(data))
+
+    def test_parse(self):
+        self.assertEqual(self._callFUT('  PID  PPID\n 11  1\n\nx y z\n12 11'),
+                         [(11, 1), (12, 11)])
+
+class PSSamplerTests(unittest.TestCase):
+    def _makeOne(self, pscommand):
+        from superlance.samplers import PSSampler
+        return PSSampler(pscommand)
+
+    def test_sample(self):
+        sampler = self._makeOne('echo 22%s')
+        self.assertEqual(sampler.sample([11, 12]),
+                         {11: 2211 * 1024, 12: 2212 * 1024})
+
+    def test_sample_no_output(self):
+        sampler = self._makeOne('true %s')
+        self.assertEqual(sampler.sample([11]), {})
+
+    def test_sample_garbage(self):
+        sampler = self._makeOne('echo garbage%s')
+        self.assertEqual(sampler.sample([11]), {})
+
+class BatchPSSamplerTests(unittest.TestCase):
+    def _makeOne(self, pscommand, maxlen=16384):
+        from superlance.samplers import BatchPSSampler
+        return BatchPSSampler(pscommand, maxlen)
+
+    def test_chunks_single(self):
+        sampler = self._makeOne('')
+        self.assertEqual(list(sampler.chunks([11, 12, 13])), ['11,12,13'])
+
+    def test_chunks_split(self):
+        sampler = self._makeOne('', maxlen=6)
+        self.assertEqual(list(sampler.chunks([11, 12, 13])),
+                         ['11,12', '13'])
+
+    def test_chunks_empty(self):
+        sampler = self._makeOne('')
+        self.assertEqual(list(sampler.chunks([])), [])
+
+    def test_sample(self):
+        sampler = self._makeOne(
+            'printf "   11  2211\\n   12 2212\\n" # %s')
+        self.assertEqual(sampler.sample([11, 12]),
+                         {11: 2211 * 1024, 12: 2212 * 1024})
+
+    def test_sample_one_command_per_chunk(self):
+        sampler = self._makeOne('echo %s', maxlen=6)
+        commands = []
+        import superlance.samplers
+        original = superlance.samplers.shell
+        def shell(cmd):
+            commands.append(cmd)
+            return ''
+        superlance.samplers.shell = shell
+        try:
+            sampler.sample([11, 12, 13])
+        finally:
+            superlance.samplers.shell = original
+        self.assertEqual(commands, ['echo 11,12', 'echo 13'])
+
+    def test_sample_ignores_garbage_and_unknown_pids(self):
+        sampler = self._makeOne(
+            'printf "PID RSS\\n11 2211\\n99 1\\nfoo\\n" # %s')
+        self.assertEqual(sampler.sample([11, 12]), {11: 2211 * 1024})
+
+    def test_sample_real_ps(self):
+        from superlance.samplers import BatchPSSampler
+        sampler = BatchPSSampler()
+        rss = sampler.sample([os.getpid()])
+        self.failUnless(rss[os.getpid()] > 0)
+        self.assertEqual(sampler.ppids()[os.getpid()], os.getppid())
+
+class ProcSamplerTests(ProcFixture, unittest.TestCase):
+    def _makeOne(self):
+        from superlance.samplers import ProcSampler
+        return ProcSampler(self.procroot, pagesize=4096)
+
+    def test_sample(self):
+        self._writeProcFile(11, 'statm', '1000 250 30 10 0 200 0\n')
+        self._writeProcFile(12, 'statm', '1000 10 30 10 0 200 0\n')
+        sampler = self._makeOne()
+        self.assertEqual(sampler.sample([11, 12]),
+                         {11: 250 * 4096, 12: 10 * 4096})
+
+    def test_sample_missing_pid(self):
+        self._writeProcFile(11, 'statm', '1000 250 30 10 0 200 0\n')
+        sampler = self._makeOne()
+        self.assertEqual(sampler.sample([11, 99]), {11: 250 * 4096})
+
+    def test_sample_truncated(self):
+        self._writeProcFile(11, 'statm', '')
+        sampler = self._makeOne()
+        self.assertEqual(sampler.sample([11]), {})
+
+    def test_ppids(self):
+        self._writeProcFile(1, 'stat', '1 (init) S 0 1 1 0 -1\n')
+        self._writeProcFile(11, 'stat', '11 (a (b) c) R 1 11 11 0 -1\n')
+        self._writeProcFile(12, 'stat', '')
+        self._writeProcFile('self', 'stat', '11 (a (b) c) R 1 11 11 0 -1\n')
+        sampler = self._makeOne()
+        self.assertEqual(sampler.ppids(), {1: 0, 11: 1})
+
+    def test_sample_real_proc(self):
+        from superlance.samplers import ProcSampler, have_proc
+        if not have_proc():
+            return
+        sampler = ProcSampler()
+        rss = sampler.sample([os.getpid()])
+        self.failUnless(rss[os.getpid()] > 0)
+        self.assertEqual(sampler.ppids()[os.getpid()], os.getppid())
+
+SMAPS = """\
+00400000-0040b000 r-xp 00000000 08:01 1234      /bin/cat
+Size:                 44 kB
+Rss:                  40 kB
+Pss:                  20 kB
+Shared_Clean:         40 kB
+Private_Clean:         0 kB
+Private_Dirty:         0 kB
+Anonymous:             0 kB
+Swap:                  0 kB
+7f0000000000-7f0000100000 rw-p 00000000 00:00 0
+Size:               1024 kB
+Rss:                1000 kB
+Pss:                1000 kB
+Private_Clean:        10 kB
+Private_Dirty:       990 kB
+Anonymous:          1000 kB
+Swap:                 24 kB
+"""
+
+ROLLUP = """\
+00400000-7fff00000000 ---p 00000000 00:00 0      [rollup]
+Rss:                2000 kB
+Pss:                1500 kB
+Private_Clean:       100 kB
+Private_Dirty:      1200 kB
+Anonymous:          1300 kB
+Swap:                 10 kB
+"""
+
+class DummyClock:
+    def __init__(self, step):
+        self.now = 0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+class SmapsSamplerTests(ProcFixture, unittest.TestCase):
+    def _makeOne(self, metric, budget=None, clock=None):
+        from superlance.samplers import SmapsSampler
+        return SmapsSampler(metric, self.procroot, budget, clock)
+
+    def test_unknown_metric(self):
+        self.assertRaises(ValueError, self._makeOne, 'bogus')
+
+    def test_sample_rollup(self):
+        self._writeProcFile(11, 'smaps_rollup', ROLLUP)
+        self._writeProcFile(11, 'smaps', SMAPS)
+        for metric, kb in (('rss', 2000), ('pss', 1500), ('uss', 1300),
+                           ('anon', 1300), ('swap', 10)):
+            sampler = self._makeOne(metric)
+            self.assertEqual(sampler.sample([11]), {11: kb * 1024})
+            self.assertEqual(sampler.rollup, True)
+
+    def test_sample_smaps_fallback(self):
+        self._writeProcFile(11, 'smaps', SMAPS)
+        for metric, kb in (('rss', 1040), ('pss', 1020), ('uss', 1000),
+                           ('anon', 1000), ('swap', 24)):
+            sampler = self._makeOne(metric)
+            self.assertEqual(sampler.sample([11]), {11: kb * 1024})
+            self.assertEqual(sampler.rollup, False)
+
+    def test_sample_missing_pid(self):
+        self._writeProcFile(11, 'smaps_rollup', ROLLUP)
+        sampler = self._makeOne('pss')
+        self.assertEqual(sampler.sample([11, 99]), {11: 1500 * 1024})
+        self.assertEqual(sampler.rollup, True)
+
+    def test_sample_missing_pid_before_rollup_known(self):
+        sampler = self._makeOne('pss')
+        self.assertEqual(sampler.sample([99]), {})
+        self.assertEqual(sampler.rollup, None)
+
+    def test_sample_budget(self):
+        for pid in (11, 12, 13):
+            self._writeProcFile(pid, 'smaps_rollup', ROLLUP)
+        # every clock reading advances time by one second
+        sampler = self._makeOne('pss', budget=2, clock=DummyClock(1))
+        self.assertEqual(sampler.sample([11, 12, 13]),
+                         {11: 1500 * 1024})
+        self._writeProcFile(11, 'smaps_rollup', ROLLUP.replace('1500', '1'))
+        # 12 and 13 have never been sampled so they go first; 11 keeps its
+        # stale value
+        self.assertEqual(sampler.sample([11, 12, 13]),
+                         {11: 1500 * 1024, 12: 1500 * 1024})
+        self.assertEqual(sampler.sample([11, 12, 13]),
+                         {11: 1500 * 1024, 12: 1500 * 1024, 13: 1500 * 1024})
+        self.assertEqual(sampler.sample([11, 12, 13]),
+                         {11: 1024, 12: 1500 * 1024, 13: 1500 * 1024})
+
+    def test_sample_forgets_departed_pids(self):
+        self._writeProcFile(11, 'smaps_rollup', ROLLUP)
+        sampler = self._makeOne('pss')
+        sampler.sample([11])
+        self.assertEqual(sampler.sample([12]), {})
+        self.assertEqual(sampler.values, {})
+        self.assertEqual(sampler.sampled, {})
+
+    def test_sample_real_proc(self):
+        from superlance.samplers import SmapsSampler, have_proc
+        if not have_proc():
+            return
+        sampler = SmapsSampler('pss')
+        pss = sampler.sample([os.getpid()])
+        self.failUnless(pss[os.getpid()] > 0)
+
+class CgroupSamplerTests(ProcFixture, unittest.TestCase):
+    def setUp(self):
+        ProcFixture.setUp(self)
+        self.cgroot = tempfile.mkdtemp()
+
+    def tearDown(self):
+        ProcFixture.tearDown(self)
+        shutil.rmtree(self.cgroot)
+
+    def _makeOne(self, ppids=None):
+        from superlance.samplers import CgroupSampler
+        from superlance.tests.dummy import DummySampler
+        self._writeProcFile('self', 'cgroup', '0::/supervisord.service\n')
+        fallback = DummySampler({11: 1, 12: 2, 13: 3, 14: 4}, ppids)
+        return CgroupSampler(self.procroot, self.cgroot, fallback)
+
+    def _writeCgroup(self, path, current, oom_kill=0, procs=(11,)):
+        cgdir = os.path.join(self.cgroot, path.lstrip('/'))
+        if not os.path.isdir(cgdir):
+            os.makedirs(cgdir)
+        for filename, data in (
+            ('cgroup.procs', ''.join([ '%s\n' % x for x in procs ])),
+            ('memory.current', '%s\n' % current),
+            ('memory.events', 'low 0\nhigh 0\nmax 3\noom %s\n'
+             'oom_kill %s\n' % (oom_kill, oom_kill))):
+            f = open(os.path.join(cgdir, filename), 'w')
+            f.write(data)
+            f.close()
+
+    def test_sample(self):
+        self._writeProcFile(11, 'cgroup', '1:name=systemd:/x\n0::/foo\n')
+        self._writeProcFile(12, 'cgroup', '0::/supervisord.service\n')
+        self._writeProcFile(13, 'cgroup', '0::/shared\n')
+        self._writeProcFile(14, 'cgroup', '0::/shared\n')
+        self._writeCgroup('/foo', 1000)
+        self._writeCgroup('/shared', 2000, procs=(13, 14))
+        sampler = self._makeOne()
+        self.assertEqual(sampler.sample([11, 12, 13, 14, 99]),
+                         {11: 1000, 12: 2, 13: 3, 14: 4})
+        self.assertEqual(sampler.fallback.sampled, [[12, 13, 14, 99]])
+
+    def test_metric(self):
+        # the same for the pids measured by the fallback
+        self.assertEqual(self._makeOne().metric, 'rss')
+
+    def test_sample_shared_with_unwatched(self):
+        # 50 isn't passed to sample(), but shares 11's cgroup
+        self._writeProcFile(11, 'cgroup', '0::/foo\n')
+        self._writeCgroup('/foo', 1000, procs=(11, 50))
+        sampler = self._makeOne({11: 1, 50: 1})
+        self.assertEqual(sampler.sample([11]), {11: 1})
+        self.assertEqual(sampler.fallback.sampled, [[11]])
+
+    def test_sample_children_in_cgroup(self):
+        # 11's own children (and theirs) don't make its cgroup shared
+        self._writeProcFile(11, 'cgroup', '0::/foo\n')
+        self._writeCgroup('/foo', 1000, procs=(11, 50, 51))
+        sampler = self._makeOne({11: 1, 50: 11, 51: 50})
+        self.assertEqual(sampler.sample([11]), {11: 1000})
+
+    def test_sample_discovers_cgroup_once(self):
+        self._writeProcFile(11, 'cgroup', '0::/foo\n')
+        self._writeCgroup('/foo', 1000)
+        sampler = self._makeOne()
+        sampler.sample([11])
+        os.remove(os.path.join(self.procroot, '11', 'cgroup'))
+        self.assertEqual(sampler.sample([11]), {11: 1000})
+        self.assertEqual(sampler.sample([12]), {12: 2})
+        self.assertEqual(sampler.cgroups, {})
+
+    def test_sample_v1_only(self):
+        self._writeProcFile(11, 'cgroup', '4:memory:/foo\n')
+        sampler = self._makeOne()
+        self.assertEqual(sampler.sample([11]), {11: 1})
+        self.assertEqual(sampler.cgroups, {11: ''})
+
+    def test_sample_unreadable_cgroup(self):
+        self._writeProcFile(11, 'cgroup', '0::/gone\n')
+        sampler = self._makeOne()
+        self.assertEqual(sampler.sample([11]), {11: 1})
+
+    def test_oom_kills(self):
+        self._writeProcFile(11, 'cgroup', '0::/foo\n')
+        self._writeCgroup('/foo', 1000, oom_kill=2)
+        sampler = self._makeOne()
+        sampler.sample([11])
+        self.assertEqual(sampler.oom_kills(), [])
+        self._writeCgroup('/foo', 1000, oom_kill=5)
+        sampler.sample([11])
+        self.assertEqual(sampler.oom_kills(), [(11, '/foo', 3)])
+        self.assertEqual(sampler.oom_kills(), [])
+        sampler.sample([11])
+        self.assertEqual(sampler.oom_kills(), [])
+
+def cpu_stat(pid, utime, stime, start):
+    return ('%s (a (weird) name) S 1 %s %s 0 -1 4194560 100 0 0 0 %s %s 0 0 '
+            '20 0 1 0 %s 1000 100\n' % (pid, pid, pid, utime, stime, start))
+
+class CPUSamplerTests(ProcFixture, unittest.TestCase):
+    def _makeOne(self):
+        from superlance.samplers import CPUSampler
+        return CPUSampler(self.procroot, clktck=100, clock=DummyClock(10))
+
+    def test_first_sample_primes(self):
+        sampler = self._makeOne()
+        self._writeProcFile(11, 'stat', cpu_stat(11, 100, 50, 5000))
+        self.assertEqual(sampler.sample([11]), {})
+        self.assertEqual(sampler.previous, {(11, 5000): (150, 10)})
+
+    def test_sample(self):
+        sampler = self._makeOne()
+        self._writeProcFile(11, 'stat', cpu_stat(11, 100, 50, 5000))
+        sampler.sample([11])
+        # 5 seconds of CPU in 10 seconds
+        self._writeProcFile(11, 'stat', cpu_stat(11, 500, 150, 5000))
+        self.assertEqual(sampler.sample([11]), {11: 50.0})
+
+    def test_pid_reused(self):
+        sampler = self._makeOne()
+        self._writeProcFile(11, 'stat', cpu_stat(11, 5000, 5000, 5000))
+        sampler.sample([11])
+        self._writeProcFile(11, 'stat', cpu_stat(11, 10, 0, 9000))
+        self.assertEqual(sampler.sample([11]), {})
+        self.assertEqual(sampler.previous.keys(), [(11, 9000)])
+
+    def test_vanished_pid_forgotten(self):
+        sampler = self._makeOne()
+        self._writeProcFile(11, 'stat', cpu_stat(11, 100, 50, 5000))
+        sampler.sample([11])
+        self.assertEqual(sampler.sample([11, 12]), {11: 0.0})
+        self.assertEqual(sampler.sample([12]), {})
+        self.assertEqual(sampler.previous, {})
+
+    def test_ppids(self):
+        sampler = self._makeOne()
+        self._writeProcFile(11, 'stat', cpu_stat(11, 100, 50, 5000))
+        self.assertEqual(sampler.ppids(), {11: 1})
+
+class MakeSamplerTests(ProcFixture, unittest.TestCase):
+    def _callFUT(self, name):
+        from superlance.samplers import make_sampler
+        return make_sampler(name, self.procroot)
+
+    def test_auto_with_proc(self):
+        self._writeProcFile('self', 'statm', '1 1 1 1 0 1 0\n')
+        self.assertEqual(self._callFUT('auto').name, 'proc')
+
+    def test_auto_without_proc(self):
+        self.assertEqual(self._callFUT('auto').name, 'psbatch')
+
+    def test_explicit(self):
+        self.assertEqual(self._callFUT('ps').name, 'ps')
+        self.assertEqual(self._callFUT('psbatch').name, 'psbatch')
+        self.assertEqual(self._callFUT('proc').name, 'proc')
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, self._callFUT, 'bogus')
+
+    def test_metric(self):
+        from superlance.samplers import make_sampler
+        self._writeProcFile('self', 'statm', '1 1 1 1 0 1 0\n')
+        sampler = make_sampler('auto', self.procroot, 'pss', 0.5)
+        self.assertEqual(sampler.name, 'smaps')
+        self.assertEqual(sampler.metric, 'pss')
+        self.assertEqual(sampler.budget, 0.5)
+
+    def test_metric_without_proc(self):
+        from superlance.samplers import make_sampler
+        self.assertRaises(ValueError, make_sampler, 'auto', self.procroot,
+                          'pss')
+
+    def test_metric_ps(self):
+        from superlance.samplers import make_sampler
+        self._writeProcFile('self', 'statm', '1 1 1 1 0 1 0\n')
+        self.assertRaises(ValueError, make_sampler, 'ps', self.procroot,
+                          'pss')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import socket
+import unittest
+
+class StatsClientTests(unittest.TestCase):
+    def setUp(self):
+        # a local stand-in for the StatsD server
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+
+    def tearDown(self):
+        self.server.close()
+
+    def _makeOne(self, prefix='memmon', dogstatsd=False, maxsize=1432):
+        from superlance.statsd import StatsClient
+        host, port = self.server.getsockname()
+        return StatsClient(host, port, prefix, dogstatsd, maxsize)
+
+    def _receive(self, count):
+        return [ self.server.recv(65536) for i in range(count) ]
+
+    def test_metrics(self):
+        client = self._makeOne()
+        client.gauge('rss', 1024, [('group', 'foo'), ('name', 'bar')])
+        client.incr('restarts')
+        client.timing('probe', 12.5)
+        self.assertEqual(client.buffer, [
+            'memmon.rss.foo.bar:1024|g',
+            'memmon.restarts:1|c',
+            'memmon.probe:12.500|ms',
+            ])
+
+    def test_dogstatsd_tags(self):
+        client = self._makeOne(dogstatsd=True)
+        client.incr('restarts', tags=[('group', 'foo'), ('name', 'b|a:r')])
+        self.assertEqual(client.buffer,
+                         ['memmon.restarts:1|c|#group:foo,name:b_a_r'])
+
+    def test_sanitize_name(self):
+        client = self._makeOne(prefix='')
+        client.timing('probe', 1, [('url', 'http://foo:8080/')])
+        self.assertEqual(client.buffer, ['probe.http___foo_8080_:1|ms'])
+
+    def test_url_tag_is_one_part(self):
+        client = self._makeOne(prefix='httpok')
+        client.timing('probe', 1, [('url', 'http://127.0.0.1:8080/health')])
+        self.assertEqual(client.buffer,
+                         ['httpok.probe.http___127_0_0_1_8080_health:1|ms'])
+
+    def test_dogstatsd_url_tag(self):
+        client = self._makeOne(prefix='httpok', dogstatsd=True)
+        client.timing('probe', 1, [('url', 'http://127.0.0.1:8080/health')])
+        self.assertEqual(client.buffer, ['httpok.probe:1|ms|'
+                                         '#url:http_//127.0.0.1_8080/health'])
+
+    def test_flush_coalesces(self):
+        client = self._makeOne()
+        for i in range(3):
+            client.incr('restarts')
+        client.flush()
+        self.assertEqual(self._receive(1),
+                         ['memmon.restarts:1|c\n' * 2 + 'memmon.restarts:1|c'])
+        self.assertEqual(client.sent, 1)
+        self.assertEqual(client.buffer, [])
+
+    def test_flush_splits_at_maxsize(self):
+        # each line is 19 bytes; two of them and a newline fit in 40
+        client = self._makeOne(maxsize=40)
+        for i in range(5):
+            client.incr('restarts')
+        client.flush()
+        self.assertEqual(client.sent, 3)
+        packets = self._receive(3)
+        self.assertEqual([ len(x.split('\n')) for x in packets ], [2, 2, 1])
+        for packet in packets:
+            self.failUnless(len(packet) <= 40)
+
+    def test_flush_nothing(self):
+        client = self._makeOne()
+        client.flush()
+        self.assertEqual(client.sent, 0)
+
+    def test_flush_send_error_ignored(self):
+        client = self._makeOne()
+        client.address = ('127.0.0.1', 0) # not a valid destination
+        client.incr('restarts')
+        client.flush()
+        self.assertEqual(client.sent, 0)
+
+class ParseAddressTests(unittest.TestCase):
+    def _callFUT(self, value):
+        from superlance.statsd import parse_address
+        return parse_address(value)
+
+    def test_port(self):
+        self.assertEqual(self._callFUT('8125'), ('127.0.0.1', 8125))
+
+    def test_host_port(self):
+        self.assertEqual(self._callFUT('stats:8125'), ('stats', 8125))
+
+    def test_bad(self):
+        self.assertRaises(ValueError, self._callFUT, 'stats')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,275 @@
+import os
+import socket
+import ssl
+import threading
+import time
+import unittest
+
+def addrinfo(address, family=socket.AF_INET):
+    return (family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', address)
+
+class ResolverTests(unittest.TestCase):
+    def _makeOne(self, ttl, clock):
+        from superlance.timeoutconn import Resolver
+        self.lookups = []
+        def getaddrinfo(host, port, family, socktype):
+            self.lookups.append((host, port))
+            return [addrinfo(('127.0.0.1', port))]
+        return Resolver(ttl, clock, getaddrinfo)
+
+    def test_cached(self):
+        now = [1000]
+        resolver = self._makeOne(60, lambda: now[0])
+        infos = resolver.resolve('foo', 80)
+        self.assertEqual(infos, [addrinfo(('127.0.0.1', 80))])
+        now[0] = 1059
+        self.assertEqual(resolver.resolve('foo', 80), infos)
+        self.assertEqual(self.lookups, [('foo', 80)])
+        resolver.resolve('foo', 8080)
+        self.assertEqual(len(self.lookups), 2)
+        # expired
+        now[0] = 1060
+        resolver.resolve('foo', 80)
+        self.assertEqual(self.lookups[-1], ('foo', 80))
+        self.assertEqual(len(self.lookups), 3)
+
+    def test_not_cached(self):
+        resolver = self._makeOne(0, lambda: 1000)
+        resolver.resolve('foo', 80)
+        resolver.resolve('foo', 80)
+        self.assertEqual(len(self.lookups), 2)
+
+    def test_failure_not_cached(self):
+        from superlance.timeoutconn import Resolver
+        def getaddrinfo(*args):
+            raise socket.gaierror(-2, 'Name or service not known')
+        resolver = Resolver(60, time.time, getaddrinfo)
+        self.assertRaises(socket.gaierror, resolver.resolve, 'foo', 80)
+        self.assertEqual(resolver.cache, {})
+
+class InterleaveTests(unittest.TestCase):
+    def _callFUT(self, infos):
+        from superlance.timeoutconn import interleave
+        return interleave(infos)
+
+    def test_it(self):
+        v6 = [ addrinfo(('::%d' % i, 80), socket.AF_INET6) for i in range(3) ]
+        v4 = [ addrinfo(('10.0.0.%d' % i, 80)) for i in range(2) ]
+        self.assertEqual(self._callFUT(v6 + v4),
+                         [v6[0], v4[0], v6[1], v4[1], v6[2]])
+        self.assertEqual(self._callFUT(v4), v4)
+        self.assertEqual(self._callFUT([]), [])
+
+class ConnectFirstTests(unittest.TestCase):
+    def setUp(self):
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def _listen(self, backlog=5):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(backlog)
+        self.sockets.append(sock)
+        return sock.getsockname()
+
+    def _blackhole(self):
+        # a listening socket whose backlog is full doesn't answer SYNs
+        address = self._listen(0)
+        for i in range(4):
+            sock = socket.socket()
+            sock.setblocking(0)
+            sock.connect_ex(address)
+            self.sockets.append(sock)
+        time.sleep(0.05)
+        return address
+
+    def _refused(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        address = sock.getsockname()
+        sock.close()
+        return address
+
+    def _callFUT(self, addresses, timeout=2, delay=0.25):
+        from superlance.timeoutconn import connect_first
+        sock = connect_first([ addrinfo(x) for x in addresses ], timeout,
+                             delay)
+        self.sockets.append(sock)
+        return sock
+
+    def test_first(self):
+        good = self._listen()
+        self.assertEqual(self._callFUT([good]).getpeername(), good)
+
+    def test_refused_then_good(self):
+        good = self._listen()
+        start = time.time()
+        sock = self._callFUT([self._refused(), good])
+        self.assertEqual(sock.getpeername(), good)
+        # no waiting for the attempt delay after a refusal
+        self.failUnless(time.time() - start < 0.2)
+
+    def test_unsupported_family_then_good(self):
+        from superlance.timeoutconn import connect_first
+        good = self._listen()
+        # no such address family: socket() itself fails
+        infos = [addrinfo(('::1', good[1]), 9999), addrinfo(good)]
+        sock = connect_first(infos, 2)
+        self.sockets.append(sock)
+        self.assertEqual(sock.getpeername(), good)
+
+    def test_unsupported_family_only(self):
+        from superlance.timeoutconn import connect_first
+        infos = [addrinfo(('::1', 80), 9999)]
+        self.assertRaises(socket.error, connect_first, infos, 2)
+
+    def test_races_unresponsive(self):
+        good = self._listen()
+        start = time.time()
+        sock = self._callFUT([self._blackhole(), good], timeout=5, delay=0.1)
+        self.assertEqual(sock.getpeername(), good)
+        self.failUnless(time.time() - start < 1)
+
+    def test_all_refused(self):
+        from superlance.timeoutconn import connect_first
+        infos = [ addrinfo(self._refused()) for i in range(2) ]
+        try:
+            connect_first(infos, 2)
+        except socket.error, why:
+            self.assertEqual(why.args[1], 'ECONNREFUSED')
+        else:
+            self.fail('connected')
+
+    def test_timeout(self):
+        from superlance.timeoutconn import connect_first
+        start = time.time()
+        self.assertRaises(socket.timeout, connect_first,
+                          [addrinfo(self._blackhole())], 0.2)
+        self.failUnless(time.time() - start < 1)
+
+    def test_no_addresses(self):
+        from superlance.timeoutconn import connect_first
+        self.assertRaises(socket.error, connect_first, [], 1)
+
+class TimeoutHTTPConnectionTests(unittest.TestCase):
+    def _serve(self):
+        import BaseHTTPServer
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write('OK')
+            def log_message(self, *args):
+                pass
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.handle_request)
+        thread.setDaemon(True)
+        thread.start()
+        return server, thread
+
+    def test_timings(self):
+        from superlance.timeoutconn import TimeoutHTTPConnection
+        server, thread = self._serve()
+        try:
+            conn = TimeoutHTTPConnection('127.0.0.1', server.server_port)
+            conn.timeout = 5
+            conn.request('GET', '/')
+            res = conn.getresponse()
+            self.assertEqual(res.read(), 'OK')
+            self.assertEqual(sorted(conn.timings.keys()),
+                             ['connect', 'firstbyte', 'resolve'])
+            # a request on the open connection doesn't connect again
+            conn.request('GET', '/')
+            res = conn.getresponse()
+            res.read()
+            self.assertEqual(conn.timings.keys(), ['firstbyte'])
+            conn.close()
+            thread.join(5)
+        finally:
+            server.server_close()
+
+class TimeoutHTTPSConnectionTests(unittest.TestCase):
+    certfile = os.path.join(os.path.dirname(__file__), 'localhost.pem')
+
+    def _serve(self):
+        import BaseHTTPServer
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write('OK')
+            def log_message(self, *args):
+                pass
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        server.socket = ssl.wrap_socket(server.socket, server_side=True,
+                                        certfile=self.certfile)
+        # clients close without a TLS close_notify
+        server.handle_error = lambda request, address: None
+        thread = threading.Thread(target=server.handle_request)
+        thread.setDaemon(True)
+        thread.start()
+        return server, thread
+
+    def _makeOne(self, port, context):
+        from superlance.timeoutconn import TimeoutHTTPSConnection
+        conn = TimeoutHTTPSConnection('localhost', port, context=context)
+        conn.timeout = 5
+        return conn
+
+    def test_verified(self):
+        from superlance.timeoutconn import make_context
+        server, thread = self._serve()
+        try:
+            conn = self._makeOne(server.server_port,
+                                 make_context(cafile=self.certfile))
+            conn.request('GET', '/')
+            res = conn.getresponse()
+            self.assertEqual(res.read(), 'OK')
+            self.assertEqual(sorted(conn.timings.keys()),
+                             ['connect', 'firstbyte', 'handshake', 'resolve'])
+            self.assertEqual(conn.peercert['subject'],
+                             ((('commonName', 'localhost'),),))
+            self.failUnless(ssl.cert_time_to_seconds(
+                conn.peercert['notAfter']) > time.time())
+            conn.close()
+            thread.join(5)
+        finally:
+            server.server_close()
+
+    def test_not_verified(self):
+        from superlance.timeoutconn import make_context
+        server, thread = self._serve()
+        try:
+            conn = self._makeOne(server.server_port, make_context(False))
+            conn.request('GET', '/')
+            self.assertEqual(conn.getresponse().read(), 'OK')
+            # nothing is known of a certificate which wasn't verified
+            self.assertEqual(conn.peercert, {})
+            conn.close()
+            thread.join(5)
+        finally:
+            server.server_close()
+
+    def test_untrusted(self):
+        from superlance.timeoutconn import make_context
+        server, thread = self._serve()
+        try:
+            # a self-signed certificate isn't trusted by default
+            conn = self._makeOne(server.server_port,
+                                 make_context(cafile=None))
+            conn.context.load_default_certs()
+            self.assertRaises(ssl.SSLError, conn.request, 'GET', '/')
+            self.assertEqual(conn.sock, None)
+            thread.join(5)
+        finally:
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import socket
+import unittest
+import xmlrpclib
+
+class DummyResponse:
+    status = 200
+    reason = 'OK'
+
+    def __init__(self, body):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+class DummyConnection:
+    def __init__(self, failures=()):
+        self.failures = list(failures) # exceptions raised by request()
+        self.requests = []
+        self.closed = False
+
+    def request(self, method, handler, body, headers):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.requests.append((method, handler, body))
+
+    def getresponse(self):
+        return DummyResponse(xmlrpclib.dumps((True,), methodresponse=True))
+
+    def close(self):
+        self.closed = True
+
+class KeepAliveTransportTests(unittest.TestCase):
+    def _getTargetClass(self):
+        from superlance.transport import KeepAliveTransport
+        return KeepAliveTransport
+
+    def _makeOne(self, connections, clock=None, stats=None):
+        if clock is None:
+            clock = DummyClock()
+        transport = self._getTargetClass()('user', 'pass',
+                                           'http://127.0.0.1:9001', clock,
+                                           stats)
+        made = []
+        def get_connection():
+            connection = connections.pop(0)
+            made.append(connection)
+            return connection
+        transport._get_connection = get_connection
+        transport.made = made
+        return transport
+
+    def _call(self, transport, method='supervisor.getState'):
+        body = xmlrpclib.dumps((), method)
+        return transport.request('127.0.0.1', '/RPC2', body)
+
+    def test_reuses_connection(self):
+        transport = self._makeOne([DummyConnection()])
+        for i in range(3):
+            self.assertEqual(self._call(transport), (True,))
+        self.assertEqual(len(transport.made), 1)
+        self.assertEqual(len(transport.made[0].requests), 3)
+
+    def test_reconnects_after_broken_connection(self):
+        import httplib
+        broken = DummyConnection()
+        fresh = DummyConnection()
+        transport = self._makeOne([broken, fresh])
+        self._call(transport)
+        broken.failures.append(httplib.BadStatusLine(''))
+        self.assertEqual(self._call(transport), (True,))
+        self.failUnless(broken.closed)
+        self.assertEqual(len(transport.made), 2)
+        self.assertEqual(len(fresh.requests), 1)
+        self.failUnless(transport.connection is fresh)
+
+    def test_no_retry_on_fresh_connection(self):
+        refused = DummyConnection([socket.error(111, 'Connection refused')])
+        transport = self._makeOne([refused])
+        self.assertRaises(socket.error, self._call, transport)
+        self.assertEqual(len(transport.made), 1)
+        self.assertEqual(transport.connection, None)
+        self.failUnless(refused.closed)
+
+    def test_reconnects_after_reset(self):
+        import errno
+        broken = DummyConnection()
+        fresh = DummyConnection()
+        transport = self._makeOne([broken, fresh])
+        self._call(transport)
+        broken.failures.append(socket.error(errno.ECONNRESET,
+                                            'Connection reset by peer'))
+        self.assertEqual(self._call(transport), (True,))
+        self.assertEqual(len(fresh.requests), 1)
+
+    def test_no_retry_after_other_errors(self):
+        # the call may have been run already, e.g. the response timed out
+        import httplib
+        for failure in (socket.timeout('timed out'),
+                        httplib.IncompleteRead('')):
+            broken = DummyConnection()
+            transport = self._makeOne([broken, DummyConnection()])
+            self._call(transport, 'supervisor.stopProcess')
+            broken.failures.append(failure)
+            self.assertRaises(failure.__class__, self._call, transport,
+                              'supervisor.stopProcess')
+            self.assertEqual(len(transport.made), 1)
+            self.assertEqual(transport.connection, None)
+
+    def test_retry_fails_too(self):
+        from superlance.tests.dummy import DummyStats
+        broken = DummyConnection()
+        down = DummyConnection([socket.error(111, 'Connection refused')])
+        stats = DummyStats()
+        transport = self._makeOne([broken, down], stats=stats)
+        self._call(transport)
+        broken.failures.append(socket.error(32, 'Broken pipe'))
+        self.assertRaises(socket.error, self._call, transport)
+        self.assertEqual(len(transport.made), 2)
+        self.assertEqual(transport.connection, None)
+        # the failed call is timed all the same
+        self.assertEqual([ x[0] for x in stats.metrics ],
+                         ['rpc', 'rpc_reconnects', 'rpc'])
+
+    def test_stats(self):
+        from superlance.tests.dummy import DummyStats
+        clock = DummyClock([0.0, 0.002, 1.0, 1.004, 2.0, 2.010])
+        stats = DummyStats()
+        transport = self._makeOne([DummyConnection()], clock, stats)
+        self._call(transport, 'supervisor.getState')
+        self._call(transport, 'supervisor.getState')
+        self._call(transport, 'system.multicall')
+        self.assertEqual([ (name, round(ms, 3), kind, tags)
+                           for name, ms, kind, tags in stats.metrics ], [
+            ('rpc', 2.0, 'ms', [('method', 'supervisor.getState')]),
+            ('rpc', 4.0, 'ms', [('method', 'supervisor.getState')]),
+            ('rpc', 10.0, 'ms', [('method', 'system.multicall')]),
+            ])
+
+    def test_no_stats(self):
+        transport = self._makeOne([DummyConnection()])
+        self.assertEqual(self._call(transport), (True,))
+
+class GetRPCInterfaceTests(unittest.TestCase):
+    def test_it(self):
+        from superlance.transport import getRPCInterface
+        from superlance.transport import KeepAliveTransport
+        rpc = getRPCInterface({'SUPERVISOR_SERVER_URL':
+                               'unix:///tmp/supervisor.sock'})
+        transport = rpc._ServerProxy__transport
+        self.failUnless(isinstance(transport, KeepAliveTransport))
+        self.assertEqual(transport.username, '')
+        self.assertEqual(transport.serverurl, 'unix:///tmp/supervisor.sock')
+        self.assertEqual(transport.stats, None)
+
+    def test_stats(self):
+        from superlance.transport import getRPCInterface
+        from superlance.tests.dummy import DummyStats
+        stats = DummyStats()
+        rpc = getRPCInterface({'SUPERVISOR_SERVER_URL':
+                               'unix:///tmp/supervisor.sock'}, stats)
+        self.failUnless(rpc._ServerProxy__transport.stats is stats)
+
+    def test_not_a_listener(self):
+        from superlance.transport import getRPCInterface
+        self.assertRaises(KeyError, getRPCInterface, {})
+
+class DummyClock:
+    def __init__(self, times=None):
+        self.times = times
+
+    def __call__(self):
+        if self.times is None:
+            return 0.0
+        return self.times.pop(0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+def spec(name, group='web'):
+    return {'name': name, 'group': group}
+
+class ProcessNumTests(unittest.TestCase):
+    def _callFUT(self, name):
+        from superlance.urltemplate import process_num
+        return process_num(name)
+
+    def test_it(self):
+        self.assertEqual(self._callFUT('web_00'), 0)
+        self.assertEqual(self._callFUT('web_07'), 7)
+        self.assertEqual(self._callFUT('web12'), 12)
+        self.assertEqual(self._callFUT('web'), 0)
+
+class ExpandTests(unittest.TestCase):
+    def _callFUT(self, template, spec):
+        from superlance.urltemplate import expand
+        return expand(template, spec)
+
+    def test_offset(self):
+        template = 'http://127.0.0.1:{8000+process_num}/health'
+        self.assertEqual(self._callFUT(template, spec('web_03')),
+                         'http://127.0.0.1:8003/health')
+
+    def test_offset_after(self):
+        template = 'http://127.0.0.1:{ process_num + 9000 }/'
+        self.assertEqual(self._callFUT(template, spec('web_03')),
+                         'http://127.0.0.1:9003/')
+        template = 'http://127.0.0.1:{process_num-1}/'
+        self.assertEqual(self._callFUT(template, spec('web_03')),
+                         'http://127.0.0.1:2/')
+
+    def test_names(self):
+        template = 'http://{group}.local/{name}/{process_num}'
+        self.assertEqual(self._callFUT(template, spec('web_03')),
+                         'http://web.local/web_03/3')
+
+    def test_bad_field(self):
+        self.assertRaises(ValueError, self._callFUT, 'http://x/{pid}',
+                          spec('web_03'))
+        self.assertRaises(ValueError, self._callFUT, 'http://x/{1+name}',
+                          spec('web_03'))
+
+class IsTemplateTests(unittest.TestCase):
+    def test_it(self):
+        from superlance.urltemplate import is_template
+        self.failUnless(is_template('http://x:{8000+process_num}/'))
+        self.failIf(is_template('http://x:8000/'))
+
+class CheckTests(unittest.TestCase):
+    def test_it(self):
+        from superlance.urltemplate import check
+        check('http://x:{8000+process_num}/')
+        self.assertRaises(ValueError, check, 'http://x:{8000*process_num}/')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,42 +1,224 @@
+import errno
 import httplib
+import select
 import socket
+import ssl
+import threading
+import time
+
+# how long to wait for one address before also trying the next, as
+# recommended by RFC 8305 ("Happy Eyeballs")
+ATTEMPT_DELAY = 0.25
+
+class Resolver:
+    """ A cache of getaddrinfo results, each kept for ``ttl`` seconds.
+    getaddrinfo doesn't tell us the TTL of the DNS records, so the same
+    TTL applies to all; 0 disables caching. """
+
+    def __init__(self, ttl=60, clock=time.time,
+                 getaddrinfo=socket.getaddrinfo):
+        self.ttl = ttl
+        self.clock = clock
+        self.getaddrinfo = getaddrinfo
+        self.lock = threading.Lock()
+        self.cache = {} # (host, port) -> (expires, addrinfos)
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = self.clock()
+        self.lock.acquire()
+        try:
+            cached = self.cache.get(key)
+        finally:
+            self.lock.release()
+        if cached is not None and now < cached[0]:
+            return cached[1]
+        infos = self.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        if self.ttl > 0:
+            self.lock.acquire()
+            try:
+                self.cache[key] = (now + self.ttl, infos)
+            finally:
+                self.lock.release()
+        return infos
+
+default_resolver = Resolver()
+
+def interleave(infos):
+    """ Order addresses alternating between address families, starting
+    with the family of the first """
+    families = []
+    byfamily = {}
+    for info in infos:
+        if info[0] not in byfamily:
+            families.append(info[0])
+            byfamily[info[0]] = []
+        byfamily[info[0]].append(info)
+    ordered = []
+    while byfamily:
+        for family in families:
+            if byfamily.get(family):
+                ordered.append(byfamily[family].pop(0))
+            if family in byfamily and not byfamily[family]:
+                del byfamily[family]
+    return ordered
+
+def connect_first(infos, timeout=None, delay=ATTEMPT_DELAY, clock=time.time):
+    """ Connect to the first of the addresses to accept, starting another
+    attempt every ``delay`` seconds (or as soon as one fails) rather than
+    waiting for each to time out in turn.  ``timeout`` bounds the whole. """
+    queue = interleave(infos)
+    if not queue:
+        raise socket.error('getaddrinfo returns an empty list')
+    start = clock()
+    pending = {} # socket -> address
+    error = None
+    next_attempt = start
+    try:
+        while queue or pending:
+            now = clock()
+            if timeout and now - start >= timeout:
+                raise socket.timeout('timed out')
+            if queue and now >= next_attempt:
+                family, socktype, proto, canonname, address = queue.pop(0)
+                try:
+                    sock = socket.socket(family, socktype, proto)
+                except socket.error, why:
+                    # e.g. an IPv6 address with IPv6 turned off
+                    error = why
+                    next_attempt = now
+                    continue
+                sock.setblocking(0)
+                try:
+                    err = sock.connect_ex(address)
+                except socket.error, why:
+                    sock.close()
+                    error = why
+                    next_attempt = now
+                    continue
+                if err in (errno.EINPROGRESS, errno.EWOULDBLOCK,
+                           errno.EALREADY):
+                    pending[sock] = address
+                    next_attempt = now + delay
+                elif err:
+                    sock.close()
+                    error = socket.error(err, errno.errorcode.get(err, err))
+                    next_attempt = now
+                else:
+                    pending[sock] = address
+                continue
+
+            if queue:
+                wait = max(0, next_attempt - now)
+            else:
+                wait = None
+            if timeout:
+                left = max(0, timeout - (now - start))
+                if wait is None or left < wait:
+                    wait = left
+            r, writable, x = select.select([], pending.keys(), [], wait)
+            for sock in writable:
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if not err:
+                    del pending[sock]
+                    sock.setblocking(1)
+                    return sock
+                del pending[sock]
+                sock.close()
+                error = socket.error(err, errno.errorcode.get(err, err))
+                # try the next address right away
+                next_attempt = clock()
+        raise error
+    finally:
+        for sock in pending.keys():
+            sock.close()
 
 class TimeoutHTTPConnection(httplib.HTTPConnection):
     """A customised HTTPConnection allowing a per-connection
-    timeout, specified at construction."""
+    timeout, specified at construction.
+
+    Addresses are looked up through ``resolver`` and raced as
+    connect_first() does.  The time taken by each phase of the last
+    request is recorded in ``timings``: 'resolve', 'connect' (only if
+    the request opened the connection) and 'firstbyte' (from sending the
+    request to reading the status line)."""
     timeout = None
+    resolver = None # default_resolver, unless set
+
+    def __init__(self, *args, **kw):
+        httplib.HTTPConnection.__init__(self, *args, **kw)
+        self.timings = {}
+
+    def tcp_connect(self):
+        resolver = self.resolver or default_resolver
+        start = time.time()
+        infos = resolver.resolve(self.host, self.port)
+        resolved = time.time()
+        self.timings['resolve'] = resolved - start
+        sock = connect_first(infos, self.timeout)
+        self.timings['connect'] = time.time() - resolved
+        if self.timeout:   # this is the new bit
+            sock.settimeout(self.timeout)
+        return sock
 
     def connect(self):
         """Override HTTPConnection.connect to connect to
         host/port specified in __init__."""
+        self.sock = self.tcp_connect()
 
-        msg = "getaddrinfo returns an empty list"
-        for res in socket.getaddrinfo(self.host, self.port,
-                0, socket.SOCK_STREAM):
-            af, socktype, proto, canonname, sa = res
-            try:
-                self.sock = socket.socket(af, socktype, proto)
-                if self.timeout:   # this is the new bit
-                    self.sock.settimeout(self.timeout)
-                self.sock.connect(sa)
-            except socket.error, msg:
-                if self.sock:
-                    self.sock.close()
-                self.sock = None
-                continue
-            break
-        if not self.sock:
-            raise socket.error, msg
+    def request(self, *args, **kw):
+        self.timings = {}
+        httplib.HTTPConnection.request(self, *args, **kw)
+        self.sent = time.time()
+
+    def getresponse(self, *args, **kw):
+        response = httplib.HTTPConnection.getresponse(self, *args, **kw)
+        self.timings['firstbyte'] = time.time() - self.sent
+        return response
+
+def make_context(verify=True, cafile=None, certfile=None, keyfile=None):
+    """ An ssl.SSLContext for TimeoutHTTPSConnection, which checks the
+    server's certificate and host name against ``cafile`` (or the
+    system's trusted certificates) unless ``verify`` is false, and sends
+    ``certfile`` as the client certificate if given.  One context may be
+    shared by any number of connections. """
+    if verify:
+        context = ssl.create_default_context(cafile=cafile)
+    else:
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        context.verify_mode = ssl.CERT_NONE
+    if certfile:
+        context.load_cert_chain(certfile, keyfile)
+    return context
+
+class TimeoutHTTPSConnection(TimeoutHTTPConnection):
+    """ A TimeoutHTTPConnection over TLS, set up by ``context`` (by default
+    a make_context() of its own).  The TLS handshake is timed separately
+    from connecting, as 'handshake' in ``timings``, and the certificate
+    the server presented (as ssl.SSLSocket.getpeercert() returns it, so
+    empty unless it was verified) is kept in ``peercert``. """
+    default_port = httplib.HTTPS_PORT
+
+    def __init__(self, host, port=None, key_file=None, cert_file=None,
+                 context=None, *args, **kw):
+        TimeoutHTTPConnection.__init__(self, host, port, *args, **kw)
+        self.key_file = key_file
+        self.cert_file = cert_file
+        if context is None:
+            context = make_context(certfile=cert_file, keyfile=key_file)
+        self.context = context
+        self.peercert = None
 
-class TimeoutHTTPSConnection(httplib.HTTPSConnection):
-    timeout = None
-    
     def connect(self):
         "Connect to a host on a given (SSL) port."
-
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        if self.timeout:
-            self.sock.settimeout(self.timeout)
-        sock.connect((self.host, self.port))
-        ssl = socket.ssl(sock, self.key_file, self.cert_file)
-        self.sock = httplib.FakeSocket(sock, ssl)
+        sock = self.tcp_connect()
+        start = time.time()
+        try:
+            self.sock = self.context.wrap_socket(sock,
+                                                 server_hostname=self.host)
+        except:
+            sock.close()
+            raise
+        self.timings['handshake'] = time.time() - start
+        self.peercert = self.sock.getpeercert()
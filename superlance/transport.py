@@ -0,0 +1,100 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+A persistent-connection XML-RPC transport to supervisord for the
+superlance listeners.
+
+supervisor's own SupervisorTransport already keeps its HTTP/1.1
+connection open between calls, but once that connection breaks (e.g.
+supervisord was restarted, or closed an idle connection) every later
+call fails on it too.  KeepAliveTransport drops a broken connection,
+transparently retries a call which failed on a reused connection once on
+a fresh one, and, given a StatsD client, sends how long each call took
+(``rpc`` timers, tagged with the method) and the retries
+(``rpc_reconnects``).  Only the errors which xmlrpclib's own Transport
+retries on (a bad status line, or a reset or broken connection) are
+retried: after any other, supervisord may have run the call, and calls
+such as stopProcess mustn't be made twice.
+"""
+
+import errno
+import httplib
+import re
+import socket
+import time
+import xmlrpclib
+
+from supervisor.xmlrpc import SupervisorTransport
+
+METHODNAME = re.compile(r'<methodName>([^<]*)</methodName>')
+STALE_ERRNOS = (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE)
+
+def is_stale(why):
+    """ Whether the exception ``why`` shows that the server closed a
+    kept-alive connection, as xmlrpclib.Transport.request decides """
+    if isinstance(why, httplib.BadStatusLine):
+        return True
+    return (isinstance(why, socket.error) and
+            getattr(why, 'errno', None) in STALE_ERRNOS)
+
+class KeepAliveTransport(SupervisorTransport):
+    def __init__(self, username=None, password=None, serverurl=None,
+                 clock=time.time, stats=None):
+        SupervisorTransport.__init__(self, username, password, serverurl)
+        self.clock = clock
+        self.stats = stats
+        self.reused = False # was the last call made on an open connection?
+
+    def request(self, host, handler, request_body, verbose=0):
+        start = self.clock()
+        try:
+            try:
+                return self.send(host, handler, request_body, verbose)
+            except (socket.error, httplib.HTTPException), why:
+                if not self.reused or not is_stale(why):
+                    raise
+                # the server closed the kept-alive connection while it was
+                # idle; try once more on a new one
+                if self.stats is not None:
+                    self.stats.incr('rpc_reconnects')
+                return self.send(host, handler, request_body, verbose)
+        finally:
+            self.record(request_body, self.clock() - start)
+
+    def send(self, host, handler, request_body, verbose):
+        self.reused = self.connection is not None
+        try:
+            return SupervisorTransport.request(self, host, handler,
+                                               request_body, verbose)
+        except (socket.error, httplib.HTTPException):
+            self.close()
+            raise
+
+    def record(self, request_body, elapsed):
+        if self.stats is None:
+            return
+        match = METHODNAME.search(request_body)
+        if match is None:
+            method = '?'
+        else:
+            method = match.group(1)
+        self.stats.timing('rpc', elapsed * 1000, [('method', method)])
+
+def getRPCInterface(env, stats=None):
+    """ Like supervisor.childutils.getRPCInterface, with a
+    KeepAliveTransport reporting to ``stats`` (a StatsD client, or None) """
+    transport = KeepAliveTransport(env.get('SUPERVISOR_USERNAME', ''),
+                                   env.get('SUPERVISOR_PASSWORD', ''),
+                                   env['SUPERVISOR_SERVER_URL'], stats=stats)
+    return xmlrpclib.ServerProxy('http://127.0.0.1', transport)
@@ -0,0 +1,71 @@
+##############################################################################
+#
+# Copyright (c) 2007 Agendaless Consulting and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the BSD-like license at
+# http://www.repoze.org/LICENSE.txt.  A copy of the license should accompany
+# this distribution.  THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL
+# EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND
+# FITNESS FOR A PARTICULAR PURPOSE
+#
+##############################################################################
+doc = """\
+URL templates for httpok, expanded once for each process of a program
+with numprocs > 1, e.g.
+
+  http://127.0.0.1:{8000+process_num}/health
+
+A field in braces is one of ``process_num``, ``name`` (the process name)
+and ``group`` (its group name); ``process_num`` may have a number added
+to or subtracted from it.  getAllProcessInfo() doesn't give the
+process_num of a process, so it is taken from the trailing digits of its
+name, as supervisor's usual ``process_name=%(program_name)s_%(process_num)02d``
+puts it there; a name without them is process_num 0.
+"""
+
+import re
+
+FIELD = re.compile(r'\{([^{}]*)\}')
+EXPRESSION = re.compile(r'^(?:(\d+)\s*\+\s*)?(process_num|name|group)'
+                        r'(?:\s*([+-])\s*(\d+))?$')
+TRAILING_DIGITS = re.compile(r'(\d+)$')
+
+def is_template(url):
+    return FIELD.search(url) is not None
+
+def process_num(name):
+    match = TRAILING_DIGITS.search(name)
+    if match is None:
+        return 0
+    return int(match.group(1))
+
+def field(text, spec):
+    """ The value of one field (without its braces) for the process
+    ``spec`` """
+    match = EXPRESSION.match(text.strip())
+    if match is None:
+        raise ValueError('Bad URL template field {%s}' % text)
+    before, variable, sign, after = match.groups()
+    if variable != 'process_num':
+        if before or sign:
+            raise ValueError('Bad URL template field {%s}: only process_num '
+                             'can be added to' % text)
+        return spec[variable]
+    value = process_num(spec['name'])
+    if before:
+        value += int(before)
+    if sign == '+':
+        value += int(after)
+    elif sign == '-':
+        value -= int(after)
+    return str(value)
+
+def expand(template, spec):
+    """ The URL of the process ``spec`` (a getAllProcessInfo() dict) """
+    return FIELD.sub(lambda match: field(match.group(1), spec), template)
+
+def check(template):
+    """ Raise ValueError if ``template`` has a bad field """
+    expand(template, {'name': 'x_0', 'group': 'x'})